@@ -0,0 +1,76 @@
+import contextlib
+import contextvars
+import re
+
+from .settings import env
+
+DEFAULT_ACCOUNT = "default"
+
+# The Brevo account the current request, CSV run or worker thread acts for.
+# Thread pools started with contextvars.copy_context() (and asyncio.to_thread)
+# carry it along, so code below the entry point never passes it around.
+_current_account = contextvars.ContextVar("brevo_account", default=DEFAULT_ACCOUNT)
+
+# Settings an extra account never takes from the default account: sharing
+# its key or CSV directory would act on the wrong brand, sharing its state
+# files would mix two brands' contacts.
+_NOT_INHERITED = {
+    "BREVO_API_KEY",
+    "SENDER_NAME",
+    "SENDER_EMAIL",
+    "CSV_BASE_PATH",
+    "CONTACT_SNAPSHOT_PATH",
+    "CSV_WATCH_STATE_FILE",
+    "BREVO_WEBHOOK_TOKEN",
+}
+
+
+class UnknownAccount(ValueError):
+    pass
+
+
+def account_names() -> list[str]:
+    # BREVO_ACCOUNTS=brand_a,brand_b adds accounts next to the default one,
+    # each configured with suffixed variables (BREVO_API_KEY_BRAND_A, ...).
+    extra = [name.strip() for name in env("BREVO_ACCOUNTS", "").split(",")]
+    return [DEFAULT_ACCOUNT] + [
+        name for name in extra if name and name != DEFAULT_ACCOUNT
+    ]
+
+
+def validate_account(account: str | None) -> str:
+    account = account or DEFAULT_ACCOUNT
+    if account not in account_names():
+        raise UnknownAccount(f"Unknown Brevo account: {account}")
+    return account
+
+
+def current_account() -> str:
+    return _current_account.get()
+
+
+@contextlib.contextmanager
+def use_account(account: str | None):
+    token = _current_account.set(validate_account(account))
+    try:
+        yield
+    finally:
+        _current_account.reset(token)
+
+
+def _suffix(account: str) -> str:
+    return re.sub(r"\W", "_", account).upper()
+
+
+def account_env(
+    name: str, default: str | None = None, account: str | None = None
+) -> str | None:
+    account = account or current_account()
+    if account == DEFAULT_ACCOUNT:
+        return env(name, default)
+    value = env(f"{name}_{_suffix(account)}")
+    if value is not None:
+        return value
+    if name in _NOT_INHERITED:
+        return default
+    return env(name, default)
@@ -0,0 +1,156 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+from .brevo_service import (
+    _fetch_existing_contacts,
+    extract_email,
+    handle_csv_rows,
+    merge_tender_codes,
+    upsert_workers,
+)
+from .csv_source import open_csv_rows
+from .results_store import new_run_id
+from .settings import env
+
+
+def parse_workers() -> int:
+    return int(env("BACKFILL_PARSE_WORKERS", str(os.cpu_count() or 2)))
+
+
+def _parse_csv_file(path: str) -> dict:
+    rows = {}
+    total_rows = 0
+    skipped = 0
+    with open_csv_rows(path) as reader:
+        for row in reader:
+            total_rows += 1
+            email = extract_email(row)
+            if not email:
+                skipped += 1
+                continue
+            rows[email] = row
+
+    return {"path": path, "rows": rows, "total_rows": total_rows, "skipped": skipped}
+
+
+def backfill_csv_files(csv_files: list[Path], list_name: str = "backfill") -> dict:
+    if not csv_files:
+        return {"files": [], "unique_contacts": 0, "results": None}
+
+    logging.info(f"Backfilling {len(csv_files)} CSV files with one shared run")
+
+    # The snapshot download and the file parsing do not depend on each other,
+    # so the contacts are fetched while worker processes parse the files.
+    with ProcessPoolExecutor(max_workers=min(parse_workers(), len(csv_files))) as pool:
+        parse_futures = [pool.submit(_parse_csv_file, str(p)) for p in csv_files]
+        snapshot = _fetch_existing_contacts()
+        parsed_files = [future.result() for future in parse_futures]
+
+    existing_emails, _ = snapshot
+    merged_rows = {}
+    file_reports = []
+
+    # Files are given oldest first; a later export overrides earlier rows
+    # for the same email while keeping every tender code seen in the range.
+    for parsed in parsed_files:
+        emails = parsed["rows"].keys()
+        overlap = sum(1 for email in emails if email in merged_rows)
+        new_contacts = sum(1 for email in emails if email not in existing_emails)
+
+        for email, row in parsed["rows"].items():
+            previous = merged_rows.get(email)
+            if previous is not None:
+                row = dict(row)
+                row["CATEGORY"] = merge_tender_codes(
+                    row.get("CATEGORY", ""), previous.get("CATEGORY", "")
+                )
+            merged_rows[email] = row
+
+        file_reports.append(
+            {
+                "file": parsed["path"],
+                "total_rows": parsed["total_rows"],
+                "valid_rows": len(parsed["rows"]),
+                "skipped_rows": parsed["skipped"],
+                "new_contacts": new_contacts,
+                "existing_contacts": len(parsed["rows"]) - new_contacts,
+                "overlap_with_earlier_files": overlap,
+            }
+        )
+
+    logging.info(
+        f"Backfill parsed {sum(r['total_rows'] for r in file_reports)} rows into "
+        f"{len(merged_rows)} unique contacts; starting upserts with {upsert_workers()} workers"
+    )
+
+    results = handle_csv_rows(
+        merged_rows.values(), list_name=list_name, snapshot=snapshot
+    )
+
+    return {
+        "files": file_reports,
+        "unique_contacts": len(merged_rows),
+        "results": results,
+    }
+
+
+# Backfills requested over the API run here, one at a time per process, in
+# the order they were asked for; the request only gets the job id back.
+MAX_KEPT_JOBS = 50
+_jobs = {}
+_jobs_lock = threading.Lock()
+_job_runner = ThreadPoolExecutor(max_workers=1, thread_name_prefix="backfill")
+
+
+def _run_job(job_id: str, service, start_date: str, end_date: str, force: bool):
+    job = _jobs[job_id]
+    job["status"] = "running"
+    job["started_at"] = time.time()
+    try:
+        job["report"] = service.backfill_csv_range(start_date, end_date, force=force)
+        job["status"] = "done"
+    except Exception as e:
+        logging.error(f"Backfill job {job_id} failed: {str(e)}")
+        job["status"] = "failed"
+        job["error"] = str(e)
+    job["finished_at"] = time.time()
+
+
+def submit_backfill(service, start_date: str, end_date: str, force: bool) -> dict:
+    job_id = new_run_id()
+    job = {
+        "job_id": job_id,
+        "account": service.account,
+        "start_date": start_date,
+        "end_date": end_date,
+        "force": force,
+        "status": "queued",
+        "queued_at": time.time(),
+    }
+    with _jobs_lock:
+        _jobs[job_id] = job
+        queued = dict(job)
+        for old_id in list(_jobs)[:-MAX_KEPT_JOBS]:
+            if _jobs[old_id]["status"] in ("done", "failed"):
+                del _jobs[old_id]
+    _job_runner.submit(
+        contextvars.copy_context().run,
+        _run_job,
+        job_id,
+        service,
+        start_date,
+        end_date,
+        force,
+    )
+    return queued
+
+
+def backfill_job(job_id: str) -> dict | None:
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job else None
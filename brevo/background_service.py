@@ -3,48 +3,84 @@
 import time
 import logging
 import schedule
-import os
 import platform
+import threading
 from datetime import datetime, timedelta
 from pathlib import Path
-from brevo_service import get_existing_contacts_email, handle_csv
+from .accounts import (
+    DEFAULT_ACCOUNT,
+    account_env,
+    account_names,
+    use_account,
+    validate_account,
+)
+from .brevo_service import (
+    check_account,
+    circuit_state,
+    drain_retry_queue,
+    handle_csv_file,
+)
+from .contact_cache import load_snapshot
+from .metrics import start_metrics_server, timed_task
+from .logging_config import configure_logging
+from .log_rotation import rotate_external_log
+from .stage_timer import format_timings
+from .csv_watcher import CsvFileWatcher, ProcessedFileRegistry
+from .settings import env, load_env
 
 log_file = Path("brevo_service.log")
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-    handlers=[logging.FileHandler(log_file, encoding="utf-8"), logging.StreamHandler()],
-)
+STDOUT_LOG_FILES = [Path("api_service.log"), Path("background_service.log")]
 
 logger = logging.getLogger(__name__)
 
 
+def _in_thread(name: str, func):
+    # Lets one account's scheduled CSV run go ahead while another's is busy.
+    def start():
+        threading.Thread(target=func, name=name, daemon=True).start()
+
+    return start
+
+
 class BrevoBackgroundService:
-    def __init__(self):
+    def __init__(self, account: str | None = None):
         self.running = False
         self.start_time = datetime.now()
         self.platform = platform.system()
-        logger.info(f"Brevo Background Service initialized on {self.platform}")
+        self.account = validate_account(account)
+        self.peers = []
+        logger.info(
+            f"Brevo Background Service initialized on {self.platform} "
+            f"for account {self.account}"
+        )
+
+        # Each account reads its own suffixed settings (CSV_BASE_PATH_BRAND_A).
+        def setting(name, default=None):
+            return account_env(name, default, account=self.account)
 
-        self.csv_base_path = os.getenv("CSV_BASE_PATH", "")
-        self.csv_filename_pattern = os.getenv(
+        self.csv_base_path = setting("CSV_BASE_PATH", "")
+        self.csv_filename_pattern = setting(
             "CSV_FILENAME_PATTERN", "applications_{date}_past_1days"
         )
-        self.csv_file_extension = os.getenv("CSV_FILE_EXTENSION", ".csv")
+        self.csv_file_extension = setting("CSV_FILE_EXTENSION", ".csv")
+        state_file = (
+            "processed_csv_files.db"
+            if self.account == DEFAULT_ACCOUNT
+            else f"processed_csv_files.{self.account}.db"
+        )
+        self.processed_files = ProcessedFileRegistry(
+            Path(setting("CSV_WATCH_STATE_FILE", state_file)),
+            claim_timeout=float(setting("CSV_CLAIM_TIMEOUT_HOURS", "6")) * 3600,
+        )
+        self._processing_lock = threading.Lock()
+        self._retry_lock = threading.Lock()
+        self.retry_drain_seconds = int(setting("RETRY_DRAIN_SECONDS", "60"))
+        self.watcher = None
 
         if not self.csv_base_path:
             logger.error("CSV_BASE_PATH is required! Please set it in your .env file.")
             raise ValueError("CSV_BASE_PATH environment variable is required")
 
-        self._setup_directories()
-        if not self._validate_path():
-            logger.warning(
-                "Required CSV path or expected file format is invalid. Continuing service and will retry later."
-            )
-
-        self._log_configuration()
-
     def _validate_path(self) -> bool:
         base_path = Path(self.csv_base_path)
 
@@ -84,7 +120,7 @@ class BrevoBackgroundService:
                 logger.info(f"Created directory: {logs_dir}")
 
     def _log_configuration(self):
-        logger.info("Dynamic CSV Path Configuration:")
+        logger.info(f"Dynamic CSV Path Configuration ({self.account}):")
         logger.info(f"  - Base Path: {self.csv_base_path}")
         logger.info(f"  - Filename Pattern: {self.csv_filename_pattern}")
         logger.info(f"  - File Extension: {self.csv_file_extension}")
@@ -160,13 +196,31 @@ class BrevoBackgroundService:
 
     def health_check(self):
         try:
-            api_key = os.getenv("BREVO_API_KEY")
+            api_key = account_env("BREVO_API_KEY", account=self.account)
             if not api_key:
-                logger.warning("BREVO_API_KEY not configured")
+                logger.warning(f"BREVO_API_KEY not configured for {self.account}")
                 return False
 
-            contacts = get_existing_contacts_email()
-            logger.info(f"Health check passed - {len(contacts)} contacts found")
+            with use_account(self.account):
+                state = circuit_state()
+                if state != "closed":
+                    logger.warning(
+                        f"Health check failed for {self.account} - Brevo circuit is {state}"
+                    )
+                    return False
+
+                # Reachability only; the contact count comes from the snapshot
+                # instead of paging through the whole account.
+                if not check_account():
+                    logger.warning(
+                        f"Health check failed for {self.account} - Brevo account check failed"
+                    )
+                    return False
+                snapshot = load_snapshot()
+            contacts = len(snapshot["emails"]) if snapshot else "unknown"
+            logger.info(
+                f"Health check passed for {self.account} - {contacts} contacts in snapshot"
+            )
             return True
 
         except Exception as e:
@@ -188,8 +242,17 @@ class BrevoBackgroundService:
                 )
                 return
 
+            if not self.processed_files.claim(csv_file):
+                logger.info(f"CSV file already processed, skipping: {csv_file}")
+                return
+
             logger.info(f"Processing CSV file: {csv_file}")
-            self._process_csv_file(csv_file)
+            try:
+                self._process_csv_file_exclusive(csv_file)
+            except Exception:
+                self.processed_files.finish(csv_file, "failed")
+                raise
+            self.processed_files.finish(csv_file, "done")
 
             logger.info("Daily CSV processing completed")
 
@@ -208,7 +271,7 @@ class BrevoBackgroundService:
                 return
 
             logger.info(f"Processing CSV file: {csv_file}")
-            self._process_csv_file(csv_file)
+            self._process_csv_file_exclusive(csv_file)
 
             logger.info(f"Manual CSV processing completed for {date_str}")
 
@@ -217,31 +280,118 @@ class BrevoBackgroundService:
         except Exception as e:
             logger.error(f"Error during manual CSV processing for {date_str}: {str(e)}")
 
-    def _process_csv_file(self, csv_file: Path):
+    def backfill_csv_range(
+        self, start_date_str: str, end_date_str: str, force: bool = False
+    ) -> dict:
+        start_date = datetime.strptime(start_date_str, "%Y-%m-%d")
+        end_date = datetime.strptime(end_date_str, "%Y-%m-%d")
+        if end_date < start_date:
+            raise ValueError("end date must not be before start date")
+
+        csv_files = []
+        missing_dates = []
+        already_processed = []
+
+        current = start_date
+        while current <= end_date:
+            csv_path = self._generate_csv_path(current)
+            date_str = current.strftime("%Y-%m-%d")
+            if not csv_path.exists():
+                missing_dates.append(date_str)
+            elif self.processed_files.claim(csv_path) or force:
+                csv_files.append(csv_path)
+            else:
+                already_processed.append(date_str)
+            current += timedelta(days=1)
+
+        logger.info(
+            f"Backfill {start_date_str}..{end_date_str}: {len(csv_files)} files to process, "
+            f"{len(missing_dates)} missing, {len(already_processed)} already processed"
+        )
+
+        from .backfill import backfill_csv_files
+
+        status = "failed"
         try:
-            logger.info(f"Processing CSV file: {csv_file.name}")
+            with self._processing_lock, use_account(self.account):
+                report = backfill_csv_files(
+                    csv_files, list_name=f"backfill {start_date_str}..{end_date_str}"
+                )
+            if not (report.get("results") or {}).get("errors"):
+                status = "done"
+        finally:
+            for csv_path in csv_files:
+                self.processed_files.finish(csv_path, status)
+
+        report["missing_dates"] = missing_dates
+        report["already_processed_dates"] = already_processed
+
+        results = report.get("results") or {}
+        logger.info(
+            f"Backfill completed: {report['unique_contacts']} unique contacts, "
+            f"{results.get('counts', {}).get('added', 0)} added, "
+            f"{results.get('counts', {}).get('updated', 0)} updated, "
+            f"{results.get('counts', {}).get('failed', 0)} failed, "
+            f"{len(results.get('errors', []))} run errors"
+        )
+        for line in format_timings(results.get("timings", {})):
+            logger.info(f"  - {line}")
 
-            with open(csv_file, "rb") as f:
-                csv_content = f.read()
+        return report
 
-            results = handle_csv(csv_content)
+    def _process_csv_file_exclusive(self, csv_file: Path):
+        with self._processing_lock, use_account(self.account):
+            self._process_csv_file(csv_file)
 
-            total_processed = len(results.get("added_contacts", [])) + len(
-                results.get("info_sent", [])
-            )
-            total_errors = len(results.get("errors", []))
+    def _start_watcher(self):
+        if env("CSV_WATCH_ENABLED", "true").lower() in ("0", "false", "no"):
+            logger.info("CSV directory watcher disabled (CSV_WATCH_ENABLED)")
+            return
+
+        self.watcher = CsvFileWatcher(
+            Path(self.csv_base_path),
+            self.csv_filename_pattern,
+            self.csv_file_extension,
+            self.processed_files,
+            on_ready=self._process_csv_file_exclusive,
+            stable_seconds=float(env("CSV_WATCH_STABLE_SECONDS", "10")),
+            max_age_days=int(env("CSV_WATCH_MAX_AGE_DAYS", "0")),
+            rescan_seconds=float(env("CSV_WATCH_RESCAN_SECONDS", "900")),
+        )
+        if not self.watcher.start():
+            self.watcher = None
+
+    def _process_csv_file(self, csv_file: Path):
+        try:
+            logger.info(f"Processing CSV file: {csv_file.name} ({self.account})")
+
+            results = handle_csv_file(csv_file)
+
+            counts = results.get("counts", {})
+            total_processed = counts.get("added", 0) + counts.get("updated", 0)
+            total_errors = counts.get("failed", 0)
 
             logger.info(f"CSV processing completed for {csv_file.name}:")
             logger.info(f"  - Successfully processed: {total_processed} contacts")
-            logger.info(
-                f"  - New contacts added: {len(results.get('added_contacts', []))}"
-            )
-            logger.info(f"  - Info emails sent: {len(results.get('info_sent', []))}")
+            logger.info(f"  - New contacts added: {counts.get('added', 0)}")
+            logger.info(f"  - Existing contacts updated: {counts.get('updated', 0)}")
             logger.info(f"  - Errors: {total_errors} contacts")
+            if counts.get("queued_for_retry"):
+                logger.info(
+                    f"  - Queued for retry: {counts['queued_for_retry']} contacts"
+                )
+            logger.info(f"  - Row results: {results.get('results_file')}")
+
+            for error in results.get("errors", []):
+                logger.error(f"  - Run error: {error.get('error')}")
+
+            logger.info("Stage timings:")
+            for line in format_timings(results.get("timings", {})):
+                logger.info(f"  - {line}")
 
             if total_errors > 0:
                 logger.warning(f"Some contacts failed to process in {csv_file.name}")
-                for error in results.get("errors", [])[:5]:  # Show first 5 errors
+                for error in results.get("sample_errors", []):  # First 5 errors
                     logger.warning(
                         f"  - {error.get('email', 'Unknown')}: {error.get('error', 'Unknown error')}"
                     )
@@ -251,36 +401,40 @@ class BrevoBackgroundService:
             else:
                 logger.info("No contacts were processed, skipping campaign creation")
 
+            # Setup failures (folder, list, campaign) come back as run errors
+            # rather than exceptions; the file must still count as failed so
+            # it is claimed and run again.
+            if results.get("errors"):
+                raise RuntimeError(
+                    "; ".join(error.get("error", "") for error in results["errors"])
+                )
+
             logger.info(f"File processed successfully: {csv_file}")
 
         except Exception as e:
             logger.error(f"Error processing CSV file {csv_file.name}: {str(e)}")
             raise
 
-    def cleanup_logs(self):
+    def drain_retries(self):
+        # A drain still working through a slow batch is left to finish.
+        if not self._retry_lock.acquire(blocking=False):
+            return
         try:
-            log_files = [
-                Path("brevo_service.log"),
-                Path("api_service.log"),
-                Path("background_service.log"),
-            ]
-
-            for log_file in log_files:
-                if log_file.exists():
-                    if log_file.stat().st_size > 10 * 1024 * 1024:  # 10MB
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        backup_name = f"{log_file.stem}_{timestamp}.log"
-
-                        if self.platform == "Windows" and Path("logs").exists():
-                            backup_path = Path("logs") / backup_name
-                        else:
-                            backup_path = Path(backup_name)
-
-                        log_file.rename(backup_path)
-                        logger.info(f"Log file rotated to {backup_path}")
+            with use_account(self.account):
+                drain_retry_queue()
+        finally:
+            self._retry_lock.release()
 
-        except Exception as e:
-            logger.error(f"Error during log cleanup: {str(e)}")
+    def cleanup_logs(self):
+        # brevo_service.log rotates itself; the stdout logs written by the run
+        # scripts are copied out and truncated here once they grow too large.
+        for log_file in STDOUT_LOG_FILES:
+            try:
+                segment = rotate_external_log(log_file)
+                if segment:
+                    logger.info(f"Log file {log_file} rotated to {segment}")
+            except Exception as e:
+                logger.error(f"Error rotating {log_file}: {str(e)}")
 
     def send_daily_report(self):
         try:
@@ -316,17 +470,65 @@ class BrevoBackgroundService:
             logger.info("Georgian time is 2:00 - running daily_csv_processing")
             self.daily_csv_processing()
 
+    def start_account(self):
+        # The per-account part of start(). Filesystem checks run here, not
+        # when the service is constructed (the API builds one per /backfill).
+        if not self._validate_path():
+            logger.warning(
+                "Required CSV path or expected file format is invalid. Continuing service and will retry later."
+            )
+        self._log_configuration()
+
+        schedule.every(5).minutes.do(timed_task("health_check", self.health_check))
+        # Schedule daily CSV processing at 2:00 AM
+        schedule.every().day.at("02:00").do(
+            _in_thread(
+                f"daily-csv-{self.account}",
+                timed_task("daily_csv_processing", self.daily_csv_processing),
+            )
+        )
+
+        if self.retry_drain_seconds > 0:
+            schedule.every(self.retry_drain_seconds).seconds.do(
+                _in_thread(
+                    f"retry-drain-{self.account}",
+                    timed_task("retry_drain", self.drain_retries),
+                )
+            )
+            logger.info(
+                f" - Retry queue ({self.account}): drained every "
+                f"{self.retry_drain_seconds}s"
+            )
+
+        self._start_watcher()
+        if self.watcher:
+            logger.info(
+                f" - CSV export watcher ({self.account}): processes new files once stable"
+            )
+
+        self.health_check()
+
     def start(self):
         self.running = True
         logger.info("Starting Brevo Background Service...")
 
+        self._setup_directories()
+
+        metrics_port = env("BACKGROUND_METRICS_PORT", "8011")
+        if metrics_port and metrics_port != "0":
+            try:
+                start_metrics_server(int(metrics_port))
+            except Exception as e:
+                logger.error(f"Could not start metrics endpoint: {str(e)}")
+
         # Schedule tasks
-        schedule.every(5).minutes.do(self.health_check)
-        schedule.every().hour.do(self.cleanup_logs)
-        schedule.every().day.at("09:00").do(self.send_daily_report)
+        schedule.every().hour.do(timed_task("cleanup_logs", self.cleanup_logs))
+        schedule.every().day.at("09:00").do(
+            timed_task("send_daily_report", self.send_daily_report)
+        )
 
-        # Schedule daily CSV processing at 2:00 AM
-        schedule.every().day.at("02:00").do(self.daily_csv_processing)
+        for service in [self] + self.peers:
+            service.start_account()
 
         logger.info("Background service started successfully")
         logger.info("Scheduled tasks:")
@@ -334,8 +536,7 @@ class BrevoBackgroundService:
         logger.info(" - Log cleanup: Every hour")
         logger.info(" - Daily report: 09:00 daily")
         logger.info(" - Daily CSV processing: 2:00 AM ")
-
-        self.health_check()
+        logger.info(f" - Accounts: {', '.join(s.account for s in [self] + self.peers)}")
 
         try:
             while self.running:
@@ -347,12 +548,30 @@ class BrevoBackgroundService:
 
     def stop(self):
         self.running = False
+        for service in [self] + self.peers:
+            if service.watcher:
+                service.watcher.stop()
         logger.info("Brevo Background Service stopped")
 
 
-def main():
+def _account_services(account: str | None = None) -> list:
+    # One service per account that has its own CSV directory; the default
+    # account's comes first and runs the shared schedule.
+    if account:
+        return [BrevoBackgroundService(account)]
+    services = [BrevoBackgroundService()]
+    for name in account_names()[1:]:
+        if account_env("CSV_BASE_PATH", account=name):
+            services.append(BrevoBackgroundService(name))
+        else:
+            logger.info(f"No CSV_BASE_PATH for account {name}, not watching it")
+    return services
+
+
+def main(account: str | None = None):
     try:
-        service = BrevoBackgroundService()
+        service, *peers = _account_services(account)
+        service.peers = peers
         service.start()
     except Exception as e:
         logger.error(f"Critical error in background service: {str(e)}")
@@ -361,9 +580,9 @@ def main():
     return 0
 
 
-def test_configuration():
+def test_configuration(account: str | None = None):
     try:
-        service = BrevoBackgroundService()
+        service = BrevoBackgroundService(account)
         service.test_dynamic_path_configuration()
     except Exception as e:
         logger.error(f"Configuration test failed: {str(e)}")
@@ -372,7 +591,32 @@ def test_configuration():
 if __name__ == "__main__":
     import sys
 
+    load_env()
+    configure_logging(log_file=log_file)
+
+    # --account NAME limits the service (or the command) to one Brevo account.
+    account = None
+    if "--account" in sys.argv:
+        position = sys.argv.index("--account")
+        if position + 1 >= len(sys.argv):
+            print("Usage: python -m brevo.background_service [--account NAME] ...")
+            exit(2)
+        account = sys.argv.pop(position + 1)
+        sys.argv.pop(position)
+
     if len(sys.argv) > 1 and sys.argv[1] == "test":
-        test_configuration()
+        test_configuration(account)
+    elif len(sys.argv) > 1 and sys.argv[1] == "backfill":
+        if len(sys.argv) < 4:
+            print(
+                "Usage: python -m brevo.background_service backfill START END [--force]"
+            )
+            exit(2)
+        report = BrevoBackgroundService(account).backfill_csv_range(
+            sys.argv[2], sys.argv[3], force="--force" in sys.argv[4:]
+        )
+        results = report.get("results") or {}
+        failed = results.get("errors") or results.get("counts", {}).get("failed")
+        exit(1 if failed else 0)
     else:
-        exit(main())
+        exit(main(account))
@@ -1,32 +1,53 @@
+import contextlib
 import csv
+import contextvars
+import functools
 import requests
+from urllib3.util.request import ACCEPT_ENCODING
 import logging
 import io
 import os
+import queue
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import time
 from pathlib import Path
-from dotenv import load_dotenv
-
-
-load_dotenv()
-
-SENDER_NAME = os.getenv("SENDER_NAME")
-SENDER_EMAIL = os.getenv("SENDER_EMAIL")
-
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
+from . import metrics
+from .logging_config import ROW_LOGGER_NAME
+from .stage_timer import StageTimer, profiled_run, record_api_call
+from .rate_limiter import RequestScheduler
+from .circuit_breaker import CircuitBreaker, CircuitOpen
+from .contact_cache import (
+    SYNC_LEASE,
+    acquire_lease,
+    cached_id,
+    fetched_at as contacts_fetched_at,
+    load_snapshot,
+    record_contact_changes,
+    release_lease,
+    remember_id,
+    save_snapshot,
 )
+from .csv_source import open_csv_rows, sniff_delimiter
+from .results_store import RunResults
+from .retry_queue import (
+    claim_due,
+    claim_run,
+    enqueue,
+    is_retryable,
+    record_failure,
+    record_success,
+    release,
+)
+from .row_fingerprints import open_fingerprint_store, row_fingerprint
+from .sms_index import SmsIndex
+from .singleflight import SingleFlight
+from .accounts import account_env, account_names, current_account, use_account
+from .json_codec import dumps as json_dumps, loads as json_loads, response_json
 
-API_KEY = os.getenv("BREVO_API_KEY")
-
-HEADERS = {
-    "api-key": API_KEY,
-    "accept": "application/json",
-    "content-type": "application/json",
-}
+row_logger = logging.getLogger(ROW_LOGGER_NAME)
 
 
 class MockResponse:
@@ -35,58 +56,148 @@ class MockResponse:
         self.text = text
 
 
-def get_existing_contacts_email():
-    all_contacts = set()
-    offset = 0
-    limit = 1000
+class _BrevoClient:
+    # One per Brevo account, shared by every call made for it, so concurrent
+    # upserts (CSV runs, backfills) reuse pooled connections and stay under
+    # that account's request rate. Accounts get separate pools, rate budgets
+    # and circuits, so one account's backlog or outage does not hold up another.
+    def __init__(self, account: str):
+        self.account = account
+        setting = functools.partial(account_env, account=account)
+        self.api_key = setting("BREVO_API_KEY")
+        self.sender = {"name": setting("SENDER_NAME"), "email": setting("SENDER_EMAIL")}
+        self.headers = {
+            "api-key": self.api_key,
+            "accept": "application/json",
+            "content-type": "application/json",
+            # gzip and deflate, plus br/zstd when brotli/zstandard are installed.
+            "accept-encoding": ACCEPT_ENCODING,
+        }
+        # Points at a local stand-in (brevo.brevo_stub) for load tests.
+        self.api_url = setting("BREVO_API_URL", "https://api.brevo.com/v3").rstrip("/")
+        self.upsert_workers = int(setting("BREVO_UPSERT_WORKERS", "4"))
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=4, pool_maxsize=max(10, self.upsert_workers * 2)
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Every call for the account queues here by priority class: requests
+        # a user waits on go ahead of CSV runs, syncs and health checks.
+        reserve = setting("BREVO_INTERACTIVE_RESERVE")
+        self.scheduler = RequestScheduler(
+            float(setting("BREVO_RATE_LIMIT", "10")),
+            interactive_share=float(setting("BREVO_INTERACTIVE_SHARE", "0.8")),
+            reserve=int(reserve) if reserve else None,
+            on_wait=lambda priority, waited: metrics.REQUEST_WAIT.observe(
+                waited, account, priority
+            ),
+            on_queue=lambda priority, depth: metrics.REQUEST_QUEUE_DEPTH.set(
+                depth, account, priority
+            ),
+        )
+        self.timeout = float(setting("BREVO_REQUEST_TIMEOUT", "30"))
+        # Opens after consecutive transport failures or 5xx responses so an
+        # outage costs one fast refusal per call instead of a socket timeout.
+        self.circuit = CircuitBreaker(
+            failure_threshold=int(setting("BREVO_CIRCUIT_FAILURES", "5")),
+            reset_timeout=float(setting("BREVO_CIRCUIT_RESET_SECONDS", "30")),
+            probe_timeout=self.timeout,
+            name=f"Brevo ({account})",
+        )
+        self.circuit.on_state_change = lambda state: metrics.CIRCUIT_STATE.set(
+            {"closed": 0, "open": 1, "half_open": 2}[state], account
+        )
 
-    logging.info("Starting to fetch all existing contacts...")
 
-    while True:
-        url = f"https://api.brevo.com/v3/contacts?limit={limit}&offset={offset}"
+# Configuration is read and the session built on first use, not at import.
+@functools.lru_cache(maxsize=None)
+def _account_client(account: str) -> _BrevoClient:
+    return _BrevoClient(account)
 
-        try:
-            response = requests.get(url, headers=HEADERS)
-            response.raise_for_status()
-            data = response.json()
 
-            contacts = data.get("contacts", [])
+def _client() -> _BrevoClient:
+    return _account_client(current_account())
 
-            if not contacts:
-                break
 
-            for contact in contacts:
-                email = contact.get("email")
-                if email:
-                    all_contacts.add(email.lower())
+def api_url(path: str) -> str:
+    return f"{_client().api_url}/{path}"
 
-            logging.info(
-                f"Fetched {len(contacts)} contacts (offset: {offset}). Total so far: {len(all_contacts)}"
-            )
 
-            if len(contacts) < limit:
-                break
+def upsert_workers() -> int:
+    return _client().upsert_workers
 
-            offset += limit
 
-            time.sleep(0.1)
+def circuit_state() -> str:
+    return _client().circuit.state
 
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Error fetching contacts at offset {offset}: {str(e)}")
-            break
-        except Exception as e:
-            logging.error(
-                f"Unexpected error fetching contacts at offset {offset}: {str(e)}"
-            )
-            break
 
-    logging.info(
-        f"Finished fetching contacts. Total: {len(all_contacts)} unique emails found"
+def scheduler_stats() -> dict:
+    return _client().scheduler.stats()
+
+
+def rate_limit() -> float:
+    return _client().scheduler.rate
+
+
+@contextlib.contextmanager
+def limited_rate(rate_per_second: float):
+    # Lowers the current account's request rate in this process for the
+    # duration, e.g. while it is one of several processes sharing the budget.
+    # Yields a setter for when the share changes; it never goes above the
+    # rate the process had before.
+    scheduler = _client().scheduler
+    ceiling = scheduler.rate
+    previous = scheduler.set_rate(min(rate_per_second, ceiling))
+    try:
+        yield lambda rate: scheduler.set_rate(min(rate, ceiling))
+    finally:
+        scheduler.set_rate(previous)
+
+
+def _brevo_request(method: str, url: str, **kwargs) -> requests.Response:
+    client = _client()
+    circuit = client.circuit
+    try:
+        circuit.before_call()
+    except CircuitOpen:
+        metrics.CIRCUIT_REJECTED.inc(client.account)
+        raise
+    client.scheduler.acquire()
+    kwargs.setdefault("timeout", client.timeout)
+    if "json" in kwargs:
+        kwargs["data"] = json_dumps(kwargs.pop("json"))
+    start = time.perf_counter()
+    try:
+        response = client.session.request(method, url, headers=client.headers, **kwargs)
+    except Exception:
+        circuit.record_failure()
+        metrics.observe_api_call(url, method, "error", time.perf_counter() - start)
+        record_api_call()
+        raise
+    if response.status_code >= 500:
+        circuit.record_failure()
+    else:
+        circuit.record_success()
+    metrics.observe_api_call(
+        url, method, response.status_code, time.perf_counter() - start
     )
-    return all_contacts
+    record_api_call(response)
+    return response
+
+
+# Concurrent callers (API requests, health checks, runs) share one in-flight
+# download of an account's contact base instead of each paging through it.
+_contact_fetches = SingleFlight()
 
 
 def get_detailed_contacts():
+    return _contact_fetches.do(
+        (current_account(), "detailed"), _download_detailed_contacts
+    )
+
+
+def _download_detailed_contacts():
     all_contacts = []
     offset = 0
     limit = 1000  # Maximum allowed by Brevo for contacts endpoint
@@ -94,52 +205,48 @@ def get_detailed_contacts():
     logging.info("Starting to fetch all detailed contacts...")
 
     while True:
-        url = f"https://api.brevo.com/v3/contacts?limit={limit}&offset={offset}"
+        url = api_url(f"contacts?limit={limit}&offset={offset}")
 
         try:
-            response = requests.get(url, headers=HEADERS)
+            response = _brevo_request("GET", url)
             response.raise_for_status()
-            data = response.json()
-
-            contacts = data.get("contacts", [])
+            data = response_json(response)
+        except Exception as e:
+            # Stopping here would pass off part of the contact base as all of
+            # it, and it would be stored over the last complete download.
+            logging.error(
+                f"Error fetching detailed contacts at offset {offset}: {str(e)}"
+            )
+            raise
 
-            if not contacts:
-                break
+        contacts = data.get("contacts", [])
 
-            for contact in contacts:
-                contact_info = {
-                    "id": contact.get("id"),
-                    "email": contact.get("email"),
-                    "emailBlacklisted": contact.get("emailBlacklisted", False),
-                    "smsBlacklisted": contact.get("smsBlacklisted", False),
-                    "createdAt": contact.get("createdAt"),
-                    "modifiedAt": contact.get("modifiedAt"),
-                    "listIds": contact.get("listIds", []),
-                    "attributes": contact.get("attributes", {}),
-                }
-                all_contacts.append(contact_info)
+        if not contacts:
+            break
 
-            logging.info(
-                f"Fetched {len(contacts)} detailed contacts (offset: {offset}). Total so far: {len(all_contacts)}"
-            )
+        for contact in contacts:
+            contact_info = {
+                "id": contact.get("id"),
+                "email": contact.get("email"),
+                "emailBlacklisted": contact.get("emailBlacklisted", False),
+                "smsBlacklisted": contact.get("smsBlacklisted", False),
+                "createdAt": contact.get("createdAt"),
+                "modifiedAt": contact.get("modifiedAt"),
+                "listIds": contact.get("listIds", []),
+                "attributes": contact.get("attributes", {}),
+            }
+            all_contacts.append(contact_info)
 
-            if len(contacts) < limit:
-                break
+        logging.info(
+            f"Fetched {len(contacts)} detailed contacts (offset: {offset}). Total so far: {len(all_contacts)}"
+        )
 
-            offset += limit
+        if len(contacts) < limit:
+            break
 
-            time.sleep(0.1)
+        offset += limit
 
-        except requests.exceptions.RequestException as e:
-            logging.error(
-                f"Error fetching detailed contacts at offset {offset}: {str(e)}"
-            )
-            break
-        except Exception as e:
-            logging.error(
-                f"Unexpected error fetching detailed contacts at offset {offset}: {str(e)}"
-            )
-            break
+        time.sleep(0.1)
 
     logging.info(
         f"Finished fetching detailed contacts. Total: {len(all_contacts)} contacts found"
@@ -148,15 +255,14 @@ def get_detailed_contacts():
 
 
 def add_contact(email: str, existing_contacts: set, list_ids=None, contact_data=None):
-    if not API_KEY:
+    if not _client().api_key:
         logging.error("BREVO_API_KEY is not configured in environment variables")
         return MockResponse(500, "BREVO_API_KEY not configured")
 
-    logging.info(f"users list: {len(existing_contacts)} contacts found")
     contact_exists = email in existing_contacts
     if contact_exists:
-        logging.info(
-            f"[-] {email} already exists. Will update with new data if provided."
+        row_logger.debug(
+            "[-] %s already exists. Will update with new data if provided.", email
         )
 
     payload = build_payload(email, list_ids, contact_data)
@@ -164,11 +270,23 @@ def add_contact(email: str, existing_contacts: set, list_ids=None, contact_data=
 
 
 def get_or_create_folder(name: str) -> int | None:
-    url = "https://api.brevo.com/v3/contacts/folders"
+    # Folder ids are kept in the shared contact store, so runs in every
+    # process skip the folder listing after the first lookup.
+    folder_id = cached_id("folder", name)
+    if folder_id:
+        return folder_id
+    folder_id = _find_or_create_folder(name)
+    if folder_id:
+        remember_id("folder", name, folder_id)
+    return folder_id
+
+
+def _find_or_create_folder(name: str) -> int | None:
+    url = api_url("contacts/folders")
     try:
-        response = requests.get(url, headers=HEADERS)
+        response = _brevo_request("GET", url)
         response.raise_for_status()
-        folders = response.json().get("folders", [])
+        folders = response_json(response).get("folders", [])
 
         for folder in folders:
             if folder.get("name") == name:
@@ -186,13 +304,13 @@ def get_or_create_folder(name: str) -> int | None:
 
 
 def create_folder(name: str) -> int | None:
-    url = "https://api.brevo.com/v3/contacts/folders"
+    url = api_url("contacts/folders")
     payload = {"name": name}
 
     try:
-        response = requests.post(url, json=payload, headers=HEADERS)
+        response = _brevo_request("POST", url, json=payload)
         if response.status_code in (201, 202):
-            folder_id = response.json().get("id")
+            folder_id = response_json(response).get("id")
             logging.info(f"Created new folder '{name}' with ID: {folder_id}")
             return folder_id
         else:
@@ -210,7 +328,7 @@ def create_new_contact_list(csv_name: str) -> int | None:
         logging.error("Failed to get or create folder for contact lists")
         return None
 
-    url = "https://api.brevo.com/v3/contacts/lists"
+    url = api_url("contacts/lists")
 
     now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
@@ -220,25 +338,46 @@ def create_new_contact_list(csv_name: str) -> int | None:
     }
 
     try:
-        response = requests.post(url, json=payload, headers=HEADERS)
+        response = _brevo_request("POST", url, json=payload)
         if response.status_code in (201, 202):
-            list_id = response.json().get("id")
+            list_id = response_json(response).get("id")
             logging.info(f"Created new contact list with ID: {list_id}")
             return list_id
         else:
             logging.error(f"Failed to create contact list: {response.text}")
+            # The cached folder may have been deleted; look it up next time.
+            remember_id("folder", "Winners", None)
             return None
     except Exception as e:
         logging.error(f"Exception creating contact list: {str(e)}")
         return None
 
 
+def add_contacts_to_list(list_id: int, emails: list[str]) -> set[str]:
+    # Adds existing contacts to a list without touching their attributes.
+    # Returns the emails Brevo did not add.
+    url = api_url(f"contacts/lists/{list_id}/contacts/add")
+    try:
+        response = _brevo_request("POST", url, json={"emails": emails})
+        if response.status_code in (200, 201):
+            contacts = response_json(response).get("contacts", {})
+            return {email.lower() for email in contacts.get("failure", [])}
+        logging.error(
+            f"Failed to add {len(emails)} contacts to list {list_id}: {response.text}"
+        )
+    except CircuitOpen:
+        raise
+    except Exception as e:
+        logging.error(f"Exception adding contacts to list {list_id}: {str(e)}")
+    return set(emails)
+
+
 def rename_folder(folder_id: int, new_name: str) -> bool:
-    url = f"https://api.brevo.com/v3/contacts/folders/{folder_id}"
+    url = api_url(f"contacts/folders/{folder_id}")
     payload = {"name": new_name}
 
     try:
-        response = requests.put(url, json=payload, headers=HEADERS)
+        response = _brevo_request("PUT", url, json=payload)
         if response.status_code in (200, 204):
             logging.info(f"Renamed folder {folder_id} to '{new_name}'")
             return True
@@ -259,10 +398,11 @@ def build_payload(email: str, list_ids, contact_data: dict | None) -> dict:
     attributes = build_attributes(contact_data)
     if attributes:
         payload["attributes"] = attributes
-        logging.info(f"Adding contact with attributes: {attributes}")
+        row_logger.debug("Adding contact %s with attributes: %s", email, attributes)
     else:
-        logging.info(
-            "No attributes to add - contact_data was empty or had no valid fields"
+        row_logger.debug(
+            "No attributes to add for %s - contact_data was empty or had no valid fields",
+            email,
         )
 
     if list_ids:
@@ -290,27 +430,63 @@ def build_attributes(contact_data: dict | None) -> dict:
     return attributes
 
 
+def merge_tender_codes(newer: str, older: str, limit: int | None = None) -> str:
+    # TENDER_CODE holds ";"-separated codes, newest first. A code already
+    # there moves to the front instead of repeating, and only the newest
+    # TENDER_CODE_MAX_CODES are kept (0 keeps all), so recurring winners do
+    # not grow the attribute run after run.
+    if limit is None:
+        limit = int(account_env("TENDER_CODE_MAX_CODES", "20"))
+    codes = dict.fromkeys(
+        code.strip()
+        for value in (newer, older)
+        for code in (value or "").split(";")
+        if code.strip()
+    )
+    merged = list(codes)
+    return ";".join(merged[:limit] if limit > 0 else merged)
+
+
 def send_contact_payload(email: str, payload: dict, contact_exists: bool):
-    url = "https://api.brevo.com/v3/contacts"
+    url = api_url("contacts")
 
     try:
-        response = requests.post(url, json=payload, headers=HEADERS)
-        logging.info(f"Brevo API response: {response.status_code} - {response.text}")
+        response = _brevo_request("POST", url, json=payload)
+        row_logger.debug(
+            "Brevo API response for %s: %s - %s",
+            email,
+            response.status_code,
+            response.text,
+        )
 
         if is_duplicate_sms_error(response):
             return retry_without_sms(email, payload)
 
+        if response.status_code >= 500 and circuit_state() != "closed":
+            raise CircuitOpen(f"Brevo returned {response.status_code} for {email}")
+
         if response.status_code not in (201, 204):
-            logging.warning(
-                f"Failed to add/update contact {email}: {response.status_code} {response.text}"
+            row_logger.warning(
+                "Failed to add/update contact %s: %s %s",
+                email,
+                response.status_code,
+                response.text,
             )
         else:
-            action = "Updated" if contact_exists else "Added"
-            logging.info(f"{action} contact {email} with additional data")
+            row_logger.debug(
+                "%s contact %s with additional data",
+                "Updated" if contact_exists else "Added",
+                email,
+            )
 
         return response
 
+    except CircuitOpen:
+        raise
     except Exception as e:
+        if circuit_state() != "closed":
+            # This failure tripped the breaker; let the caller retry the row.
+            raise CircuitOpen(str(e)) from e
         logging.error(
             f"Exception occurred while contacting Brevo API for {email}: {str(e)}"
         )
@@ -325,8 +501,9 @@ def is_duplicate_sms_error(response: requests.Response) -> bool:
 
 
 def retry_without_sms(email: str, payload: dict):
-    logging.warning(
-        f"SMS already exists for another contact. Retrying {email} without SMS field..."
+    row_logger.info(
+        "SMS already exists for another contact. Retrying %s without SMS field...",
+        email,
     )
 
     attributes = payload.get("attributes", {})
@@ -336,21 +513,27 @@ def retry_without_sms(email: str, payload: dict):
     }
 
     if payload_without_sms["attributes"]:
-        logging.info(f"Retrying with payload: {payload_without_sms}")
-        retry_response = requests.post(
-            "https://api.brevo.com/v3/contacts",
+        row_logger.debug("Retrying with payload: %s", payload_without_sms)
+        metrics.API_RETRIES.inc("duplicate_sms")
+        retry_response = _brevo_request(
+            "POST",
+            api_url("contacts"),
             json=payload_without_sms,
-            headers=HEADERS,
         )
-        logging.info(
-            f"Retry without SMS - Brevo API response: {retry_response.status_code} - {retry_response.text}"
+        row_logger.debug(
+            "Retry without SMS - Brevo API response: %s - %s",
+            retry_response.status_code,
+            retry_response.text,
         )
         return retry_response
     else:
-        logging.info(f"No other attributes to update for {email}, treating as success")
+        row_logger.debug(
+            "No other attributes to update for %s, treating as success", email
+        )
         return MockResponse(204, "No attributes to update after removing duplicate SMS")
 
 
+@functools.lru_cache(maxsize=None)
 def load_html_template(filename: str) -> str:
     base_dir = Path(__file__).resolve().parent
     file_path = base_dir / "template" / filename
@@ -362,7 +545,7 @@ def load_html_template(filename: str) -> str:
 
 
 def create_new_campaign(list_id: int) -> dict:
-    url = "https://api.brevo.com/v3/emailCampaigns"
+    url = api_url("emailCampaigns")
 
     html_content = load_html_template("message_template.html")
 
@@ -370,7 +553,7 @@ def create_new_campaign(list_id: int) -> dict:
     campaign_name = f"CSV Import Campaign - {timestamp}"
 
     payload = {
-        "sender": {"name": SENDER_NAME, "email": SENDER_EMAIL},
+        "sender": _client().sender,
         "name": campaign_name,
         "subject": "დოკუმენტაციის თარგმნა ნოტარიულად დამოწმებით",
         "htmlContent": html_content,
@@ -378,10 +561,10 @@ def create_new_campaign(list_id: int) -> dict:
     }
 
     try:
-        response = requests.post(url, json=payload, headers=HEADERS)
+        response = _brevo_request("POST", url, json=payload)
 
         if response.status_code in (201, 202):
-            campaign_data = response.json()
+            campaign_data = response_json(response)
             logging.info(
                 f"Campaign '{campaign_name}' created successfully with ID: {campaign_data.get('id')}"
             )
@@ -406,10 +589,10 @@ def create_new_campaign(list_id: int) -> dict:
 
 
 def send_campaign_to_contacts(campaign_id: int) -> dict:
-    url = f"https://api.brevo.com/v3/emailCampaigns/{campaign_id}/sendNow"
+    url = api_url(f"emailCampaigns/{campaign_id}/sendNow")
 
     try:
-        response = requests.post(url, headers=HEADERS)
+        response = _brevo_request("POST", url)
 
         if response.status_code in (200, 202, 204):
             logging.info(f"Campaign {campaign_id} sent successfully")
@@ -434,12 +617,31 @@ def send_campaign_to_contacts(campaign_id: int) -> dict:
         return {"success": False, "error": f"Exception: {str(e)}", "status_code": None}
 
 
+def send_run_campaign(campaign_id: int, run_id: str) -> dict:
+    # A run's campaign that Brevo failed to send is queued for another try;
+    # its contacts are already in the list.
+    send_result = send_campaign_to_contacts(campaign_id)
+    if not send_result["success"]:
+        try:
+            send_result["retry"] = enqueue(
+                "campaign_send",
+                "",
+                {"campaign_id": campaign_id},
+                send_result["error"],
+                send_result["status_code"],
+                run_id=run_id,
+            )
+        except Exception as e:
+            logging.error(f"Failed to queue campaign {campaign_id} send: {str(e)}")
+    return send_result
+
+
 def send_info_email(email: str):
-    if not SENDER_EMAIL:
+    if not _client().sender["email"]:
         logging.error("SENDER_EMAIL not configured in environment variables")
         raise ValueError("SENDER_EMAIL is required for sending emails")
 
-    url = "https://api.brevo.com/v3/smtp/email"
+    url = api_url("smtp/email")
 
     html_content = load_html_template("message_template.html")
 
@@ -447,16 +649,16 @@ def send_info_email(email: str):
         "to": [{"email": email}],
         "subject": "დოკუმენტაციის თარგმნა ნოტარიულად დამოწმებით",
         "htmlContent": f"{html_content}",
-        "sender": {"name": SENDER_NAME, "email": SENDER_EMAIL},
+        "sender": _client().sender,
     }
 
-    resp: requests.Response = requests.post(url, json=payload, headers=HEADERS)
+    resp: requests.Response = _brevo_request("POST", url, json=payload)
     if resp.status_code not in (200, 201):
         logging.warning(
             f"Failed to send email to {email}: {resp.status_code} {resp.text}"
         )
         try:
-            error_details = resp.json()
+            error_details = response_json(resp)
             logging.error(f"Brevo API error details: {error_details}")
         except:
             logging.error(f"Raw error response: {resp.text}")
@@ -466,12 +668,12 @@ def send_info_email(email: str):
 
 
 def get_campaign_details(campaign_id: int) -> dict:
-    url = f"https://api.brevo.com/v3/emailCampaigns/{campaign_id}"
+    url = api_url(f"emailCampaigns/{campaign_id}")
 
     try:
-        response = requests.get(url, headers=HEADERS)
+        response = _brevo_request("GET", url)
         if response.status_code == 200:
-            campaign_data = response.json()
+            campaign_data = response_json(response)
             logging.info(f"Campaign {campaign_id} details: {campaign_data}")
             return campaign_data
         else:
@@ -508,12 +710,12 @@ def process_contact(
     email: str,
     contact_data: dict,
     existing_emails: set,
-    results: dict,
+    results: RunResults,
     campaign_list_id: int,
     detailed_contacts_by_email: dict,
-):
+) -> bool:
     if email in existing_emails:
-        update_existing_contact(
+        return update_existing_contact(
             email,
             campaign_list_id,
             contact_data,
@@ -522,18 +724,18 @@ def process_contact(
             detailed_contacts_by_email,
         )
     else:
-        create_new_contact_for_campaign(
+        return create_new_contact_for_campaign(
             email, contact_data, existing_emails, results, campaign_list_id
         )
 
 
 def check_contact_status(email: str):
-    url = f"https://api.brevo.com/v3/contacts/{email}"
+    url = api_url(f"contacts/{email}")
 
     try:
-        response = requests.get(url, headers=HEADERS)
+        response = _brevo_request("GET", url)
         if response.status_code == 200:
-            contact_data = response.json()
+            contact_data = response_json(response)
             logging.info(f"Contact {email} status:")
             logging.info(
                 f"  - Email Blacklisted: {contact_data.get('emailBlacklisted', False)}"
@@ -553,109 +755,439 @@ def check_contact_status(email: str):
         return None
 
 
+def _merged_contact_data(email: str, contact_data: dict, existing) -> dict:
+    old_code = ((existing or {}).get("attributes") or {}).get("TENDER_CODE", "")
+    new_code = contact_data.get("tender_code", "")
+    if not (new_code and old_code):
+        return contact_data
+    merged = dict(contact_data, tender_code=merge_tender_codes(new_code, old_code))
+    row_logger.debug("Updated tender_code for %s: %s", email, merged["tender_code"])
+    return merged
+
+
 def update_existing_contact(
     email: str,
     campaign_list_id: int,
     contact_data: dict,
-    results: dict,
+    results: RunResults,
     existing_emails: set,
     detailed_contacts_by_email: dict,
-):
+) -> bool:
     existing = detailed_contacts_by_email.get(email)
 
     if existing:
         if existing.get("emailBlacklisted", False):
-            logging.warning(
-                f"Contact {email} is EMAIL BLACKLISTED - will not receive emails!"
+            row_logger.warning(
+                "Contact %s is EMAIL BLACKLISTED - will not receive emails!", email
             )
         if existing.get("smsBlacklisted", False):
-            logging.warning(f"Contact {email} is SMS BLACKLISTED")
+            row_logger.warning("Contact %s is SMS BLACKLISTED", email)
 
-        old_code = existing.get("attributes", {}).get("TENDER_CODE", "")
-        new_code = contact_data.get("tender_code", "")
-        if new_code and old_code and new_code != old_code:
-            contact_data["tender_code"] = f"{new_code};{old_code}"
-            logging.info(
-                f"Updated tender_code for {email}: {contact_data['tender_code']}"
-            )
-
-    if existing:
-        old_code = existing.get("attributes", {}).get("TENDER_CODE", "")
-        new_code = contact_data.get("tender_code", "")
-        if new_code and old_code and new_code != old_code:
-            contact_data["tender_code"] = f"{new_code};{old_code}"
-            logging.info(
-                f"Updated tender_code for {email}: {contact_data['tender_code']}"
-            )
+    # The row as read stays as it is: a failed upsert is queued unmerged and
+    # merged again with whatever Brevo holds when it is retried.
+    upsert_data = _merged_contact_data(email, contact_data, existing)
 
     resp = add_contact(
-        email, existing_emails, list_ids=[campaign_list_id], contact_data=contact_data
+        email, existing_emails, list_ids=[campaign_list_id], contact_data=upsert_data
     )
 
     if resp and resp.status_code in (201, 204):
-        results["updated_contacts"].append({"email": email, "data": contact_data})
-        logging.info(
-            f"Existing contact {email} updated and added to campaign list {campaign_list_id}"
-        )
-    else:
-        results["errors"].append(
-            {
-                "email": email,
-                "error": f"Failed to update contact: {resp.text if resp else 'No response'}",
-            }
+        results.updated(email, upsert_data)
+        row_logger.debug(
+            "Existing contact %s updated and added to campaign list %s",
+            email,
+            campaign_list_id,
         )
+        return True
+    results.error(
+        email,
+        f"Failed to update contact: {resp.text if resp else 'No response'}",
+        retry=_queue_failed_upsert(
+            email, contact_data, campaign_list_id, resp, results
+        ),
+    )
+    return False
 
 
 def create_new_contact_for_campaign(
     email: str,
     contact_data: dict,
     existing_emails: set,
-    results: dict,
+    results: RunResults,
     campaign_list_id: int,
-):
+) -> bool:
     resp = add_contact(
         email, existing_emails, list_ids=[campaign_list_id], contact_data=contact_data
     )
     if resp and resp.status_code in (201, 204):
         action = "updated" if resp.status_code == 204 else "created"
-        results["added_to_campaign"].append(
-            {"email": email, "data": contact_data, "action": action}
-        )
+        results.added(email, contact_data, action)
         existing_emails.add(email)
-        logging.info(
-            f"New contact {email} {action} and added to campaign list {campaign_list_id}"
+        row_logger.debug(
+            "New contact %s %s and added to campaign list %s",
+            email,
+            action,
+            campaign_list_id,
         )
-    else:
-        results["errors"].append(
-            {"email": email, "error": (resp.text if resp else "No response")}
+        return True
+    results.error(
+        email,
+        resp.text if resp else "No response",
+        retry=_queue_failed_upsert(
+            email, contact_data, campaign_list_id, resp, results
+        ),
+    )
+    return False
+
+
+def _queue_failed_upsert(
+    email: str,
+    contact_data: dict,
+    campaign_list_id: int,
+    resp,
+    results: RunResults,
+    error: str | None = None,
+) -> str | None:
+    # Transient failures heal from the retry queue instead of another run of
+    # the whole file; the rest go straight to the dead letters.
+    status = resp.status_code if resp is not None else None
+    if error is None:
+        error = resp.text if resp is not None else "No response"
+    try:
+        return enqueue(
+            "upsert",
+            email,
+            {"contact_data": contact_data, "list_ids": [campaign_list_id]},
+            error,
+            status,
+            run_id=results.run_id,
         )
+    except Exception as e:
+        logging.error(f"Failed to queue retry for {email}: {str(e)}")
+        return None
 
 
 def _get_csv_reader(file_bytes: bytes):
-    decoded = file_bytes.decode("utf-8")
-    return csv.DictReader(io.StringIO(decoded))
+    decoded = file_bytes.decode("utf-8-sig")
+    return csv.DictReader(io.StringIO(decoded), delimiter=sniff_delimiter(decoded))
+
+
+SYNC_LEASE_SECONDS = 600
+SYNC_POLL_SECONDS = 0.5
+_background_syncs = set()
+_background_syncs_lock = threading.Lock()
+
+
+def sync_contacts(wait: bool = True):
+    # Downloads the account's contacts into the shared store. Of all the
+    # processes wanting a download (uvicorn workers, the background service),
+    # the one holding the sync lease does it and the others wait for it to
+    # land, or with wait=False give up. Returns the contacts when this process
+    # downloaded them, None otherwise.
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    seen = contacts_fetched_at()
+    while not acquire_lease(SYNC_LEASE, owner, SYNC_LEASE_SECONDS):
+        if not wait:
+            return None
+        time.sleep(SYNC_POLL_SECONDS)
+        if contacts_fetched_at() != seen:
+            return None
+    try:
+        return _download_contacts()
+    finally:
+        release_lease(SYNC_LEASE, owner)
+
+
+def _sync_in_background(account: str):
+    # One refresh per account and process at a time.
+    with _background_syncs_lock:
+        if account in _background_syncs:
+            return
+        _background_syncs.add(account)
+
+    def run():
+        try:
+            with use_account(account):
+                sync_contacts(wait=False)
+        except Exception as e:
+            logging.warning(f"Background contact sync failed for {account}: {e}")
+        finally:
+            with _background_syncs_lock:
+                _background_syncs.discard(account)
+
+    threading.Thread(target=run, name="contact-sync", daemon=True).start()
+
+
+def current_contacts() -> dict:
+    # Contacts for API reads (/users, /add_contact) from the shared store.
+    # Past CONTACT_SYNC_SECONDS the store is still served while a refresh
+    # runs in the background; only an empty store makes the caller wait.
+    max_age = float(account_env("CONTACT_SYNC_SECONDS", "300"))
+    snapshot = load_snapshot()
+    if snapshot is not None:
+        if time.time() - snapshot["fetched_at"] >= max_age:
+            _sync_in_background(current_account())
+        return snapshot
+    try:
+        downloaded = sync_contacts()
+    except Exception as e:
+        logging.warning(f"Contact download failed, nothing stored yet: {str(e)}")
+        downloaded = None
+    snapshot = load_snapshot()
+    if snapshot is None:
+        # Nothing stored: an empty account, a failed download, or the store
+        # could not be written.
+        emails, detailed = downloaded or (set(), {})
+        return {"emails": emails, "detailed": detailed, "fetched_at": None}
+    return snapshot
 
 
 def _fetch_existing_contacts():
+    downloaded = sync_contacts()
+    if downloaded is not None:
+        return downloaded
+    # Another process just downloaded them.
+    snapshot = load_snapshot()
+    if snapshot is None:
+        return _download_contacts()
+    return set(snapshot["emails"]), snapshot["detailed"].copy()
+
+
+def _download_contacts():
     logging.info("Fetching all existing contacts from Brevo...")
-    existing_contacts_email = get_existing_contacts_email()
+    started = time.time()
+    # One pass over the contact base; the email set comes from the same pages.
+    # A failed page raises, so only a complete download is ever saved.
     detailed_contacts = get_detailed_contacts()
 
     detailed_contacts_by_email = {
         c["email"].lower(): c for c in detailed_contacts if c.get("email")
     }
+    existing_contacts_email = set(detailed_contacts_by_email)
 
     logging.info(
         f"Found {len(existing_contacts_email)} existing contacts in your Brevo account"
     )
 
+    if detailed_contacts_by_email:
+        save_snapshot(detailed_contacts_by_email, fetched_at=started)
+
     return existing_contacts_email, detailed_contacts_by_email
 
 
+def _snapshot_max_age() -> float:
+    # Only webhooks keep the snapshot current between downloads, so without
+    # BREVO_WEBHOOK_TOKEN the default is 0: every run downloads the contacts.
+    default = "24" if account_env("BREVO_WEBHOOK_TOKEN") else "0"
+    return float(account_env("CONTACT_SNAPSHOT_MAX_AGE_HOURS", default)) * 3600
+
+
+def _snapshot_is_fresh(snapshot) -> bool:
+    max_age = _snapshot_max_age()
+    return (
+        max_age > 0
+        and snapshot is not None
+        and time.time() - (snapshot["fetched_at"] or 0) < max_age
+    )
+
+
+def _existing_contacts_for_run():
+    # With /webhooks/brevo keeping the snapshot current, a snapshot younger
+    # than CONTACT_SNAPSHOT_MAX_AGE_HOURS stands in for paging through the
+    # whole account.
+    snapshot = load_snapshot() if _snapshot_max_age() > 0 else None
+    if _snapshot_is_fresh(snapshot):
+        age_hours = (time.time() - snapshot["fetched_at"]) / 3600
+        logging.info(
+            f"Using contact snapshot from {age_hours:.1f}h ago with "
+            f"{len(snapshot['emails'])} contacts instead of a full download"
+        )
+        return set(snapshot["emails"]), snapshot["detailed"].copy()
+    return _fetch_existing_contacts()
+
+
+def _record_run_writes(row_results: RunResults, campaign_list_id: int):
+    # Folds the contacts a run wrote into the local snapshot, so it stays
+    # current without a download.
+    row_results.flush()
+    changes = []
+    with open(row_results.path, "rb") as f:
+        for line in f:
+            row = json_loads(line)
+            if row["outcome"] == "unchanged":
+                changes.append(
+                    {"email": row["email"], "add_list_ids": [campaign_list_id]}
+                )
+            elif row["outcome"] in ("added", "updated"):
+                changes.append(
+                    {
+                        "email": row["email"].lower(),
+                        "attributes": build_attributes(row.get("data")),
+                        "add_list_ids": [campaign_list_id],
+                    }
+                )
+    record_contact_changes(changes)
+
+
+def _retry_upsert(payload: dict, email: str):
+    # The queued row is merged with the contact as it stands now, so a
+    # TENDER_CODE written since the failure is kept.
+    snapshot = load_snapshot()
+    existing = snapshot["detailed"].get(email) if snapshot else None
+    contact_data = _merged_contact_data(email, payload["contact_data"], existing)
+    resp = add_contact(
+        email, set(), list_ids=payload["list_ids"], contact_data=contact_data
+    )
+    if resp.status_code in (201, 204):
+        record_contact_changes(
+            [
+                {
+                    "email": email,
+                    "attributes": build_attributes(contact_data),
+                    "add_list_ids": payload["list_ids"],
+                }
+            ]
+        )
+        return True, None, resp.status_code
+    return False, resp.text or "", resp.status_code
+
+
+def _retry_send_info(payload: dict, email: str):
+    resp = send_info_email(email)
+    return resp.status_code in (200, 201), resp.text or "", resp.status_code
+
+
+def _retry_campaign_send(payload: dict, email: str):
+    result = send_campaign_to_contacts(payload["campaign_id"])
+    return result["success"], result.get("error", ""), result["status_code"]
+
+
+_RETRY_HANDLERS = {
+    "upsert": _retry_upsert,
+    "send_info": _retry_send_info,
+    "campaign_send": _retry_campaign_send,
+}
+
+
+def drain_retry_queue() -> dict:
+    # One batch of the current account's due retries, through the same rate
+    # limiter and circuit breaker as everything else. Items an open circuit
+    # stops are handed back untried.
+    items = claim_due(int(account_env("RETRY_BATCH_SIZE", "100")))
+    outcomes = _retry_items(items)
+    if items:
+        logging.info(
+            f"Retried {len(items)} queued items: {outcomes['succeeded']} succeeded, "
+            f"{outcomes['queued']} queued again, {outcomes['dead_lettered']} dead-lettered, "
+            f"{outcomes['released']} held back by the circuit breaker"
+        )
+    return outcomes
+
+
+def retry_run_upserts(row_results: RunResults) -> dict:
+    # A contact healed by the retry queue after the run's campaign was sent
+    # joins the list too late for it, so the run tries its queued upserts
+    # once more before sending.
+    items = claim_run(row_results.run_id, "upsert")
+    outcomes = _retry_items(items, on_success=row_results.recovered)
+    if items:
+        logging.info(
+            f"Retried {len(items)} failed upserts of run {row_results.run_id} "
+            f"before the campaign send: {outcomes['succeeded']} succeeded"
+        )
+    return outcomes
+
+
+def _retry_reason(status: int | None) -> str:
+    # Why the retry queue re-sends an item: what its last attempt got back.
+    if status is None:
+        return "transport_error"
+    if status == 429:
+        return "rate_limited"
+    return "server_error"
+
+
+def _retry_items(items: list[dict], on_success=None) -> dict:
+    outcomes = {"succeeded": 0, "queued": 0, "dead_lettered": 0, "released": 0}
+    if not items:
+        return outcomes
+    lock = threading.Lock()
+    # A retried upsert that went through counts as applied for later runs,
+    # like one that went through the first time.
+    fingerprints = (
+        open_fingerprint_store()
+        if any(item["kind"] == "upsert" for item in items)
+        else None
+    )
+
+    def retry(item: dict):
+        metrics.API_RETRIES.inc(_retry_reason(item.get("last_status")))
+        try:
+            ok, error, status = _RETRY_HANDLERS[item["kind"]](
+                item["payload"], item["email"]
+            )
+        except CircuitOpen:
+            ok, error, status = False, None, None
+        except Exception as e:
+            ok, error, status = False, f"Exception: {str(e)}", None
+        if ok:
+            record_success(item)
+            outcome = "succeeded"
+            if item["kind"] == "upsert":
+                contact_data = item["payload"]["contact_data"]
+                if fingerprints:
+                    fingerprints.add(row_fingerprint(item["email"], contact_data))
+                if on_success:
+                    on_success(item["email"], contact_data)
+        elif error is None or (is_retryable(status) and circuit_state() != "closed"):
+            # Brevo is down, which says nothing about the item: no attempt
+            # is counted.
+            release([item])
+            outcome = "released"
+        else:
+            outcome = record_failure(item, error, status)
+        with lock:
+            outcomes[outcome] += 1
+
+    try:
+        with ThreadPoolExecutor(max_workers=upsert_workers()) as executor:
+            for item in items:
+                executor.submit(contextvars.copy_context().run, retry, item)
+    finally:
+        if fingerprints:
+            fingerprints.close()
+    return outcomes
+
+
+def check_account() -> bool:
+    # One cheap call that proves the key works and Brevo answers.
+    response = _brevo_request("GET", api_url("account"))
+    return response.status_code == 200
+
+
+def warm_up():
+    load_html_template("message_template.html")
+    for account in account_names():
+        with use_account(account):
+            _warm_up_account()
+
+
+def _warm_up_account():
+    client = _client()
+    load_snapshot()
+    if not client.api_key:
+        return
+    try:
+        # Opens a pooled TLS connection before the first real request needs it.
+        _brevo_request("GET", api_url("account"))
+    except Exception as e:
+        logging.warning(f"Brevo warm-up request failed: {str(e)}")
+
+
 def _init_results(total_existing: int):
+    # Per-row outcomes are streamed to a RunResults file; this dict only
+    # carries run-level information.
     return {
-        "added_to_campaign": [],
-        "updated_contacts": [],
         "errors": [],
         "campaign_info": {},
         "total_existing_contacts": total_existing,
@@ -669,67 +1201,383 @@ def _ensure_folder(name: str):
     return folder_id
 
 
+PARSE_CHUNK_ROWS = 256
+PARSE_QUEUE_CHUNKS = 8
+# Brevo adds at most 150 emails to a list per request.
+LIST_ADD_BATCH = 150
+
+
+class _ParsedRows:
+    # First stage of a CSV run: rows are parsed and normalised on their own
+    # thread into a bounded queue, so parsing overlaps the contact download,
+    # list setup and upserts while at most a few thousand rows wait in memory.
+    _DONE = object()
+
+    def __init__(self, rows):
+        self._queue = queue.Queue(maxsize=PARSE_QUEUE_CHUNKS)
+        self._stop = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(self._parse, rows),
+            name="csv-parse",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _parse(self, rows):
+        chunk = []
+        try:
+            for row in rows:
+                email = extract_email(row)
+                contact_data = extract_contact_data(row) if email else None
+                chunk.append((email, contact_data, row))
+                if len(chunk) >= PARSE_CHUNK_ROWS:
+                    if not self._put(chunk):
+                        return
+                    chunk = []
+            if chunk:
+                self._put(chunk)
+        except BaseException as e:
+            # Raised again on the consuming side (e.g. an unreadable CSV).
+            self._error = e
+        finally:
+            self._put(self._DONE)
+
+    def __iter__(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is self._DONE:
+                break
+            yield from chunk
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        # Lets the parser thread exit when the run stops early. It stops
+        # after the chunk it is parsing, and has to be gone before the file
+        # (a memory map) it reads from is closed.
+        self._stop.set()
+        self._thread.join()
+
+
 def _process_all_rows(
     reader,
     existing_emails: set,
     detailed_contacts_by_email: dict,
-    results: dict,
+    results: RunResults,
     campaign_list_id: int,
+    workers: int = 1,
 ):
-    for row in reader:
-        email = extract_email(row)
-        if not email:
-            logging.warning(f"Skipping row with missing/invalid email: {row}")
-            continue
-
-        contact_data = extract_contact_data(row)
-
+    start = time.perf_counter()
+    processed_before = results.processed
+    errors_before = results.counts["error"]
+    cache_hits = 0
+    cache_misses = 0
+    skipped = 0
+    sms_index = SmsIndex.from_contacts(detailed_contacts_by_email)
+    circuit = _client().circuit
+    # Circuit reopenings a row waits out before it goes to the retry queue.
+    circuit_retries = int(account_env("BREVO_CIRCUIT_ROW_RETRIES", "3"))
+    fingerprints = open_fingerprint_store()
+    # Rows an earlier run already applied; they only need the campaign list.
+    unchanged = []
+
+    parsed = reader if isinstance(reader, _ParsedRows) else _ParsedRows(reader)
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    # Bounds how many parsed rows can wait for a worker at once.
+    in_flight = threading.BoundedSemaphore(max(1, workers) * 4)
+
+    def process_row(email: str, contact_data: dict, fingerprint: str | None):
         try:
-            process_contact(
+            attempts = 0
+            while True:
+                try:
+                    applied = process_contact(
+                        email,
+                        contact_data,
+                        existing_emails,
+                        results,
+                        campaign_list_id,
+                        detailed_contacts_by_email,
+                    )
+                    break
+                except CircuitOpen as e:
+                    attempts += 1
+                    if attempts > circuit_retries:
+                        # Brevo stayed down; the retry queue sends it later.
+                        results.error(
+                            email,
+                            str(e),
+                            retry=_queue_failed_upsert(
+                                email,
+                                contact_data,
+                                campaign_list_id,
+                                None,
+                                results,
+                                error=str(e),
+                            ),
+                        )
+                        applied = False
+                        break
+                    # Nothing was sent; retry the row once Brevo is back.
+                    circuit.wait_until_closed()
+            # Only a row Brevo accepted counts as applied for later runs.
+            if applied and fingerprint:
+                fingerprints.add(fingerprint)
+        except Exception as e:
+            results.error(email, str(e))
+        finally:
+            in_flight.release()
+
+    def dispatch(email: str, contact_data: dict, fingerprint: str | None):
+        in_flight.acquire()
+        if executor:
+            executor.submit(
+                contextvars.copy_context().run,
+                process_row,
                 email,
                 contact_data,
-                existing_emails,
-                results,
-                campaign_list_id,
-                detailed_contacts_by_email,
+                fingerprint,
             )
-        except Exception as e:
-            results["errors"].append({"email": email, "error": str(e)})
+        else:
+            process_row(email, contact_data, fingerprint)
+
+    def add_unchanged_to_list():
+        batch = unchanged[:]
+        unchanged.clear()
+        emails = [email for email, _, _ in batch]
+        attempts = 0
+        while True:
+            try:
+                failed = add_contacts_to_list(campaign_list_id, emails)
+                break
+            except CircuitOpen:
+                attempts += 1
+                if attempts > circuit_retries:
+                    # Each row then takes the upsert path and its retry cap.
+                    failed = set(emails)
+                    break
+                circuit.wait_until_closed()
+        for email, contact_data, fingerprint in batch:
+            if email in failed:
+                # Fall back to the full upsert, which also adds the list.
+                dispatch(email, contact_data, fingerprint)
+            else:
+                results.unchanged(email)
+
+    try:
+        for email, contact_data, row in parsed:
+            if circuit.state != "closed":
+                logging.warning(
+                    "Brevo circuit is open, pausing CSV rows until it closes"
+                )
+                paused = circuit.wait_until_closed()
+                logging.info(f"Resuming CSV rows after {paused:.1f}s pause")
+
+            if not email:
+                skipped += 1
+                results.skipped()
+                row_logger.debug("Skipping row with missing/invalid email: %s", row)
+                continue
+
+            # Drop a number another contact already holds rather than letting
+            # Brevo reject the upsert and re-sending it without SMS.
+            sms_owner = sms_index.claim(contact_data.get("phone"), email)
+            if sms_owner:
+                contact_data.pop("phone")
+                metrics.SMS_INDEX_DROPS.inc()
+                row_logger.debug(
+                    "SMS for %s already belongs to %s, sending without SMS",
+                    email,
+                    sms_owner,
+                )
 
+            if email in existing_emails:
+                cache_hits += 1
+            else:
+                cache_misses += 1
+
+            fingerprint = None
+            if fingerprints:
+                fingerprint = row_fingerprint(email, contact_data)
+                # A contact deleted since is created again in full.
+                if email in existing_emails and fingerprints.seen(fingerprint):
+                    unchanged.append((email, contact_data, fingerprint))
+                    if len(unchanged) >= LIST_ADD_BATCH:
+                        add_unchanged_to_list()
+                    continue
+
+            dispatch(email, contact_data, fingerprint)
+
+        if unchanged:
+            add_unchanged_to_list()
+    finally:
+        parsed.close()
+        if executor:
+            executor.shutdown(wait=True)
+        if fingerprints:
+            fingerprints.close()
+
+    processed = results.processed - processed_before
+    failed = results.counts["error"] - errors_before
+    elapsed = time.perf_counter() - start
+    metrics.record_csv_run(
+        processed=processed,
+        failed=failed,
+        elapsed=elapsed,
+        hits=cache_hits,
+        misses=cache_misses,
+    )
+    logging.info(
+        f"Processed CSV rows in {elapsed:.1f}s: {processed} added or updated, {failed} failed, "
+        f"{skipped} skipped without email, {results.counts['unchanged']} unchanged"
+    )
 
-def handle_csv(file_bytes: bytes):
-    reader = _get_csv_reader(file_bytes)
-    existing_emails, detailed_by_email = _fetch_existing_contacts()
 
-    results = _init_results(len(existing_emails))
+def handle_csv(file_bytes: bytes, shard_workers: int | None = None):
+    if shard_workers is None:
+        shard_workers = int(account_env("CSV_SHARD_WORKERS", "0"))
+    if shard_workers > 0:
+        from .sharding import handle_csv_sharded
 
-    folder_id = _ensure_folder("Winners")
-    if not folder_id:
-        return {"errors": [{"error": "Folder setup failed"}]}
+        return handle_csv_sharded(file_bytes, shard_workers)
+
+    return handle_csv_rows(_get_csv_reader(file_bytes))
+
+
+def handle_csv_file(csv_path: Path, shard_workers: int | None = None):
+    # Like handle_csv, but streams the file from a memory map instead of
+    # holding it (and its decoded copy) in memory.
+    if shard_workers is None:
+        shard_workers = int(account_env("CSV_SHARD_WORKERS", "0"))
+    if shard_workers > 0:
+        from .sharding import handle_csv_sharded
+
+        return handle_csv_sharded(Path(csv_path), shard_workers)
+
+    with open_csv_rows(csv_path) as rows:
+        return handle_csv_rows(rows)
+
+
+def handle_csv_rows(
+    rows,
+    list_name: str = "csv_import",
+    snapshot=None,
+    workers: int | None = None,
+):
+    if workers is None:
+        workers = upsert_workers()
+    timer = StageTimer()
+    row_results = RunResults()
+    try:
+        with profiled_run("handle_csv"):
+            results = _run_csv_stages(
+                rows, timer, list_name, snapshot, workers, row_results
+            )
+    finally:
+        row_results.close()
+    results.update(row_results.as_dict())
+    results["account"] = current_account()
+    results["timings"] = timer.as_dict()
+    return results
 
-    csv_list_id = create_new_contact_list("csv_import")
+
+def _timed_stage(timer: StageTimer, name: str, fn, *args):
+    with timer.stage(name):
+        return fn(*args)
+
+
+def _set_up_list(list_name: str):
+    if not _ensure_folder("Winners"):
+        return None, "Folder setup failed"
+    csv_list_id = create_new_contact_list(list_name)
     if not csv_list_id:
-        return {"errors": [{"error": "Failed to create contact list"}]}
+        return None, "Failed to create contact list"
+    return csv_list_id, None
 
-    campaign_result = create_new_campaign(csv_list_id)
 
-    logging.info(campaign_result)
+def _run_csv_stages(
+    rows,
+    timer: StageTimer,
+    list_name: str,
+    snapshot,
+    workers: int,
+    row_results: RunResults,
+):
+    # The stages overlap: rows are parsed while the contact base downloads and
+    # the folder, list and then campaign are set up; upserts start once the
+    # snapshot and the campaign are both there.
+    parsed = _ParsedRows(rows)
+    setup = ThreadPoolExecutor(max_workers=2, thread_name_prefix="csv-setup")
+
+    def in_background(name: str, fn, *args):
+        return setup.submit(
+            contextvars.copy_context().run, _timed_stage, timer, name, fn, *args
+        )
 
-    results["campaign_info"] = campaign_result
+    try:
+        snapshot_future = None
+        if snapshot is None:
+            snapshot_future = in_background(
+                "contact_download", _existing_contacts_for_run
+            )
 
-    if not campaign_result["success"]:
-        results["errors"].append(
-            {"error": "Failed to create campaign", "details": campaign_result["error"]}
+        csv_list_id, error = in_background(
+            "folder_list_setup", _set_up_list, list_name
+        ).result()
+        if error:
+            return {"errors": [{"error": error}]}
+        campaign_future = in_background(
+            "campaign_creation", create_new_campaign, csv_list_id
         )
-        return results
-
-    _process_all_rows(
-        reader,
-        existing_emails,
-        detailed_by_email,
-        results,
-        csv_list_id,
-    )
+
+        if snapshot_future is not None:
+            snapshot = snapshot_future.result()
+        existing_emails, detailed_by_email = snapshot
+        results = _init_results(len(existing_emails))
+
+        # No row is written before the campaign exists: a run without one
+        # stops before touching any contact, as it did before the stages
+        # overlapped.
+        campaign_result = campaign_future.result()
+        logging.info(campaign_result)
+        results["campaign_info"] = campaign_result
+        if not campaign_result["success"]:
+            results["errors"].append(
+                {
+                    "error": "Failed to create campaign",
+                    "details": campaign_result["error"],
+                }
+            )
+            return results
+
+        with timer.stage("row_upserts"):
+            _process_all_rows(
+                parsed,
+                existing_emails,
+                detailed_by_email,
+                row_results,
+                csv_list_id,
+                workers=workers,
+            )
+        with timer.stage("row_retries"):
+            retry_run_upserts(row_results)
+        _record_run_writes(row_results, csv_list_id)
+    finally:
+        parsed.close()
+        # An early return leaves a contact download running; it finishes (and
+        # refreshes the snapshot) in the background.
+        setup.shutdown(wait=False, cancel_futures=True)
 
     campaign_id = campaign_result["campaign_id"]
 
@@ -760,7 +1608,8 @@ def handle_csv(file_bytes: bytes):
     #
     # logging.info("=== END DEBUGGING ===")
     #
-    send_result = send_campaign_to_contacts(campaign_id)
+    with timer.stage("campaign_send"):
+        send_result = send_run_campaign(campaign_id, row_results.run_id)
     results["campaign_info"]["send_result"] = send_result
 
     if send_result["success"]:
@@ -0,0 +1,243 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+# A local stand-in for the parts of the Brevo v3 API this service calls, for
+# load tests and trying the service without an account. State lives in
+# memory; every response can be delayed and a share of them failed with a
+# 500 to look like the real thing under load.
+
+
+class BrevoStub:
+    def __init__(
+        self,
+        contacts: int = 1000,
+        latency: float = 0.05,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        self._ids = iter(range(1, 1 << 62))
+        self.contacts = {}
+        self._sms_owners = {}
+        self.folders = {}
+        self.lists = {}
+        self.campaigns = {}
+        self.requests = 0
+        for i in range(contacts):
+            self._upsert(
+                f"contact{i}@example.com",
+                {"SMS": f"995500{i:06d}", "TENDER_CODE": f"T{i % 50}"},
+                [],
+            )
+
+    def _upsert(self, email: str, attributes: dict, list_ids: list) -> bool:
+        created = email not in self.contacts
+        contact = self.contacts.setdefault(
+            email,
+            {
+                "id": next(self._ids),
+                "email": email,
+                "emailBlacklisted": False,
+                "smsBlacklisted": False,
+                "listIds": [],
+                "attributes": {},
+            },
+        )
+        contact["attributes"].update(attributes)
+        if attributes.get("SMS"):
+            self._sms_owners[attributes["SMS"]] = email
+        contact["listIds"] = sorted(set(contact["listIds"]) | set(list_ids))
+        return created
+
+    def _sms_owner(self, sms: str, email: str) -> str | None:
+        owner = self._sms_owners.get(sms)
+        return owner if owner != email else None
+
+    def handle(self, method: str, path: str, query: dict, body) -> tuple:
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        with self._lock:
+            self.requests += 1
+            if self.error_rate and random.random() < self.error_rate:
+                return 500, {"code": "internal_error", "message": "Stub failure"}
+            return self._route(method, path, query, body or {})
+
+    def _route(self, method: str, path: str, query: dict, body: dict) -> tuple:
+        if method == "GET" and path == "account":
+            return 200, {"email": "owner@example.com", "companyName": "Brevo stub"}
+
+        if path == "contacts" and method == "GET":
+            limit = int(query.get("limit", 50))
+            offset = int(query.get("offset", 0))
+            contacts = list(self.contacts.values())
+            return 200, {
+                "contacts": contacts[offset : offset + limit],
+                "count": len(contacts),
+            }
+        if path == "contacts" and method == "POST":
+            email = body.get("email", "").lower()
+            attributes = body.get("attributes") or {}
+            if not email:
+                return 400, {"code": "missing_parameter", "message": "email missing"}
+            if attributes.get("SMS") and self._sms_owner(attributes["SMS"], email):
+                return 400, {
+                    "code": "duplicate_parameter",
+                    "message": "Unable to update contact, SMS is already associated with another Contact",
+                }
+            if email in self.contacts and not body.get("updateEnabled"):
+                return 400, {
+                    "code": "duplicate_parameter",
+                    "message": "Contact already exist",
+                }
+            created = self._upsert(email, attributes, body.get("listIds") or [])
+            if created:
+                return 201, {"id": self.contacts[email]["id"]}
+            return 204, None
+
+        match = re.fullmatch(r"contacts/([^/]+@[^/]+)", path)
+        if match and method == "GET":
+            contact = self.contacts.get(unquote(match.group(1)).lower())
+            if contact is None:
+                return 404, {
+                    "code": "document_not_found",
+                    "message": "Contact does not exist",
+                }
+            return 200, contact
+
+        if path == "contacts/folders" and method == "GET":
+            return 200, {
+                "folders": list(self.folders.values()),
+                "count": len(self.folders),
+            }
+        if path == "contacts/folders" and method == "POST":
+            folder_id = next(self._ids)
+            self.folders[folder_id] = {"id": folder_id, "name": body.get("name")}
+            return 201, {"id": folder_id}
+        match = re.fullmatch(r"contacts/folders/(\d+)", path)
+        if match and method == "PUT":
+            folder = self.folders.get(int(match.group(1)))
+            if folder is None:
+                return 404, {"code": "document_not_found", "message": "No folder"}
+            folder["name"] = body.get("name", folder["name"])
+            return 204, None
+
+        if path == "contacts/lists" and method == "POST":
+            list_id = next(self._ids)
+            self.lists[list_id] = {"id": list_id, "name": body.get("name")}
+            return 201, {"id": list_id}
+        match = re.fullmatch(r"contacts/lists/(\d+)/contacts/add", path)
+        if match and method == "POST":
+            list_id = int(match.group(1))
+            success, failure = [], []
+            for email in body.get("emails", []):
+                if email.lower() in self.contacts:
+                    self._upsert(email.lower(), {}, [list_id])
+                    success.append(email)
+                else:
+                    failure.append(email)
+            return 201, {
+                "contacts": {
+                    "success": success,
+                    "failure": failure,
+                    "total": len(success),
+                }
+            }
+
+        if path == "emailCampaigns" and method == "POST":
+            campaign_id = next(self._ids)
+            self.campaigns[campaign_id] = dict(body, id=campaign_id, status="draft")
+            return 201, {"id": campaign_id}
+        match = re.fullmatch(r"emailCampaigns/(\d+)(/sendNow)?", path)
+        if match:
+            campaign = self.campaigns.get(int(match.group(1)))
+            if campaign is None:
+                return 404, {"code": "document_not_found", "message": "No campaign"}
+            if match.group(2) and method == "POST":
+                campaign["status"] = "sent"
+                return 204, None
+            if not match.group(2) and method == "GET":
+                return 200, campaign
+
+        if path == "smtp/email" and method == "POST":
+            return 201, {"messageId": f"<{next(self._ids)}@brevo-stub>"}
+
+        return 404, {"code": "not_found", "message": f"No stub for {method} {path}"}
+
+
+def _handler(stub: BrevoStub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _serve(self):
+            url = urlsplit(self.path)
+            path = url.path.strip("/").removeprefix("v3/")
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            length = int(self.headers.get("content-length") or 0)
+            raw = self.rfile.read(length) if length else b""
+            try:
+                body = json.loads(raw) if raw else None
+            except ValueError:
+                status, payload = 400, {"code": "bad_request", "message": "Bad JSON"}
+            else:
+                status, payload = stub.handle(self.command, path, query, body)
+
+            data = b"" if payload is None else json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST = do_PUT = do_DELETE = _serve
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_stub(port: int = 0, **options) -> tuple[ThreadingHTTPServer, str]:
+    # Serves on a daemon thread; the URL is what BREVO_API_URL should be set to.
+    stub = BrevoStub(**options)
+    server = ThreadingHTTPServer(("127.0.0.1", port), _handler(stub))
+    server.daemon_threads = True
+    server.stub = stub
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v3"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Brevo API stand-in")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--contacts", type=int, default=1000)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    args = parser.parse_args()
+
+    server, url = start_stub(
+        args.port,
+        contacts=args.contacts,
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        error_rate=args.error_rate,
+    )
+    print(f"Brevo stub listening; run the service with BREVO_API_URL={url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import logging
+import threading
+import time
+
+import requests
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(requests.exceptions.RequestException):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        name: str = "Brevo",
+        probe_timeout: float | None = None,
+    ):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        # A probe that never reports back (its caller crashed or was
+        # cancelled) hands over to the next caller after this long.
+        self.probe_timeout = reset_timeout if probe_timeout is None else probe_timeout
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started_at = 0.0
+        self._changed = threading.Condition()
+        self.on_state_change = None
+
+    def _set_state(self, state: str):
+        if state == self.state:
+            return
+        logging.warning(f"{self.name} circuit breaker {self.state} -> {state}")
+        self.state = state
+        if self.on_state_change:
+            self.on_state_change(state)
+        self._changed.notify_all()
+
+    def _probe_due(self, now: float) -> bool:
+        if self.state == HALF_OPEN:
+            return now - self._probe_started_at >= self.probe_timeout
+        return self.state == OPEN and now - self._opened_at >= self.reset_timeout
+
+    def _next_deadline(self) -> float:
+        if self.state == HALF_OPEN:
+            return self._probe_started_at + self.probe_timeout
+        return self._opened_at + self.reset_timeout
+
+    def before_call(self):
+        with self._changed:
+            if self.state == CLOSED:
+                return
+            now = time.monotonic()
+            if self._probe_due(now):
+                if self.state == HALF_OPEN:
+                    logging.warning(
+                        f"{self.name} circuit probe did not report back, probing again"
+                    )
+                # This caller is the probe; everyone else keeps failing fast
+                # until it reports back.
+                self._probe_started_at = now
+                self._set_state(HALF_OPEN)
+                return
+            raise CircuitOpen(f"Brevo circuit is {self.state}, not sending request")
+
+    def record_success(self):
+        with self._changed:
+            self._failures = 0
+            self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self._changed:
+            self._failures += 1
+            if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                if self.state == OPEN:
+                    return
+                self._set_state(OPEN)
+
+    def wait_until_closed(self, timeout: float | None = None) -> float:
+        start = time.monotonic()
+        with self._changed:
+            while self.state != CLOSED:
+                now = time.monotonic()
+                if self._probe_due(now):
+                    break
+                if timeout is not None and now - start >= timeout:
+                    break
+                delay = self._next_deadline() - now
+                if timeout is not None:
+                    delay = min(delay, start + timeout - now)
+                self._changed.wait(max(0.01, delay))
+        return time.monotonic() - start
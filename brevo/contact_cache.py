@@ -0,0 +1,373 @@
+import contextlib
+import logging
+import sqlite3
+import threading
+import time
+from collections.abc import Mapping
+from pathlib import Path
+
+from . import json_codec
+from .accounts import DEFAULT_ACCOUNT, account_env, current_account
+from .settings import env
+
+# Contact state shared by every process of the service (uvicorn workers, the
+# background service, shard workers on the same host): one SQLite database in
+# WAL mode, so readers never block the writer or each other, read through
+# memory-mapped pages that the OS keeps once for all of them. It holds each
+# account's contacts as of the last download plus the changes recorded since
+# (webhook events, CSV run writes), the folder ids looked up by name, and the
+# lease that elects the one process allowed to download the contact base.
+MMAP_BYTES = 256 * 1024 * 1024
+SYNC_LEASE = "contact_sync"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS contacts (
+    account TEXT NOT NULL,
+    email TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (account, email)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS changes (
+    account TEXT NOT NULL,
+    received_at REAL NOT NULL,
+    change BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS changes_account ON changes (account, received_at);
+CREATE TABLE IF NOT EXISTS state (
+    account TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (account, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS names (
+    account TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    PRIMARY KEY (account, kind, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS leases (
+    account TEXT NOT NULL,
+    name TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (account, name)
+) WITHOUT ROWID;
+"""
+
+# sqlite3 connections stay on the thread that opened them.
+_local = threading.local()
+_counts = {}
+_counts_lock = threading.Lock()
+
+
+def store_path() -> Path:
+    return Path(env("CONTACT_STORE_PATH", "contact_state.db"))
+
+
+def snapshot_path() -> Path:
+    # The JSON snapshot earlier versions kept per account; it is imported into
+    # the store once, the first time the account is read.
+    account = current_account()
+    default = (
+        "contact_snapshot.json"
+        if account == DEFAULT_ACCOUNT
+        else f"contact_snapshot.{account}.json"
+    )
+    return Path(account_env("CONTACT_SNAPSHOT_PATH", default))
+
+
+def _connect() -> sqlite3.Connection:
+    path = store_path()
+    connections = _local.__dict__.setdefault("connections", {})
+    conn = connections.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={MMAP_BYTES}")
+        conn.executescript(_SCHEMA)
+        connections[path] = conn
+    return conn
+
+
+@contextlib.contextmanager
+def _transaction(conn: sqlite3.Connection):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def _get_state(conn, account: str, key: str) -> str | None:
+    row = conn.execute(
+        "SELECT value FROM state WHERE account = ? AND key = ?", (account, key)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def _set_state(conn, account: str, key: str, value):
+    conn.execute(
+        "INSERT OR REPLACE INTO state VALUES (?, ?, ?)", (account, key, str(value))
+    )
+
+
+def _bump_version(conn, account: str):
+    conn.execute(
+        """
+        INSERT INTO state VALUES (?, 'version', '1')
+        ON CONFLICT (account, key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+        """,
+        (account,),
+    )
+
+
+def store_version(account: str | None = None) -> int:
+    # Bumped in the same transaction as every write to an account's contacts,
+    # from any process; readers compare it before reusing what they derived.
+    value = _get_state(_connect(), account or current_account(), "version")
+    return int(value) if value else 0
+
+
+def fetched_at(account: str | None = None) -> float | None:
+    account = account or current_account()
+    value = _get_state(_connect(), account, "fetched_at")
+    return float(value) if value else None
+
+
+def save_snapshot(detailed_contacts_by_email: dict, fetched_at: float | None = None):
+    # fetched_at is when the download started: changes recorded after that
+    # may not be in the pages and are applied again on top.
+    account = current_account()
+    fetched_at = fetched_at or time.time()
+    conn = _connect()
+    try:
+        with _transaction(conn):
+            conn.execute("DELETE FROM contacts WHERE account = ?", (account,))
+            conn.executemany(
+                "INSERT INTO contacts VALUES (?, ?, ?)",
+                (
+                    (account, email, json_codec.dumps(contact))
+                    for email, contact in detailed_contacts_by_email.items()
+                ),
+            )
+            conn.execute(
+                "DELETE FROM changes WHERE account = ? AND received_at < ?",
+                (account, fetched_at),
+            )
+            pending = conn.execute(
+                "SELECT change FROM changes WHERE account = ? ORDER BY received_at",
+                (account,),
+            ).fetchall()
+            for (change,) in pending:
+                _apply_change(conn, account, json_codec.loads(change))
+            _set_state(conn, account, "fetched_at", fetched_at)
+            _bump_version(conn, account)
+        logging.info(
+            f"Saved contact snapshot with {len(detailed_contacts_by_email)} contacts "
+            f"to {store_path()} ({account})"
+        )
+    except Exception as e:
+        logging.error(f"Failed to save contact snapshot to {store_path()}: {str(e)}")
+
+
+class StoredContacts(Mapping):
+    # Read-only view of one account's contacts; lookups are indexed queries
+    # against the shared store instead of a per-process copy of every contact.
+    def __init__(self, account: str):
+        self.account = account
+
+    def __getitem__(self, email: str) -> dict:
+        row = (
+            _connect()
+            .execute(
+                "SELECT data FROM contacts WHERE account = ? AND email = ?",
+                (self.account, email),
+            )
+            .fetchone()
+        )
+        if row is None:
+            raise KeyError(email)
+        return json_codec.loads(row[0])
+
+    def __contains__(self, email) -> bool:
+        row = (
+            _connect()
+            .execute(
+                "SELECT 1 FROM contacts WHERE account = ? AND email = ?",
+                (self.account, email),
+            )
+            .fetchone()
+        )
+        return row is not None
+
+    def __iter__(self):
+        rows = _connect().execute(
+            "SELECT email FROM contacts WHERE account = ?", (self.account,)
+        )
+        for (email,) in rows:
+            yield email
+
+    def __len__(self) -> int:
+        # Counting scans the account's rows, so the figure is kept until the
+        # account's contacts change. The version is read first: a write in
+        # between only costs a recount.
+        version = store_version(self.account)
+        with _counts_lock:
+            cached = _counts.get((store_path(), self.account))
+        if cached and cached[0] == version:
+            return cached[1]
+        count = (
+            _connect()
+            .execute("SELECT COUNT(*) FROM contacts WHERE account = ?", (self.account,))
+            .fetchone()[0]
+        )
+        with _counts_lock:
+            _counts[(store_path(), self.account)] = (version, count)
+        return count
+
+    def items(self):
+        # One query for the lot rather than a lookup per key.
+        rows = _connect().execute(
+            "SELECT email, data FROM contacts WHERE account = ?", (self.account,)
+        )
+        for email, data in rows:
+            yield email, json_codec.loads(data)
+
+    def copy(self) -> dict:
+        return dict(self.items())
+
+
+def _import_legacy_snapshot(account: str) -> bool:
+    path = snapshot_path()
+    if not path.exists():
+        return False
+    with open(path, "rb") as f:
+        data = json_codec.loads(f.read())
+    save_snapshot(data.get("contacts", {}), fetched_at=data.get("fetched_at"))
+    path.rename(path.with_name(path.name + ".imported"))
+    return True
+
+
+def load_snapshot():
+    # The current account's contacts as of the last download, with changes
+    # recorded since applied; None until a download (or import) happened.
+    account = current_account()
+    taken_at = fetched_at(account)
+    if taken_at is None:
+        if not _import_legacy_snapshot(account):
+            return None
+        taken_at = fetched_at(account)
+    contacts = StoredContacts(account)
+    return {"emails": contacts.keys(), "detailed": contacts, "fetched_at": taken_at}
+
+
+def record_contact_changes(changes: list[dict]) -> int:
+    # Applies changes to the stored contacts and keeps them until the next
+    # download that started after they arrived. Without a download yet there
+    # is nothing to keep current.
+    account = current_account()
+    if not changes or fetched_at(account) is None:
+        return 0
+    now = time.time()
+    conn = _connect()
+    with _transaction(conn):
+        for change in changes:
+            conn.execute(
+                "INSERT INTO changes VALUES (?, ?, ?)",
+                (account, now, json_codec.dumps(change)),
+            )
+            _apply_change(conn, account, change)
+        _bump_version(conn, account)
+    return len(changes)
+
+
+def _apply_change(conn, account: str, change: dict):
+    email = change["email"]
+    if change.get("deleted"):
+        conn.execute(
+            "DELETE FROM contacts WHERE account = ? AND email = ?", (account, email)
+        )
+        return
+
+    row = conn.execute(
+        "SELECT data FROM contacts WHERE account = ? AND email = ?", (account, email)
+    ).fetchone()
+    if row:
+        contact = json_codec.loads(row[0])
+    else:
+        contact = {
+            "email": email,
+            "emailBlacklisted": False,
+            "smsBlacklisted": False,
+            "listIds": [],
+            "attributes": {},
+        }
+    for flag in ("emailBlacklisted", "smsBlacklisted"):
+        if flag in change:
+            contact[flag] = change[flag]
+    if change.get("attributes"):
+        contact.setdefault("attributes", {}).update(change["attributes"])
+    list_ids = set(contact.get("listIds") or [])
+    list_ids |= set(change.get("add_list_ids") or [])
+    list_ids -= set(change.get("remove_list_ids") or [])
+    contact["listIds"] = sorted(list_ids)
+    conn.execute(
+        "INSERT OR REPLACE INTO contacts VALUES (?, ?, ?)",
+        (account, email, json_codec.dumps(contact)),
+    )
+
+
+def cached_id(kind: str, name: str) -> int | None:
+    row = (
+        _connect()
+        .execute(
+            "SELECT id FROM names WHERE account = ? AND kind = ? AND name = ?",
+            (current_account(), kind, name),
+        )
+        .fetchone()
+    )
+    return row[0] if row else None
+
+
+def remember_id(kind: str, name: str, object_id: int | None):
+    conn = _connect()
+    if object_id is None:
+        conn.execute(
+            "DELETE FROM names WHERE account = ? AND kind = ? AND name = ?",
+            (current_account(), kind, name),
+        )
+    else:
+        conn.execute(
+            "INSERT OR REPLACE INTO names VALUES (?, ?, ?, ?)",
+            (current_account(), kind, name, object_id),
+        )
+
+
+def acquire_lease(name: str, owner: str, seconds: float) -> bool:
+    # The lease is the election: whoever holds it does the work, the others
+    # wait for its result. An expired lease (its holder died) can be taken.
+    conn = _connect()
+    now = time.time()
+    with _transaction(conn):
+        row = conn.execute(
+            "SELECT owner, expires FROM leases WHERE account = ? AND name = ?",
+            (current_account(), name),
+        ).fetchone()
+        if row and row[0] != owner and row[1] > now:
+            return False
+        conn.execute(
+            "INSERT OR REPLACE INTO leases VALUES (?, ?, ?, ?)",
+            (current_account(), name, owner, now + seconds),
+        )
+    return True
+
+
+def release_lease(name: str, owner: str):
+    _connect().execute(
+        "DELETE FROM leases WHERE account = ? AND name = ? AND owner = ?",
+        (current_account(), name, owner),
+    )
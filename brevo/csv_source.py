@@ -0,0 +1,51 @@
+import contextlib
+import csv
+import io
+import mmap
+from pathlib import Path
+
+SNIFF_BYTES = 64 * 1024
+
+
+def sniff_delimiter(sample: str) -> str:
+    # Exports come comma- or semicolon-separated; the header line decides.
+    header = sample.lstrip("\ufeff").split("\n", 1)[0]
+    return ";" if header.count(";") > header.count(",") else ","
+
+
+class _MmapReader(io.RawIOBase):
+    # Lets TextIOWrapper decode straight out of the mapping, a buffer at a
+    # time, instead of from one bytes copy of the whole file.
+    def __init__(self, mapped: mmap.mmap):
+        self._mapped = mapped
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._mapped.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+@contextlib.contextmanager
+def open_csv_rows(path: Path):
+    # Rows of a CSV file as dicts, read from a read-only memory map: pages come
+    # from the OS page cache, so processes and threads reading the same (or
+    # several) large exports do not each hold a copy on their heap.
+    with open(path, "rb") as f:
+        if Path(path).stat().st_size == 0:
+            yield iter(())
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            sample = mapped[:SNIFF_BYTES].decode("utf-8", errors="replace")
+            # utf-8-sig drops a byte order mark; newline="" is what csv expects.
+            text = io.TextIOWrapper(
+                io.BufferedReader(_MmapReader(mapped)),
+                encoding="utf-8-sig",
+                newline="",
+            )
+            try:
+                yield csv.DictReader(text, delimiter=sniff_delimiter(sample))
+            finally:
+                text.detach()
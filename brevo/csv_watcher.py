@@ -0,0 +1,346 @@
+import contextlib
+import json
+import logging
+import os
+import re
+import select
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    def __init__(self, directory: Path):
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY
+        wd = libc.inotify_add_watch(self._fd, os.fsencode(str(directory)), mask)
+        if wd < 0:
+            os.close(self._fd)
+            raise OSError(
+                ctypes.get_errno(), f"inotify_add_watch failed for {directory}"
+            )
+
+    def wait(self, timeout: float) -> set[str]:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        names = set()
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            _, _, _, name_len = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset : offset + name_len].rstrip(b"\0")
+            offset += name_len
+            if name:
+                names.add(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    def __init__(self, directory: Path, interval: float = 5.0):
+        self.directory = directory
+        self.interval = interval
+        self._seen = self._scan()
+
+    def _scan(self) -> dict:
+        snapshot = {}
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        snapshot[entry.name] = (stat.st_size, stat.st_mtime)
+        except OSError as e:
+            logger.warning(f"Could not scan {self.directory}: {str(e)}")
+        return snapshot
+
+    def wait(self, timeout: float) -> set[str]:
+        time.sleep(min(timeout, self.interval))
+        current = self._scan()
+        changed = {name for name, sig in current.items() if self._seen.get(name) != sig}
+        self._seen = current
+        return changed
+
+    def close(self):
+        pass
+
+
+class ProcessedFileRegistry:
+    # A file is claimed once; a failed run, or a claim left "processing" by a
+    # process that died more than claim_timeout seconds ago, can be claimed
+    # again, so the watcher and the daily job retry it. The background service
+    # and API backfills claim from different processes, so the state lives in
+    # SQLite and a claim is one write transaction.
+    def __init__(self, state_file: Path, claim_timeout: float = 6 * 3600):
+        # Earlier versions kept the state in JSON; it is imported once.
+        legacy_file = state_file if state_file.suffix == ".json" else None
+        self.state_file = state_file.with_suffix(".db")
+        self.claim_timeout = claim_timeout
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    name TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    size INTEGER,
+                    mtime REAL,
+                    status TEXT NOT NULL,
+                    claimed_at TEXT,
+                    finished_at TEXT
+                )
+                """)
+            if legacy_file is None:
+                legacy_file = self.state_file.with_suffix(".json")
+            if legacy_file.exists():
+                self._import(conn, legacy_file)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.state_file, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _import(self, conn, legacy_file: Path):
+        try:
+            with open(legacy_file, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except Exception as e:
+            logger.error(f"Could not read processed-file state {legacy_file}: {str(e)}")
+            return
+        conn.executemany(
+            "INSERT OR IGNORE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    name,
+                    entry.get("path", name),
+                    entry.get("size"),
+                    entry.get("mtime"),
+                    entry.get("status", "done"),
+                    entry.get("claimed_at"),
+                    entry.get("finished_at"),
+                )
+                for name, entry in entries.items()
+            ),
+        )
+        legacy_file.rename(legacy_file.with_name(legacy_file.name + ".imported"))
+        logger.info(
+            f"Imported {len(entries)} processed-file entries from {legacy_file}"
+        )
+
+    def _claimable(self, row) -> bool:
+        if row is None or row[0] == "failed":
+            return True
+        if row[0] == "processing":
+            try:
+                claimed_at = datetime.fromisoformat(row[1])
+            except (TypeError, ValueError):
+                return True
+            age = (datetime.now() - claimed_at).total_seconds()
+            return age > self.claim_timeout
+        return False
+
+    def claim(self, path: Path) -> bool:
+        stat = path.stat()
+        with contextlib.closing(self._connect()) as conn:
+            # Taking the write lock first makes check-and-claim atomic across
+            # processes.
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT status, claimed_at FROM files WHERE name = ?",
+                    (path.name,),
+                ).fetchone()
+                if not self._claimable(row):
+                    conn.execute("ROLLBACK")
+                    return False
+                if row is not None:
+                    logger.info(f"Claiming {path.name} again (was {row[0]})")
+                conn.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, 'processing', ?, NULL)",
+                    (
+                        path.name,
+                        str(path),
+                        stat.st_size,
+                        stat.st_mtime,
+                        datetime.now().isoformat(timespec="seconds"),
+                    ),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return True
+
+    def finish(self, path: Path, status: str):
+        finished_at = datetime.now().isoformat(timespec="seconds")
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute(
+                """
+                INSERT INTO files (name, path, status, finished_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (name) DO UPDATE
+                SET status = excluded.status, finished_at = excluded.finished_at
+                """,
+                (path.name, str(path), status, finished_at),
+            )
+
+    def is_processed(self, path: Path) -> bool:
+        with contextlib.closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT status, claimed_at FROM files WHERE name = ?", (path.name,)
+            ).fetchone()
+        return not self._claimable(row)
+
+
+def filename_regex(pattern: str, extension: str) -> re.Pattern:
+    parts = [re.escape(part) for part in pattern.split("{date}")]
+    return re.compile("^" + r"(\d{8})".join(parts) + re.escape(extension) + "$")
+
+
+class CsvFileWatcher:
+    def __init__(
+        self,
+        directory: Path,
+        filename_pattern: str,
+        file_extension: str,
+        registry: ProcessedFileRegistry,
+        on_ready,
+        stable_seconds: float = 10.0,
+        max_age_days: int = 0,
+        rescan_seconds: float = 900.0,
+    ):
+        self.directory = directory
+        self.regex = filename_regex(filename_pattern, file_extension)
+        self.registry = registry
+        self.on_ready = on_ready
+        self.stable_seconds = stable_seconds
+        self.max_age_days = max_age_days
+        # Failed and abandoned files raise no new events; a periodic listing
+        # of the directory picks them up again.
+        self.rescan_seconds = rescan_seconds
+        self.running = False
+        self._pending = {}
+        self._thread = None
+
+    def _make_backend(self):
+        if sys.platform.startswith("linux"):
+            try:
+                backend = InotifyWatcher(self.directory)
+                logger.info(f"Watching {self.directory} with inotify")
+                return backend
+            except Exception as e:
+                logger.warning(
+                    f"inotify unavailable ({str(e)}), falling back to polling"
+                )
+        logger.info(f"Watching {self.directory} by polling")
+        return PollingWatcher(self.directory)
+
+    def _is_candidate(self, name: str) -> bool:
+        match = self.regex.match(name)
+        if not match:
+            return False
+        try:
+            file_date = datetime.strptime(match.group(1), "%Y%m%d").date()
+        except ValueError:
+            return False
+        age_days = (datetime.now().date() - file_date).days
+        return 0 <= age_days <= self.max_age_days
+
+    def _track(self, names):
+        for name in names:
+            if name in self._pending or not self._is_candidate(name):
+                continue
+            path = self.directory / name
+            if self.registry.is_processed(path):
+                continue
+            logger.info(f"Detected CSV export {path}, waiting for it to settle")
+            self._pending[name] = (None, time.monotonic())
+
+    def _check_pending(self):
+        now = time.monotonic()
+        for name, (last_sig, since) in list(self._pending.items()):
+            path = self.directory / name
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                del self._pending[name]
+                continue
+
+            sig = (stat.st_size, stat.st_mtime_ns)
+            if sig != last_sig or stat.st_size == 0:
+                self._pending[name] = (sig, now)
+                continue
+            if now - since < self.stable_seconds:
+                continue
+
+            del self._pending[name]
+            if not self.registry.claim(path):
+                continue
+            logger.info(f"CSV export {path} is stable, processing now")
+            try:
+                self.on_ready(path)
+                self.registry.finish(path, "done")
+            except Exception as e:
+                logger.error(f"Processing of watched file {path} failed: {str(e)}")
+                self.registry.finish(path, "failed")
+
+    def _run(self):
+        backend = self._make_backend()
+        last_scan = None
+        try:
+            while self.running:
+                # One failing pass (an unreadable directory, a broken state
+                # file) must not stop the watcher for good.
+                try:
+                    now = time.monotonic()
+                    if last_scan is None or now - last_scan >= self.rescan_seconds:
+                        self._track(os.listdir(self.directory))
+                        last_scan = now
+                    timeout = 1.0 if self._pending else 30.0
+                    self._track(backend.wait(timeout))
+                    self._check_pending()
+                except Exception as e:
+                    logger.error(f"CSV watcher pass failed: {str(e)}")
+                    time.sleep(5)
+        finally:
+            backend.close()
+
+    def start(self):
+        if not self.directory.is_dir():
+            logger.error(f"Cannot watch {self.directory}: directory does not exist")
+            return False
+        self.running = True
+        self._thread = threading.Thread(
+            target=self._run, name="csv-watcher", daemon=True
+        )
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self.running = False
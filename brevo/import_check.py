@@ -0,0 +1,77 @@
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+# Cumulative import time budgets in milliseconds. Most of each figure is
+# third-party (requests, fastapi); the check is there to catch regressions
+# such as network calls, file reads or heavy imports creeping into import.
+BUDGETS_MS = {
+    "brevo.brevo_service": 400,
+    "brevo.background_service": 450,
+    "brevo.main": 1200,
+}
+
+_SIDE_EFFECTS = """
+import logging, os, sys
+before = set(os.listdir("."))
+import {module}
+from brevo.settings import load_env
+problems = []
+if logging.getLogger().handlers:
+    problems.append("configured logging")
+if load_env.cache_info().currsize:
+    problems.append("loaded .env")
+created = set(os.listdir(".")) - before
+if created:
+    problems.append("created " + ", ".join(sorted(created)))
+print("; ".join(problems))
+"""
+
+
+def _run(args, root: Path) -> subprocess.CompletedProcess:
+    environ = dict(os.environ, PYTHONPATH=str(root), PYTHONDONTWRITEBYTECODE="1")
+    return subprocess.run(
+        [sys.executable, *args], cwd=root, env=environ, capture_output=True, text=True
+    )
+
+
+def import_time_ms(module: str, root: Path) -> float:
+    result = _run(["-X", "importtime", "-c", f"import {module}"], root)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| (\S+)$", line)
+        if match and match.group(2) == module:
+            return int(match.group(1)) / 1000
+    raise RuntimeError(f"no import time reported for {module}")
+
+
+def import_side_effects(module: str, root: Path) -> str:
+    result = _run(["-c", _SIDE_EFFECTS.format(module=module)], root)
+    if result.returncode != 0:
+        return f"import failed: {result.stderr.strip()}"
+    return result.stdout.strip()
+
+
+def main() -> int:
+    root = Path(__file__).resolve().parent.parent
+    scale = float(os.getenv("IMPORT_BUDGET_SCALE", "1"))
+    failures = 0
+    for module, budget in BUDGETS_MS.items():
+        # Best of three, so a cold disk cache does not fail the check.
+        elapsed = min(import_time_ms(module, root) for _ in range(3))
+        problems = import_side_effects(module, root)
+        limit = budget * scale
+        ok = elapsed <= limit and not problems
+        failures += not ok
+        status = "ok" if ok else "FAIL"
+        print(f"{status:4} {module}: {elapsed:.0f} ms (budget {limit:.0f} ms)")
+        if problems:
+            print(f"     side effects on import: {problems}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,34 @@
+import json
+
+# orjson parses and renders the large bodies (contact pages, snapshots, CSV
+# run results) several times faster than the stdlib; it is optional and the
+# stdlib is used when it is not installed.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj):
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def loads(data: bytes | str):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        obj, ensure_ascii=False, default=_default, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def response_json(response):
+    # Drop-in for requests' response.json().
+    return loads(response.content)
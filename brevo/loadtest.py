@@ -0,0 +1,409 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# Drives the API with a configurable request mix and concurrency and reports
+# throughput, latency percentiles, error rates and event-loop lag. By default
+# the app runs in-process (called over ASGI, no sockets) against a local Brevo
+# stand-in, so the numbers measure the service itself; --url points it at a
+# running uvicorn instead.
+#
+#   python -m brevo.loadtest --concurrency 50 --requests 2000 \
+#       --mix add_contact=8,send_info=2
+
+DEFAULT_MIX = "add_contact=8,send_info=2"
+LAG_INTERVAL = 0.01
+
+
+def _contact_email(rng: random.Random, known_contacts: int) -> str:
+    # About half existing stand-in contacts (updates), half new ones (creates).
+    n = rng.randrange(max(1, known_contacts) * 2)
+    if n < known_contacts:
+        return f"contact{n}@example.com"
+    return f"loadtest{rng.randrange(10**9)}@example.com"
+
+
+def _scenarios(known_contacts: int) -> dict:
+    def add_contact(rng):
+        return (
+            "POST",
+            "/add_contact",
+            {
+                "email": _contact_email(rng, known_contacts),
+                "vendor_name": "Load Test LLC",
+                "phone": f"99559{rng.randrange(10**7):07d}",
+                "tender_code": f"T{rng.randrange(50)}",
+            },
+        )
+
+    def send_info(rng):
+        return "POST", "/send-info", {"email": _contact_email(rng, known_contacts)}
+
+    return {
+        "add_contact": add_contact,
+        "send_info": send_info,
+        "users": lambda rng: ("GET", "/users", None),
+        "accounts": lambda rng: ("GET", "/accounts", None),
+        "metrics": lambda rng: ("GET", "/metrics", None),
+    }
+
+
+def parse_mix(spec: str, scenarios: dict) -> list[tuple[str, float]]:
+    mix = []
+    for part in spec.split(","):
+        name, _, weight = part.strip().partition("=")
+        if name not in scenarios:
+            raise ValueError(
+                f"Unknown scenario {name!r}; choose from {', '.join(scenarios)}"
+            )
+        mix.append((name, float(weight or 1)))
+    if not any(weight > 0 for _, weight in mix):
+        raise ValueError("The request mix needs at least one positive weight")
+    return mix
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class _AsgiClient:
+    # Calls the ASGI app directly: the request travels the full middleware
+    # stack and event loop, minus the HTTP server.
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method: str, path: str, payload) -> int:
+        body = b"" if payload is None else json.dumps(payload).encode("utf-8")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "root_path": "",
+            "headers": [
+                (b"host", b"loadtest"),
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+            "client": ("127.0.0.1", 0),
+            "server": ("loadtest", 80),
+        }
+        status = None
+        body_sent = False
+        finished = asyncio.Event()
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body" and not message.get(
+                "more_body"
+            ):
+                finished.set()
+
+        await self.app(scope, receive, send)
+        return status
+
+    async def close(self):
+        pass
+
+
+class _HttpClient:
+    # Against a running server; requests runs on a thread per concurrent
+    # worker so the client does not become the bottleneck.
+    def __init__(self, base_url: str, concurrency: int):
+        import requests
+
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def request(self, method: str, path: str, payload) -> int:
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(
+            self.executor,
+            lambda: self.session.request(
+                method, self.base_url + path, json=payload, timeout=120
+            ),
+        )
+        return response.status_code
+
+    async def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+
+async def _measure_loop_lag(lags: list[float], stop: asyncio.Event):
+    # How late a short sleep wakes up: time the event loop spent blocked.
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(LAG_INTERVAL)
+        lags.append(max(0.0, time.perf_counter() - started - LAG_INTERVAL))
+
+
+async def run_load(
+    client,
+    mix: list[tuple[str, float]],
+    scenarios: dict,
+    concurrency: int,
+    total_requests: int | None,
+    duration: float | None,
+    seed: int,
+    measure_lag: bool,
+) -> dict:
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+    lags = []
+    issued = 0
+    deadline = time.perf_counter() + duration if duration else None
+
+    async def worker(worker_id: int):
+        nonlocal issued
+        rng = random.Random(seed + worker_id)
+        while True:
+            if total_requests is not None and issued >= total_requests:
+                return
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            issued += 1
+            name = rng.choices(names, weights)[0]
+            method, path, payload = scenarios[name](rng)
+            started = time.perf_counter()
+            try:
+                status = await client.request(method, path, payload)
+            except Exception as e:
+                status = type(e).__name__
+            latencies[name].append(time.perf_counter() - started)
+            statuses[name][str(status)] += 1
+
+    stop = asyncio.Event()
+    lag_task = (
+        asyncio.create_task(_measure_loop_lag(lags, stop)) if measure_lag else None
+    )
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    if lag_task:
+        await lag_task
+
+    return _report(latencies, statuses, lags if measure_lag else None, elapsed)
+
+
+def _is_error(status: str) -> bool:
+    return not status.isdigit() or int(status) >= 400
+
+
+def _report(latencies, statuses, lags, elapsed: float) -> dict:
+    endpoints = {}
+    all_latencies = []
+    total = errors = 0
+    for name, values in sorted(latencies.items()):
+        values.sort()
+        all_latencies += values
+        count = len(values)
+        failed = sum(n for s, n in statuses[name].items() if _is_error(s))
+        total += count
+        errors += failed
+        endpoints[name] = {
+            "requests": count,
+            "errors": failed,
+            "error_rate": failed / count if count else 0,
+            "p50_ms": percentile(values, 50) * 1000,
+            "p90_ms": percentile(values, 90) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "max_ms": values[-1] * 1000 if values else 0,
+            "statuses": dict(statuses[name]),
+        }
+    all_latencies.sort()
+    report = {
+        "elapsed_s": elapsed,
+        "requests": total,
+        "throughput_rps": total / elapsed if elapsed > 0 else 0,
+        "errors": errors,
+        "error_rate": errors / total if total else 0,
+        "p50_ms": percentile(all_latencies, 50) * 1000,
+        "p90_ms": percentile(all_latencies, 90) * 1000,
+        "p99_ms": percentile(all_latencies, 99) * 1000,
+        "endpoints": endpoints,
+        "loop_lag": None,
+    }
+    if lags is not None:
+        lags.sort()
+        report["loop_lag"] = {
+            "samples": len(lags),
+            "p50_ms": percentile(lags, 50) * 1000,
+            "p99_ms": percentile(lags, 99) * 1000,
+            "max_ms": lags[-1] * 1000 if lags else 0,
+        }
+    return report
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"{report['requests']} requests in {report['elapsed_s']:.1f}s: "
+        f"{report['throughput_rps']:.1f} req/s, "
+        f"{report['error_rate']:.1%} errors, p50 {report['p50_ms']:.0f} ms, "
+        f"p90 {report['p90_ms']:.0f} ms, p99 {report['p99_ms']:.0f} ms",
+        "",
+        f"{'endpoint':<12} {'reqs':>6} {'err%':>6} {'p50':>8} {'p90':>8} "
+        f"{'p99':>8} {'max':>8}  statuses",
+    ]
+    for name, e in report["endpoints"].items():
+        statuses = " ".join(f"{s}:{n}" for s, n in sorted(e["statuses"].items()))
+        lines.append(
+            f"{name:<12} {e['requests']:>6} {e['error_rate']:>6.1%} "
+            f"{e['p50_ms']:>6.0f}ms {e['p90_ms']:>6.0f}ms {e['p99_ms']:>6.0f}ms "
+            f"{e['max_ms']:>6.0f}ms  {statuses}"
+        )
+    lag = report["loop_lag"]
+    lines.append("")
+    if lag:
+        lines.append(
+            f"event-loop lag: p50 {lag['p50_ms']:.1f} ms, p99 {lag['p99_ms']:.1f} ms, "
+            f"max {lag['max_ms']:.1f} ms ({lag['samples']} samples)"
+        )
+    else:
+        lines.append("event-loop lag: not measured (remote server)")
+    return "\n".join(lines)
+
+
+async def _run_in_process(args, scenarios, mix) -> dict:
+    from .main import app
+
+    client = _AsgiClient(app)
+    async with app.router.lifespan_context(app):
+        await run_load(
+            client, mix, scenarios, args.concurrency, args.warmup, None, 0, False
+        )
+        return await run_load(
+            client,
+            mix,
+            scenarios,
+            args.concurrency,
+            args.requests,
+            args.duration,
+            args.seed,
+            True,
+        )
+
+
+async def _run_remote(args, scenarios, mix) -> dict:
+    client = _HttpClient(args.url, args.concurrency)
+    try:
+        await run_load(
+            client, mix, scenarios, args.concurrency, args.warmup, None, 0, False
+        )
+        return await run_load(
+            client,
+            mix,
+            scenarios,
+            args.concurrency,
+            args.requests,
+            args.duration,
+            args.seed,
+            False,
+        )
+    finally:
+        await client.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Load test the Brevo service API")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=None)
+    parser.add_argument("--duration", type=float, default=None, help="seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="name=weight,...")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured requests")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--url", help="base URL of a running server")
+    parser.add_argument(
+        "--brevo-url", help="Brevo API the in-process app calls (default: stub)"
+    )
+    parser.add_argument("--stub-contacts", type=int, default=1000)
+    parser.add_argument("--stub-latency-ms", type=float, default=50)
+    parser.add_argument("--stub-error-rate", type=float, default=0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument(
+        "--max-p99-ms", type=float, help="exit 1 if the overall p99 is above this"
+    )
+    parser.add_argument(
+        "--max-loop-lag-ms", type=float, help="exit 1 if the loop lag max is above this"
+    )
+    args = parser.parse_args(argv)
+    if args.requests is None and args.duration is None:
+        args.requests = 1000
+
+    scenarios = _scenarios(args.stub_contacts)
+    try:
+        mix = parse_mix(args.mix, scenarios)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.url:
+        report = asyncio.run(_run_remote(args, scenarios, mix))
+    else:
+        if args.brevo_url:
+            os.environ["BREVO_API_URL"] = args.brevo_url
+        else:
+            from .brevo_stub import start_stub
+
+            _, stub_url = start_stub(
+                contacts=args.stub_contacts,
+                latency=args.stub_latency_ms / 1000,
+                error_rate=args.stub_error_rate,
+            )
+            os.environ["BREVO_API_URL"] = stub_url
+            # The stand-in accepts any key; the sender is needed by /send-info.
+            os.environ.setdefault("BREVO_API_KEY", "stub-key")
+            os.environ.setdefault("SENDER_EMAIL", "loadtest@example.com")
+        report = asyncio.run(_run_in_process(args, scenarios, mix))
+
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+
+    failed = False
+    if args.max_p99_ms is not None and report["p99_ms"] > args.max_p99_ms:
+        print(f"p99 {report['p99_ms']:.0f} ms is over {args.max_p99_ms:.0f} ms")
+        failed = True
+    lag = report["loop_lag"]
+    if (
+        args.max_loop_lag_ms is not None
+        and lag
+        and lag["max_ms"] > args.max_loop_lag_ms
+    ):
+        print(
+            f"Event-loop lag {lag['max_ms']:.0f} ms is over {args.max_loop_lag_ms:.0f} ms"
+        )
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,341 @@
+import functools
+import gzip
+from bisect import bisect_right
+import json
+import os
+import re
+import time
+from datetime import datetime
+from pathlib import Path
+
+from .log_rotation import (
+    CompressingRotatingFileHandler,
+    index_path,
+    log_segments,
+)
+
+# One index entry per minute of log (split further past BUCKET_MAX_BYTES):
+# the byte range it occupies in its file, how many records of each level it
+# holds, the emails mentioned in it and the exact ranges of its warnings and
+# errors. A search only reads the byte ranges whose entry can match.
+BUCKET_FORMAT = "%Y-%m-%d %H:%M"
+BUCKET_MAX_BYTES = 64 * 1024
+EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+TEXT_LINE_RE = re.compile(r"(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) \[(\w+)\] (.+)")
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40, "CRITICAL": 50}
+
+
+def parse_log_line(line: str, source: str) -> dict:
+    line = line.strip()
+    if line.startswith("{"):
+        try:
+            record = json.loads(line)
+            return {
+                "timestamp": record.get("timestamp", ""),
+                "level": record.get("level", "INFO"),
+                "message": record.get("message", ""),
+                "source": source,
+            }
+        except ValueError:
+            pass
+
+    match = TEXT_LINE_RE.match(line)
+    if match:
+        timestamp, level, message = match.groups()
+        return {
+            "timestamp": timestamp,
+            "level": level,
+            "message": message,
+            "source": source,
+        }
+    return {
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "level": "INFO",
+        "message": line,
+        "source": source,
+    }
+
+
+class IndexedRotatingFileHandler(CompressingRotatingFileHandler):
+    def __init__(self, filename, rotate_seconds: float | None = None):
+        super().__init__(filename, rotate_seconds)
+        self._index_file = index_path(Path(self.baseFilename))
+        self._bucket = None
+        self._catch_up()
+
+    def emit(self, record):
+        try:
+            if self.shouldRollover(record):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+            line = self.format(record)
+            start = self.stream.tell()
+            self.stream.write(line + self.terminator)
+            self.flush()
+            bucket = time.strftime(BUCKET_FORMAT, time.localtime(record.created))
+            self._add(bucket, record.levelname, start, self.stream.tell(), line)
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+    def _add(self, bucket: str, level: str, start: int, end: int, line: str):
+        if self._bucket and (
+            self._bucket["bucket"] != bucket
+            or end - self._bucket["start"] > BUCKET_MAX_BYTES
+        ):
+            self._write_bucket()
+        if self._bucket is None:
+            self._bucket = {
+                "bucket": bucket,
+                "start": start,
+                "end": end,
+                "levels": {},
+                "emails": set(),
+                "alerts": [],
+            }
+        self._bucket["end"] = end
+        levels = self._bucket["levels"]
+        levels[level] = levels.get(level, 0) + 1
+        if LEVELS.get(level, 0) >= LEVELS["WARNING"]:
+            self._bucket["alerts"].append([start, end])
+        if "@" in line:
+            self._bucket["emails"].update(m.lower() for m in EMAIL_RE.findall(line))
+
+    def _write_bucket(self):
+        if self._bucket is None:
+            return
+        entry = dict(self._bucket, emails=sorted(self._bucket["emails"]))
+        with open(self._index_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._bucket = None
+
+    def _catch_up(self):
+        # Index whatever a previous process wrote without indexing it (it
+        # stopped mid-bucket, or predates the index).
+        log_path = Path(self.baseFilename)
+        entries = _read_index(self._index_file)
+        offset = entries[-1]["end"] if entries else 0
+        size = log_path.stat().st_size if log_path.exists() else 0
+        if size < offset:
+            # The log was replaced behind our back; start its index over.
+            self._index_file.unlink(missing_ok=True)
+            offset = 0
+        if size <= offset:
+            return
+        with open(log_path, "rb") as f:
+            f.seek(offset)
+            bucket = None
+            for raw in f:
+                line = raw.decode("utf-8", errors="replace")
+                record = parse_log_line(line, log_path.name)
+                bucket = record["timestamp"][:16] or bucket or ""
+                self._add(bucket, record["level"], offset, offset + len(raw), line)
+                offset += len(raw)
+        self._write_bucket()
+
+    def rotated(self, segment: Path):
+        self._write_bucket()
+        if self._index_file.exists():
+            os.replace(self._index_file, index_path(segment))
+
+    def close(self):
+        self.acquire()
+        try:
+            self._write_bucket()
+        finally:
+            self.release()
+        super().close()
+
+
+def _read_index(path: Path) -> list[dict]:
+    if not path.exists():
+        return []
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            entry["emails"] = set(entry.get("emails", ()))
+            entries.append(entry)
+    return entries
+
+
+# Rotated segments never change, and the live index only grows once a
+# minute, so parsed indexes are cached by modification time.
+@functools.lru_cache(maxsize=512)
+def _cached_index(path: str, mtime_ns: int) -> list[dict]:
+    return _read_index(Path(path))
+
+
+def load_index(log_file: Path) -> list[dict] | None:
+    path = index_path(log_file)
+    try:
+        mtime_ns = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    return _cached_index(str(path), mtime_ns)
+
+
+def _open_binary(path: Path):
+    if path.suffix == ".gz":
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+class _RangeReader:
+    # Reads uncompressed byte ranges of a log file. A segment compressed one
+    # gzip member per index entry only has the members a range touches
+    # decompressed; any other .gz file is decompressed from its start.
+    def __init__(self, path: Path, entries: list[dict] | None):
+        self._members = None
+        if path.suffix == ".gz" and entries and all("gz" in entry for entry in entries):
+            self._members = sorted(
+                (entry["start"], entry["end"], *entry["gz"]) for entry in entries
+            )
+            self._starts = [member[0] for member in self._members]
+            self._cached = (None, b"")
+            self._file = open(path, "rb")
+        else:
+            self._file = _open_binary(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+    def _member(self, position: int) -> bytes:
+        if self._cached[0] != position:
+            gz_start, gz_end = self._members[position][2:]
+            self._file.seek(gz_start)
+            self._cached = (
+                position,
+                gzip.decompress(self._file.read(gz_end - gz_start)),
+            )
+        return self._cached[1]
+
+    def read(self, start: int, end: int | None) -> bytes:
+        if self._members is None:
+            self._file.seek(start)
+            return self._file.read() if end is None else self._file.read(end - start)
+        if end is None:
+            end = self._members[-1][1]
+        parts = []
+        position = max(0, bisect_right(self._starts, start) - 1)
+        while start < end and position < len(self._members):
+            member_start, member_end = self._members[position][:2]
+            if member_end > start:
+                data = self._member(position)
+                parts.append(
+                    data[max(start, member_start) - member_start : end - member_start]
+                )
+                start = member_end
+            position += 1
+        return b"".join(parts)
+
+
+def _entry_matches(entry, start_bucket, end_bucket, min_level, email) -> bool:
+    if start_bucket and entry["bucket"] < start_bucket:
+        return False
+    if end_bucket and entry["bucket"] > end_bucket:
+        return False
+    if min_level and not any(
+        LEVELS.get(level, 0) >= min_level for level in entry["levels"]
+    ):
+        return False
+    if email and email not in entry["emails"]:
+        return False
+    return True
+
+
+def _merge_ranges(ranges: list[tuple]) -> list[tuple]:
+    merged = []
+    for start, end in sorted(ranges, key=lambda r: r[0]):
+        if merged and merged[-1][1] is not None and start <= merged[-1][1]:
+            last_start, last_end = merged[-1]
+            merged[-1] = (last_start, None if end is None else max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def search_log(
+    log_path: Path,
+    start: str | None = None,
+    end: str | None = None,
+    level: str | None = None,
+    email: str | None = None,
+    text: str | None = None,
+    limit: int = 100,
+    max_segments: int | None = None,
+) -> tuple[list[dict], dict]:
+    log_path = Path(log_path)
+    min_level = LEVELS.get(level.upper(), 0) if level else 0
+    email = email.lower() if email else None
+    text = text.lower() if text else None
+    start_bucket = start[:16] if start else None
+    end_bucket = end[:16] if end else None
+    stats = {"segments": 0, "bytes_read": 0}
+
+    sources = [log_path] if log_path.exists() else []
+    sources += log_segments(log_path)[:max_segments]
+
+    matches = []
+    for source in sources:
+        entries = load_index(source)
+        if entries is None:
+            ranges = [(0, None)]
+        else:
+            ranges = []
+            for entry in entries:
+                if not _entry_matches(
+                    entry, start_bucket, end_bucket, min_level, email
+                ):
+                    continue
+                if min_level >= LEVELS["WARNING"]:
+                    # Only the warning and error lines themselves can match.
+                    ranges += [tuple(alert) for alert in entry.get("alerts", ())]
+                else:
+                    ranges.append((entry["start"], entry["end"]))
+            if source == log_path:
+                # The bucket being written is not in the index yet.
+                covered = entries[-1]["end"] if entries else 0
+                ranges.append((covered, None))
+        if not ranges:
+            continue
+
+        stats["segments"] += 1
+        found = []
+        try:
+            with _RangeReader(source, entries) as reader:
+                for range_start, range_end in _merge_ranges(ranges):
+                    chunk = reader.read(range_start, range_end)
+                    stats["bytes_read"] += len(chunk)
+                    for raw in chunk.decode("utf-8", errors="replace").splitlines():
+                        if not raw.strip():
+                            continue
+                        if email and email not in raw.lower():
+                            continue
+                        record = parse_log_line(raw, log_path.name)
+                        if start and record["timestamp"] < start:
+                            continue
+                        if end and record["timestamp"] > end:
+                            continue
+                        if min_level and LEVELS.get(record["level"], 0) < min_level:
+                            continue
+                        if text and text not in record["message"].lower():
+                            continue
+                        found.append(record)
+        except FileNotFoundError:
+            # Compressed by the archiver after it was listed.
+            continue
+
+        matches.extend(reversed(found))
+        if len(matches) >= limit:
+            break
+
+    return matches[:limit], stats
@@ -0,0 +1,248 @@
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+
+SEGMENT_TIME_FORMAT = "%Y%m%d-%H%M%S"
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def archive_dir() -> Path:
+    return Path(os.getenv("LOG_ARCHIVE_DIR", "logs"))
+
+
+def max_bytes() -> int:
+    return int(_env_number("LOG_MAX_BYTES", 10 * 1024 * 1024))
+
+
+def _segment_path(log_path: Path) -> Path:
+    directory = archive_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime(SEGMENT_TIME_FORMAT)
+    segment = directory / f"{log_path.name}.{stamp}"
+    # Several rotations within one second get increasing suffixes, above any
+    # still on disk so that ordering survives pruning.
+    same_second = [
+        _segment_order(p)[1]
+        for p in directory.glob(f"{log_path.name}.{stamp}*")
+        if not p.name.endswith(".tmp")
+    ]
+    if same_second:
+        segment = directory / f"{log_path.name}.{stamp}-{max(same_second) + 1}"
+    return segment
+
+
+def _segment_order(segment: Path):
+    # <name>.<YYYYmmdd-HHMMSS>[-<n>][.gz]; n breaks ties within one second.
+    parts = segment.name.removesuffix(".gz").rsplit(".", 1)[-1].split("-")
+    counter = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 0
+    return parts[:2], counter
+
+
+def log_segments(log_path: Path) -> list[Path]:
+    # Rotated segments of log_path, newest first. Names carry their rotation
+    # time, so sorting by name is sorting by age.
+    directory = archive_dir()
+    if not directory.exists():
+        return []
+    prefix = f"{Path(log_path).name}."
+    segments = [
+        p
+        for p in directory.iterdir()
+        if p.name.startswith(prefix) and not p.name.endswith((".tmp", ".idx"))
+    ]
+    return sorted(segments, key=_segment_order, reverse=True)
+
+
+def index_path(path: Path) -> Path:
+    # The search index of a log file or segment; it keeps its uncompressed name.
+    path = Path(path)
+    return path.with_name(path.name.removesuffix(".gz") + ".idx")
+
+
+def open_segment(path: Path):
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, "r", encoding="utf-8", errors="replace")
+
+
+def _index_entries(path: Path) -> list[dict]:
+    if not path.exists():
+        return []
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+    return sorted(entries, key=lambda entry: entry["start"])
+
+
+def _compress_members(src, dst, entries: list[dict]):
+    # One gzip member per index entry, its compressed range recorded in the
+    # entry as "gz", so a search decompresses only the entries it reads.
+    # Concatenated members still read as one stream.
+    for entry in entries:
+        if src.tell() < entry["start"]:
+            dst.write(gzip.compress(src.read(entry["start"] - src.tell())))
+        elif src.tell() > entry["start"]:
+            src.seek(entry["start"])
+        gz_start = dst.tell()
+        dst.write(gzip.compress(src.read(entry["end"] - entry["start"])))
+        entry["gz"] = [gz_start, dst.tell()]
+    rest = src.read()
+    if rest:
+        dst.write(gzip.compress(rest))
+
+
+def _compress(segment: Path):
+    if segment.suffix == ".gz" or not segment.exists():
+        return
+    target = segment.with_name(segment.name + ".gz")
+    tmp_target = target.with_name(target.name + ".tmp")
+    index = index_path(segment)
+    entries = _index_entries(index)
+    if entries:
+        with open(segment, "rb") as src, open(tmp_target, "wb") as dst:
+            _compress_members(src, dst, entries)
+        tmp_index = index.with_name(index.name + ".tmp")
+        with open(tmp_index, "w", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp_target, target)
+        os.replace(tmp_index, index)
+    else:
+        with open(segment, "rb") as src, gzip.open(tmp_target, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(tmp_target, target)
+    segment.unlink()
+
+
+def _prune(log_path: Path):
+    keep = int(_env_number("LOG_BACKUP_COUNT", 10))
+    max_age = _env_number("LOG_RETENTION_DAYS", 14) * 86400
+    now = time.time()
+    for index, segment in enumerate(log_segments(log_path)):
+        too_old = max_age > 0 and now - segment.stat().st_mtime > max_age
+        if index >= keep or too_old:
+            segment.unlink(missing_ok=True)
+            index_path(segment).unlink(missing_ok=True)
+
+
+class _Archiver:
+    # Compression and pruning run on their own thread so that a rollover only
+    # costs a rename on the logging path.
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, log_path: Path):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="log-archiver", daemon=True
+                )
+                self._thread.start()
+        self._queue.put(Path(log_path))
+
+    def _run(self):
+        while True:
+            log_path = self._queue.get()
+            try:
+                for segment in log_segments(log_path):
+                    _compress(segment)
+                _prune(log_path)
+            except Exception as e:
+                # Logging from here could recurse into a rollover.
+                print(f"Log archiving failed for {log_path}: {e}")
+
+
+archiver = _Archiver()
+
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    def __init__(self, filename, rotate_seconds: float | None = None):
+        super().__init__(filename, maxBytes=max_bytes(), encoding="utf-8")
+        if rotate_seconds is None:
+            rotate_seconds = _env_number("LOG_ROTATE_HOURS", 24) * 3600
+        self.rotate_seconds = rotate_seconds
+        self._rollover_at = time.time() + rotate_seconds
+        # Finish any compression a previous process left behind.
+        archiver.submit(Path(self.baseFilename))
+
+    def shouldRollover(self, record) -> bool:
+        if self.rotate_seconds > 0 and time.time() >= self._rollover_at:
+            if self.stream is None:
+                self.stream = self._open()
+            if self.stream.tell() > 0:
+                return True
+            self._rollover_at = time.time() + self.rotate_seconds
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        log_path = Path(self.baseFilename)
+        if log_path.exists() and log_path.stat().st_size > 0:
+            segment = _segment_path(log_path)
+            os.replace(log_path, segment)
+            self.rotated(segment)
+            archiver.submit(log_path)
+        self.stream = self._open()
+        self._rollover_at = time.time() + self.rotate_seconds
+
+    def rotated(self, segment: Path):
+        pass
+
+
+def rotate_external_log(log_path: Path) -> Path | None:
+    # For files written by a process we do not own (stdout redirects from the
+    # run scripts): copy the content out, then truncate in place so the writer
+    # keeps its handle. Lines written between the two steps are lost.
+    log_path = Path(log_path)
+    if not log_path.exists() or log_path.stat().st_size <= max_bytes():
+        return None
+    segment = _segment_path(log_path)
+    shutil.copyfile(log_path, segment)
+    with open(log_path, "r+b") as f:
+        f.truncate(0)
+    archiver.submit(log_path)
+    return segment
+
+
+def recent_log_lines(log_path: Path, count: int, max_segments: int = 2) -> list[str]:
+    # The last `count` lines of a log, continuing into its newest rotated
+    # segments when the live file alone is shorter than that.
+    log_path = Path(log_path)
+    sources = [log_path] if log_path.exists() else []
+    sources += log_segments(log_path)[:max_segments]
+
+    lines = []
+    for source in sources:
+        needed = count - len(lines)
+        if needed <= 0:
+            break
+        try:
+            with open_segment(source) as f:
+                lines = list(deque(f, maxlen=needed)) + lines
+        except FileNotFoundError:
+            # Compressed (and renamed) by the archiver since it was listed.
+            continue
+    return lines
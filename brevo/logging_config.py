@@ -0,0 +1,153 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+
+from .log_index import IndexedRotatingFileHandler
+
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Per-row detail goes to this channel. It is DEBUG-only unless
+# LOG_ROW_SAMPLE_RATE asks for a sampled share of it at normal levels.
+ROW_LOGGER_NAME = "brevo.rows"
+
+_STANDARD_ATTRS = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__.keys()) | {
+    "message",
+    "asctime",
+}
+
+_lock = threading.Lock()
+_listener = None
+_queue_handler = None
+# Lock files of the logs this process writes, held until it exits.
+_log_file_locks = []
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": self.formatTime(record, DATE_FORMAT),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class _RecordQueueHandler(logging.handlers.QueueHandler):
+    # The stock QueueHandler turns the record into its final text in the
+    # caller's thread. Here only the message is merged with its arguments
+    # (they may be mutated after the call returns, before the listener gets to
+    # them) and the traceback rendered; the handlers' formatters, with the
+    # JSON encoding, run on the listener thread.
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def configure_logging(log_file=None, level: str | None = None):
+    global _listener, _queue_handler
+
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            logging.getLogger().removeHandler(_queue_handler)
+
+        stream_handler = logging.StreamHandler()
+        if os.getenv("LOG_STREAM_FORMAT", "text") == "json":
+            stream_handler.setFormatter(JsonFormatter())
+        else:
+            stream_handler.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+        handlers = [stream_handler]
+
+        if log_file:
+            # Rotates by size and age; old segments are gzipped and pruned.
+            # A per-minute index next to each segment backs /logs/search.
+            file_handler = IndexedRotatingFileHandler(log_file)
+            file_handler.setFormatter(JsonFormatter())
+            handlers.append(file_handler)
+
+        log_queue = queue.SimpleQueue()
+        _queue_handler = _RecordQueueHandler(log_queue)
+        _listener = logging.handlers.QueueListener(
+            log_queue, *handlers, respect_handler_level=True
+        )
+        _listener.start()
+
+        root = logging.getLogger()
+        root.addHandler(_queue_handler)
+        root.setLevel(level or os.getenv("LOG_LEVEL", "INFO").upper())
+
+        row_logger = logging.getLogger(ROW_LOGGER_NAME)
+        for existing in list(row_logger.filters):
+            row_logger.removeFilter(existing)
+        sample_rate = _env_float("LOG_ROW_SAMPLE_RATE", 0.0)
+        if sample_rate > 0:
+            row_logger.setLevel(logging.DEBUG)
+            row_logger.addFilter(SamplingFilter(min(sample_rate, 1.0)))
+        else:
+            row_logger.setLevel(logging.NOTSET)
+
+
+def claim_log_file(log_file) -> bool:
+    # A log file has one writer, which also rotates and indexes it. Under
+    # `uvicorn --workers N` the first process takes it and the others log to
+    # their stream only. Without fcntl (Windows) the run scripts start a
+    # single API process.
+    try:
+        import fcntl
+    except ImportError:
+        return True
+    lock = open(f"{log_file}.lock", "a")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return False
+    _log_file_locks.append(lock)
+    return True
+
+
+def shutdown_logging():
+    global _listener
+
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+atexit.register(shutdown_logging)
@@ -1,9 +1,74 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from pathlib import Path
+
 from fastapi import FastAPI
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from .router import router
+from fastapi.responses import FileResponse, JSONResponse
+from starlette.datastructures import Headers, QueryParams
+from .accounts import UnknownAccount, use_account, validate_account
+from .logging_config import claim_log_file, configure_logging
+from .router import FastJSONResponse, router
+from .settings import load_env
+
+# The API's own JSON log, indexed and rotated like brevo_service.log; uvicorn's
+# stdout still goes to api_service.log.
+log_file = Path("brevo_api.log")
+
+
+async def _warm_up():
+    from .brevo_service import warm_up
+
+    try:
+        await asyncio.to_thread(warm_up)
+        logging.info("Warm-up finished: connection pool, template and snapshot ready")
+    except Exception as e:
+        logging.warning(f"Warm-up failed: {str(e)}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    load_env()
+    configure_logging(log_file=log_file if claim_log_file(log_file) else None)
+    # Runs in the background so the app accepts requests straight away.
+    warm_up_task = asyncio.create_task(_warm_up())
+    yield
+    warm_up_task.cancel()
+
+
+class AccountMiddleware:
+    # Requests pick their Brevo account with an X-Brevo-Account header or an
+    # ?account= parameter (default account otherwise); everything they call,
+    # worker threads included, then acts for that account.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        account = Headers(scope=scope).get("x-brevo-account") or QueryParams(
+            scope["query_string"]
+        ).get("account")
+        try:
+            account = validate_account(account)
+        except UnknownAccount as e:
+            response = JSONResponse({"detail": str(e)}, status_code=400)
+            return await response(scope, receive, send)
+        with use_account(account):
+            await self.app(scope, receive, send)
+
 
-app = FastAPI(title="Brevo Background Service")
+app = FastAPI(
+    title="Brevo Background Service",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse,
+)
+app.add_middleware(AccountMiddleware)
+# Contact lists and CSV run results run to megabytes; small bodies are not
+# worth compressing.
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -0,0 +1,328 @@
+import threading
+import time
+import logging
+from bisect import bisect_left
+from urllib.parse import urlsplit
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TASK_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 1800.0, 3600.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape_label(value) -> str:
+    # The exposition format's escapes for label values.
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, labelvalues, extra: str = "") -> str:
+    pairs = [
+        f'{name}="{_escape_label(value)}"'
+        for name, value in zip(labelnames, labelvalues)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount: float = 1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labelvalues, value in items:
+            yield self.name, _format_labels(self.labelnames, labelvalues), value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labelvalues -> [per-bucket counts..., +Inf count, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labelvalues)
+            if state is None:
+                state = [0] * (len(self.buckets) + 2)
+                self._values[labelvalues] = state
+            state[index] += 1
+            state[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        for labelvalues, state in items:
+            cumulative = 0
+            for upper, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(upper)}"'
+                yield (
+                    f"{self.name}_bucket",
+                    _format_labels(self.labelnames, labelvalues, le),
+                    cumulative,
+                )
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum", labels, state[-1]
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+API_REQUEST_DURATION = REGISTRY.register(
+    Histogram(
+        "brevo_api_request_duration_seconds",
+        "Latency of Brevo API requests.",
+        ("endpoint", "method"),
+    )
+)
+API_RESPONSES = REGISTRY.register(
+    Counter(
+        "brevo_api_responses_total",
+        "Brevo API responses by status code ('error' for transport failures).",
+        ("endpoint", "method", "status"),
+    )
+)
+API_RATE_LIMITED = REGISTRY.register(
+    Counter(
+        "brevo_api_rate_limited_total",
+        "Brevo API responses with HTTP 429.",
+        ("endpoint",),
+    )
+)
+API_RETRIES = REGISTRY.register(
+    Counter(
+        "brevo_api_retries_total",
+        "Brevo API requests re-sent after a failed attempt.",
+        ("reason",),
+    )
+)
+CIRCUIT_STATE = REGISTRY.register(
+    Gauge(
+        "brevo_api_circuit_state",
+        "Brevo API circuit breaker state (0 closed, 1 open, 2 half-open).",
+        ("account",),
+    )
+)
+CIRCUIT_REJECTED = REGISTRY.register(
+    Counter(
+        "brevo_api_circuit_rejected_total",
+        "Brevo API requests refused while the circuit was open.",
+        ("account",),
+    )
+)
+SMS_INDEX_DROPS = REGISTRY.register(
+    Counter(
+        "brevo_sms_index_drops_total",
+        "CSV rows sent without SMS because the local index found the number taken.",
+        (),
+    )
+)
+CSV_ROWS = REGISTRY.register(
+    Counter(
+        "brevo_csv_rows_total",
+        "CSV rows handled across all runs.",
+        ("outcome",),
+    )
+)
+CSV_RUNS = REGISTRY.register(Counter("brevo_csv_runs_total", "CSV runs started.", ()))
+CSV_LAST_RUN = REGISTRY.register(
+    Gauge(
+        "brevo_csv_last_run",
+        "Figures from the most recent CSV run.",
+        ("field",),
+    )
+)
+CONTACT_CACHE_LOOKUPS = REGISTRY.register(
+    Counter(
+        "brevo_contact_cache_lookups_total",
+        "Lookups of CSV emails against the existing contact set.",
+        ("result",),
+    )
+)
+WEBHOOK_EVENTS = REGISTRY.register(
+    Counter(
+        "brevo_webhook_events_total",
+        "Brevo webhook events received, by whether they changed the contact cache.",
+        ("event", "outcome"),
+    )
+)
+REQUEST_QUEUE_DEPTH = REGISTRY.register(
+    Gauge(
+        "brevo_request_queue_depth",
+        "Brevo calls waiting for the account's rate budget, by priority class.",
+        ("account", "priority"),
+    )
+)
+REQUEST_WAIT = REGISTRY.register(
+    Histogram(
+        "brevo_request_wait_seconds",
+        "Time Brevo calls waited for the account's rate budget, by priority class.",
+        ("account", "priority"),
+    )
+)
+RETRY_ITEMS = REGISTRY.register(
+    Counter(
+        "brevo_retry_items_total",
+        "Failed upserts and sends moving through the retry queue.",
+        ("kind", "outcome"),
+    )
+)
+TASK_DURATION = REGISTRY.register(
+    Histogram(
+        "brevo_scheduler_task_duration_seconds",
+        "Duration of background service scheduled tasks.",
+        ("task",),
+        buckets=TASK_BUCKETS,
+    )
+)
+TASK_FAILURES = REGISTRY.register(
+    Counter(
+        "brevo_scheduler_task_failures_total",
+        "Scheduled tasks that raised an exception.",
+        ("task",),
+    )
+)
+
+
+def endpoint_label(url: str) -> str:
+    parts = urlsplit(url).path.strip("/").split("/")
+    # Paths look like v3/<resource>[/<sub>]...
+    resource = parts[1] if len(parts) > 1 else ""
+    if resource == "contacts":
+        if len(parts) > 2 and parts[2] in ("folders", "lists"):
+            return parts[2]
+        return "contacts"
+    if resource == "emailCampaigns":
+        return "campaigns"
+    if resource == "smtp":
+        return "smtp"
+    return resource or "unknown"
+
+
+def observe_api_call(url: str, method: str, status, elapsed: float):
+    endpoint = endpoint_label(url)
+    API_REQUEST_DURATION.observe(elapsed, endpoint, method)
+    API_RESPONSES.inc(endpoint, method, str(status))
+    if status == 429:
+        API_RATE_LIMITED.inc(endpoint)
+
+
+def record_csv_run(processed: int, failed: int, elapsed: float, hits: int, misses: int):
+    CSV_RUNS.inc()
+    CSV_ROWS.inc("processed", amount=processed)
+    CSV_ROWS.inc("failed", amount=failed)
+    CSV_LAST_RUN.set(processed, "rows_processed")
+    CSV_LAST_RUN.set(failed, "rows_failed")
+    CSV_LAST_RUN.set(elapsed, "duration_seconds")
+    CSV_LAST_RUN.set(
+        (processed + failed) / elapsed if elapsed > 0 else 0, "rows_per_second"
+    )
+    CONTACT_CACHE_LOOKUPS.inc("hit", amount=hits)
+    CONTACT_CACHE_LOOKUPS.inc("miss", amount=misses)
+    lookups = hits + misses
+    CSV_LAST_RUN.set(hits / lookups if lookups else 0, "contact_cache_hit_ratio")
+    CSV_LAST_RUN.set(time.time(), "finished_timestamp_seconds")
+
+
+def timed_task(name: str, func):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            TASK_FAILURES.inc(name)
+            raise
+        finally:
+            TASK_DURATION.observe(time.perf_counter() - start, name)
+
+    wrapper.__name__ = getattr(func, "__name__", name)
+    return wrapper
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0"):
+    # Only the background service serves metrics itself; keep http.server
+    # out of every other import of this module.
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_metrics().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(
+        target=server.serve_forever, name="metrics-server", daemon=True
+    )
+    thread.start()
+    logging.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,159 @@
+import math
+import re
+import time
+from collections import Counter
+
+from .brevo_service import (
+    LIST_ADD_BATCH,
+    _get_csv_reader,
+    _snapshot_is_fresh,
+    build_attributes,
+    extract_contact_data,
+    extract_email,
+    merge_tender_codes,
+)
+from .contact_cache import cached_id, load_snapshot
+from .row_fingerprints import open_fingerprint_store, row_fingerprint
+from .sms_index import SmsIndex
+
+EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+CONTACTS_PAGE_SIZE = 1000
+
+
+class SnapshotUnavailable(Exception):
+    pass
+
+
+def _planned_tender_code(new_code: str, old_code: str) -> str:
+    if new_code and old_code:
+        return merge_tender_codes(new_code, old_code)
+    return new_code or old_code
+
+
+def plan_csv(file_bytes: bytes, snapshot=None, max_items: int | None = 1000) -> dict:
+    started = time.perf_counter()
+    if snapshot is None:
+        snapshot = load_snapshot()
+    if snapshot is None:
+        raise SnapshotUnavailable(
+            "No contact snapshot available yet; it is written by every CSV run"
+        )
+
+    existing_emails = snapshot["emails"]
+    detailed = snapshot["detailed"]
+
+    sms_index = SmsIndex.from_contacts(detailed)
+    fingerprints = open_fingerprint_store(read_only=True)
+
+    counts = Counter()
+    items = []
+    seen_emails = set()
+    upserts = 0
+    # Rows an earlier run already applied only join the campaign list.
+    list_only = 0
+
+    try:
+        for row_number, row in enumerate(_get_csv_reader(file_bytes), start=2):
+            counts["rows"] += 1
+            email = extract_email(row)
+            item = {"row": row_number, "email": email, "issues": []}
+
+            if not email:
+                counts["missing_email"] += 1
+                item.update(action="skip", issues=["missing_email"])
+            elif not EMAIL_RE.match(email):
+                counts["invalid_email"] += 1
+                # The run still sends it and Brevo rejects it: one upsert, one
+                # error in the results.
+                item.update(action="reject", issues=["invalid_email"])
+                upserts += 1
+            else:
+                contact_data = extract_contact_data(row)
+                sms_owner = sms_index.claim(contact_data.get("phone"), email)
+                if sms_owner:
+                    # The run drops the number before sending, as it does here.
+                    contact_data.pop("phone")
+                    counts["duplicate_sms"] += 1
+                    item["issues"].append("duplicate_sms")
+                    item["sms_owner"] = sms_owner
+                already_applied = (
+                    fingerprints is not None
+                    and email in existing_emails
+                    and fingerprints.seen(row_fingerprint(email, contact_data))
+                )
+                existing = detailed.get(email)
+                old_attributes = (existing or {}).get("attributes") or {}
+                if existing:
+                    contact_data["tender_code"] = _planned_tender_code(
+                        contact_data.get("tender_code", ""),
+                        old_attributes.get("TENDER_CODE", ""),
+                    )
+                attributes = build_attributes(contact_data)
+
+                if email in seen_emails:
+                    counts["duplicate_rows"] += 1
+                    item["issues"].append("duplicate_row")
+                seen_emails.add(email)
+
+                if email in existing_emails:
+                    item["action"] = "update"
+                    counts["updates"] += 1
+                    changes = {
+                        key: {"from": old_attributes.get(key), "to": value}
+                        for key, value in attributes.items()
+                        if old_attributes.get(key) != value
+                    }
+                    if changes:
+                        item["changes"] = changes
+                        counts["attribute_changes"] += 1
+                    else:
+                        counts["unchanged"] += 1
+                    if existing and existing.get("emailBlacklisted"):
+                        counts["email_blacklisted"] += 1
+                        item["issues"].append("email_blacklisted")
+                    if existing and existing.get("smsBlacklisted"):
+                        counts["sms_blacklisted"] += 1
+                        item["issues"].append("sms_blacklisted")
+                else:
+                    item["action"] = "create"
+                    item["attributes"] = attributes
+                    counts["creates"] += 1
+
+                if already_applied:
+                    counts["already_applied"] += 1
+                    item["already_applied"] = True
+                    list_only += 1
+                else:
+                    upserts += 1
+
+            if max_items is None or len(items) < max_items:
+                items.append(item)
+    finally:
+        if fingerprints:
+            fingerprints.close()
+
+    # The calls a run makes: a fresh snapshot skips the download, which is
+    # one pass of pages until a short one; the folder id is cached.
+    contact_pages = len(existing_emails) // CONTACTS_PAGE_SIZE + 1
+    expected_api_calls = {
+        "contact_download": 0 if _snapshot_is_fresh(snapshot) else contact_pages,
+        "folder_lookup": 0 if cached_id("folder", "Winners") else 1,
+        "list_creation": 1,
+        "campaign_creation": 1,
+        "contact_upserts": upserts,
+        "list_additions": math.ceil(list_only / LIST_ADD_BATCH),
+        "campaign_send": 1,
+    }
+    expected_api_calls["total"] = sum(expected_api_calls.values())
+
+    return {
+        "summary": dict(counts),
+        "expected_api_calls": expected_api_calls,
+        "snapshot": {
+            "contacts": len(existing_emails),
+            "fetched_at": snapshot.get("fetched_at"),
+        },
+        "items": items,
+        "items_truncated": max_items is not None and counts["rows"] > len(items),
+        "planning_seconds": round(time.perf_counter() - started, 3),
+    }
@@ -0,0 +1,178 @@
+import collections
+import contextlib
+import contextvars
+import threading
+import time
+
+
+class RateLimiter:
+    def __init__(self, rate_per_second: float, burst: int | None = None):
+        self.rate = rate_per_second
+        self.capacity = burst if burst is not None else max(1, int(rate_per_second))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    def acquire(self) -> float:
+        if self.rate <= 0:
+            return 0.0
+
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+# What the current call is for. API requests a user waits on mark themselves
+# interactive; everything else (CSV runs, contact syncs, health checks, the
+# retry drain) is batch. Carried into worker threads like the account.
+_current_priority = contextvars.ContextVar("brevo_priority", default=BATCH)
+
+
+def current_priority() -> str:
+    return _current_priority.get()
+
+
+@contextlib.contextmanager
+def use_priority(priority: str):
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+class RequestScheduler(RateLimiter):
+    # One token bucket per account, handed out by priority class. While both
+    # classes wait, grants are split by share (stride scheduling), so neither
+    # starves the other. Batch work alone uses the whole rate but leaves
+    # `reserve` tokens in the bucket, so an interactive request arriving
+    # mid-run goes out at once instead of queueing behind the run.
+    def __init__(
+        self,
+        rate_per_second: float,
+        interactive_share: float = 0.8,
+        reserve: int | None = None,
+        burst: int | None = None,
+        on_wait=None,
+        on_queue=None,
+    ):
+        super().__init__(rate_per_second, burst)
+        share = min(max(interactive_share, 0.01), 0.99)
+        self.shares = {INTERACTIVE: share, BATCH: 1 - share}
+        if reserve is None:
+            reserve = max(1, int(self.capacity * 0.2))
+        self._reserve = reserve
+        self.reserve = min(reserve, max(0, self.capacity - 1))
+        # on_wait(priority, seconds) is called for every grant and
+        # on_queue(priority, depth) whenever a class's queue changes.
+        self.on_wait = on_wait
+        self.on_queue = on_queue
+        self._changed = threading.Condition(self._lock)
+        self._waiting = {priority: collections.deque() for priority in self.shares}
+        self._pass = {priority: 0.0 for priority in self.shares}
+        self._granted = {priority: 0 for priority in self.shares}
+        self._waited = {priority: 0.0 for priority in self.shares}
+
+    def _next_class(self) -> str | None:
+        waiting = [p for p in self.shares if self._waiting[p]]
+        if not waiting:
+            return None
+        return min(waiting, key=lambda p: self._pass[p])
+
+    def _needed(self, priority: str) -> float:
+        if priority == BATCH and not self._waiting[INTERACTIVE]:
+            return 1 + self.reserve
+        return 1
+
+    def acquire(self, priority: str | None = None) -> float:
+        if self.rate <= 0:
+            return 0.0
+        priority = priority or current_priority()
+        ticket = object()
+        start = time.monotonic()
+        with self._changed:
+            queue = self._waiting[priority]
+            if not queue:
+                # A class coming back from idle does not get to spend the
+                # turns it skipped.
+                floor = min(
+                    (self._pass[p] for p in self.shares if self._waiting[p]),
+                    default=max(self._pass.values()),
+                )
+                self._pass[priority] = max(self._pass[priority], floor)
+            queue.append(ticket)
+            self._queue_changed(priority)
+            try:
+                while True:
+                    self._refill(time.monotonic())
+                    turn = self._next_class()
+                    if turn != priority or queue[0] is not ticket:
+                        # Woken by the next grant or arrival.
+                        self._changed.wait()
+                        continue
+                    needed = self._needed(turn)
+                    if self._tokens >= needed:
+                        break
+                    self._changed.wait((needed - self._tokens) / self.rate)
+                self._tokens -= 1
+                self._pass[priority] += 1 / self.shares[priority]
+                waited = time.monotonic() - start
+                self._granted[priority] += 1
+                self._waited[priority] += waited
+            finally:
+                queue.remove(ticket)
+                self._queue_changed(priority)
+        if self.on_wait:
+            self.on_wait(priority, waited)
+        return waited
+
+    def set_rate(self, rate_per_second: float) -> float:
+        # Returns the previous rate. The burst follows the new rate, and the
+        # reserve shrinks with it so batch work can still get through.
+        with self._changed:
+            self._refill(time.monotonic())
+            previous = self.rate
+            self.rate = rate_per_second
+            self.capacity = max(1, int(rate_per_second))
+            self._tokens = min(self._tokens, self.capacity)
+            self.reserve = min(self._reserve, max(0, self.capacity - 1))
+            self._changed.notify_all()
+        return previous
+
+    def _queue_changed(self, priority: str):
+        # Whose turn it is, and how much batch must leave, may have changed.
+        self._changed.notify_all()
+        if self.on_queue:
+            self.on_queue(priority, len(self._waiting[priority]))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                priority: {
+                    "waiting": len(self._waiting[priority]),
+                    "granted": self._granted[priority],
+                    "mean_wait_seconds": (
+                        round(self._waited[priority] / self._granted[priority], 4)
+                        if self._granted[priority]
+                        else 0.0
+                    ),
+                }
+                for priority in self.shares
+            }
@@ -0,0 +1,183 @@
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+from . import json_codec
+from .accounts import DEFAULT_ACCOUNT, account_env, current_account
+from .settings import env
+
+SAMPLE_ERRORS = 5
+
+_RUN_ID_RE = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+
+def results_dir() -> Path:
+    base = Path(env("CSV_RESULTS_DIR", "csv_results"))
+    # Runs of the other Brevo accounts are listed and read apart from these.
+    account = current_account()
+    return base if account == DEFAULT_ACCOUNT else base / account
+
+
+def prune_results(directory: Path):
+    # Results of runs older than CSV_RESULTS_RETENTION_DAYS (default 30, 0
+    # keeps them all) go when a new run starts.
+    days = float(account_env("CSV_RESULTS_RETENTION_DAYS", "30"))
+    if days <= 0:
+        return
+    cutoff = time.time() - days * 86400
+    for path in directory.glob("*.jsonl"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except OSError as e:
+            logging.warning(f"Could not prune results file {path}: {str(e)}")
+
+
+def new_run_id() -> str:
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+
+
+class RunResults:
+    def __init__(self, run_id: str | None = None, path: Path | None = None):
+        self.run_id = run_id or new_run_id()
+        if path is None:
+            directory = results_dir()
+            directory.mkdir(parents=True, exist_ok=True)
+            prune_results(directory)
+            path = directory / f"{self.run_id}.jsonl"
+        self.path = path
+        self.counts = Counter()
+        self.sample_errors = []
+        self._lock = threading.Lock()
+        self._file = open(path, "w", encoding="utf-8")
+
+    def _write(self, outcome: str, email: str, fields: dict):
+        line = json.dumps(
+            {"outcome": outcome, "email": email, **fields}, ensure_ascii=False
+        )
+        with self._lock:
+            self._file.write(line + "\n")
+            self.counts[outcome] += 1
+            if outcome == "error" and len(self.sample_errors) < SAMPLE_ERRORS:
+                self.sample_errors.append({"email": email, **fields})
+
+    def added(self, email: str, data: dict, action: str):
+        self._write("added", email, {"data": data, "action": action})
+
+    def updated(self, email: str, data: dict):
+        self._write("updated", email, {"data": data})
+
+    def error(self, email: str, error: str, retry: str | None = None):
+        # retry: what the retry queue did with the row ("queued" or
+        # "dead_lettered"), when it took it.
+        fields = {"error": error}
+        if retry:
+            fields["retry"] = retry
+            with self._lock:
+                self.counts[retry] += 1
+        self._write("error", email, fields)
+
+    def recovered(self, email: str, data: dict):
+        # A queued row the run's own retry pass got through before the send.
+        self._write("recovered", email, {"data": data})
+
+    def unchanged(self, email: str):
+        # Already applied by an earlier run; only joined the campaign list.
+        self._write("unchanged", email, {})
+
+    def skipped(self):
+        with self._lock:
+            self.counts["skipped"] += 1
+
+    def merge(self, counts: dict, sample_errors: list, lines_path: Path):
+        with self._lock:
+            self.counts.update(counts)
+            room = SAMPLE_ERRORS - len(self.sample_errors)
+            self.sample_errors.extend(sample_errors[: max(0, room)])
+            with open(lines_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    self._file.write(line)
+
+    def flush(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+
+    @property
+    def processed(self) -> int:
+        return self.counts["added"] + self.counts["updated"]
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def as_dict(self) -> dict:
+        return {
+            "run_id": self.run_id,
+            "results_file": str(self.path),
+            "counts": {
+                "added": self.counts["added"],
+                "updated": self.counts["updated"],
+                "failed": self.counts["error"],
+                "skipped": self.counts["skipped"],
+                "unchanged": self.counts["unchanged"],
+                "queued_for_retry": self.counts["queued"],
+                "recovered_by_retry": self.counts["recovered"],
+                "dead_lettered": self.counts["dead_lettered"],
+            },
+            "sample_errors": list(self.sample_errors),
+        }
+
+
+def _results_path(run_id: str) -> Path | None:
+    if not _RUN_ID_RE.match(run_id):
+        return None
+    path = results_dir() / f"{run_id}.jsonl"
+    return path if path.exists() else None
+
+
+def list_runs(limit: int = 50) -> list[dict]:
+    directory = results_dir()
+    if not directory.exists():
+        return []
+    paths = sorted(
+        directory.glob("*.jsonl"), key=lambda p: p.stat().st_mtime, reverse=True
+    )
+    return [{"run_id": p.stem, "size_bytes": p.stat().st_size} for p in paths[:limit]]
+
+
+def read_results(run_id: str, offset: int = 0, limit: int = 100, outcome=None):
+    path = _results_path(run_id)
+    if path is None:
+        return None
+
+    items = []
+    matched = 0
+    next_offset = None
+    needle = f'{{"outcome": "{outcome}"' if outcome else None
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if needle and not line.startswith(needle):
+                continue
+            if matched >= offset:
+                if len(items) == limit:
+                    next_offset = matched
+                    break
+                items.append(json_codec.loads(line))
+            matched += 1
+
+    return {
+        "run_id": run_id,
+        "offset": offset,
+        "limit": limit,
+        "outcome": outcome,
+        "items": items,
+        "next_offset": next_offset,
+    }
@@ -0,0 +1,316 @@
+import contextlib
+import random
+import sqlite3
+import time
+from pathlib import Path
+
+from . import json_codec, metrics
+from .accounts import account_env, current_account
+from .settings import env
+
+# Upserts and sends that failed with a transient error (transport failure,
+# 429, 5xx) wait here with their attempt count and next attempt time until
+# the drainer retries them. Other failures, and items that run out of
+# attempts, go to dead_letters, where they stay until requeued by hand.
+MAX_BACKOFF_SECONDS = 6 * 3600
+# A claimed item is not handed to another drainer for this long.
+CLAIM_SECONDS = 300
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS retries (
+    id INTEGER PRIMARY KEY,
+    account TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    email TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    attempts INTEGER NOT NULL,
+    next_attempt REAL NOT NULL,
+    last_error TEXT,
+    last_status INTEGER,
+    run_id TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS retries_due ON retries (account, next_attempt);
+CREATE TABLE IF NOT EXISTS dead_letters (
+    id INTEGER PRIMARY KEY,
+    account TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    email TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_error TEXT,
+    last_status INTEGER,
+    run_id TEXT,
+    created_at REAL NOT NULL,
+    failed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dead_letters_account ON dead_letters (account, failed_at);
+"""
+
+_COLUMNS = (
+    "id, kind, email, payload, attempts, last_error, last_status, run_id, created_at"
+)
+
+
+def queue_path() -> Path:
+    return Path(env("RETRY_QUEUE_DB", "retry_queue.db"))
+
+
+@contextlib.contextmanager
+def _connect():
+    # Failures are rare enough that a connection per call costs nothing.
+    conn = sqlite3.connect(queue_path(), timeout=30, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        yield conn
+    finally:
+        conn.close()
+
+
+@contextlib.contextmanager
+def _transaction(conn):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def is_retryable(status: int | None) -> bool:
+    # None: the request never got a response.
+    return status is None or status == 429 or status >= 500
+
+
+def _backoff(attempts: int) -> float:
+    base = float(account_env("RETRY_BASE_SECONDS", "60"))
+    delay = min(base * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _item(row) -> dict:
+    item = dict(
+        zip(
+            (
+                "id",
+                "kind",
+                "email",
+                "payload",
+                "attempts",
+                "last_error",
+                "last_status",
+                "run_id",
+                "created_at",
+            ),
+            row,
+        )
+    )
+    item["payload"] = json_codec.loads(item["payload"])
+    return item
+
+
+def _dead_letter(conn, account: str, item: dict, error: str, status):
+    conn.execute(
+        "INSERT INTO dead_letters (account, kind, email, payload, attempts, "
+        "last_error, last_status, run_id, created_at, failed_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            account,
+            item["kind"],
+            item["email"],
+            json_codec.dumps(item["payload"]),
+            item["attempts"],
+            error,
+            status,
+            item.get("run_id"),
+            item.get("created_at") or time.time(),
+            time.time(),
+        ),
+    )
+    metrics.RETRY_ITEMS.inc(item["kind"], "dead_lettered")
+
+
+def enqueue(
+    kind: str,
+    email: str,
+    payload: dict,
+    error: str,
+    status: int | None = None,
+    run_id: str | None = None,
+) -> str:
+    # Returns "queued", or "dead_lettered" when retrying cannot help.
+    account = current_account()
+    item = {
+        "kind": kind,
+        "email": email,
+        "payload": payload,
+        "attempts": 1,
+        "run_id": run_id,
+        "created_at": time.time(),
+    }
+    with _connect() as conn:
+        if not is_retryable(status):
+            _dead_letter(conn, account, item, error, status)
+            return "dead_lettered"
+        conn.execute(
+            "INSERT INTO retries (account, kind, email, payload, attempts, "
+            "next_attempt, last_error, last_status, run_id, created_at) "
+            "VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?)",
+            (
+                account,
+                kind,
+                email,
+                json_codec.dumps(payload),
+                time.time() + _backoff(1),
+                error,
+                status,
+                run_id,
+                item["created_at"],
+            ),
+        )
+    metrics.RETRY_ITEMS.inc(kind, "queued")
+    return "queued"
+
+
+def claim_due(limit: int) -> list[dict]:
+    # Due items of the current account, hidden from other drainers while
+    # this one works on them.
+    now = time.time()
+    with _connect() as conn, _transaction(conn):
+        rows = conn.execute(
+            f"SELECT {_COLUMNS} FROM retries WHERE account = ? AND next_attempt <= ? "
+            "ORDER BY next_attempt LIMIT ?",
+            (current_account(), now, limit),
+        ).fetchall()
+        conn.executemany(
+            "UPDATE retries SET next_attempt = ? WHERE id = ?",
+            [(now + CLAIM_SECONDS, row[0]) for row in rows],
+        )
+    return [_item(row) for row in rows]
+
+
+def claim_run(run_id: str, kind: str) -> list[dict]:
+    # A run's own items of one kind that no drainer has tried yet (still on
+    # their first attempt and never claimed), due or not, so the run can try
+    # them again before its campaign goes out. Shard workers queue under
+    # <run_id>.shard<n>.<attempt>.
+    now = time.time()
+    with _connect() as conn, _transaction(conn):
+        rows = conn.execute(
+            f"SELECT {_COLUMNS} FROM retries WHERE account = ? AND kind = ? "
+            "AND (run_id = ? OR run_id LIKE ?) AND attempts = 1 "
+            "AND next_attempt < created_at + ?",
+            (current_account(), kind, run_id, f"{run_id}.shard%", CLAIM_SECONDS),
+        ).fetchall()
+        conn.executemany(
+            "UPDATE retries SET next_attempt = ? WHERE id = ?",
+            [(now + CLAIM_SECONDS, row[0]) for row in rows],
+        )
+    return [_item(row) for row in rows]
+
+
+def record_success(item: dict):
+    with _connect() as conn:
+        conn.execute("DELETE FROM retries WHERE id = ?", (item["id"],))
+    metrics.RETRY_ITEMS.inc(item["kind"], "succeeded")
+
+
+def record_failure(item: dict, error: str, status: int | None = None) -> str:
+    attempts = item["attempts"] + 1
+    with _connect() as conn, _transaction(conn):
+        if not is_retryable(status) or attempts >= int(
+            account_env("RETRY_MAX_ATTEMPTS", "8")
+        ):
+            conn.execute("DELETE FROM retries WHERE id = ?", (item["id"],))
+            _dead_letter(
+                conn, current_account(), dict(item, attempts=attempts), error, status
+            )
+            return "dead_lettered"
+        conn.execute(
+            "UPDATE retries SET attempts = ?, next_attempt = ?, last_error = ?, "
+            "last_status = ? WHERE id = ?",
+            (attempts, time.time() + _backoff(attempts), error, status, item["id"]),
+        )
+    metrics.RETRY_ITEMS.inc(item["kind"], "retried")
+    return "queued"
+
+
+def release(items: list[dict]):
+    # Hands claimed items back untried (Brevo's circuit opened mid-batch).
+    with _connect() as conn:
+        conn.executemany(
+            "UPDATE retries SET next_attempt = ? WHERE id = ?",
+            [(time.time(), item["id"]) for item in items],
+        )
+
+
+def queue_summary() -> dict:
+    account = current_account()
+    with _connect() as conn:
+        pending = conn.execute(
+            "SELECT kind, COUNT(*), MIN(next_attempt) FROM retries "
+            "WHERE account = ? GROUP BY kind",
+            (account,),
+        ).fetchall()
+        dead = conn.execute(
+            "SELECT kind, COUNT(*) FROM dead_letters WHERE account = ? GROUP BY kind",
+            (account,),
+        ).fetchall()
+    return {
+        "pending": {kind: count for kind, count, _ in pending},
+        "next_attempt": min((due for _, _, due in pending), default=None),
+        "dead_letters": {kind: count for kind, count in dead},
+    }
+
+
+def list_retries(offset: int = 0, limit: int = 100) -> list[dict]:
+    with _connect() as conn:
+        rows = conn.execute(
+            f"SELECT {_COLUMNS}, next_attempt FROM retries WHERE account = ? "
+            "ORDER BY next_attempt LIMIT ? OFFSET ?",
+            (current_account(), limit, offset),
+        ).fetchall()
+    return [dict(_item(row[:-1]), next_attempt=row[-1]) for row in rows]
+
+
+def list_dead_letters(offset: int = 0, limit: int = 100) -> list[dict]:
+    with _connect() as conn:
+        rows = conn.execute(
+            f"SELECT {_COLUMNS}, failed_at FROM dead_letters WHERE account = ? "
+            "ORDER BY failed_at DESC LIMIT ? OFFSET ?",
+            (current_account(), limit, offset),
+        ).fetchall()
+    return [dict(_item(row[:-1]), failed_at=row[-1]) for row in rows]
+
+
+def requeue_dead_letter(letter_id: int) -> bool:
+    # Back into the queue, due now, with a fresh attempt count.
+    account = current_account()
+    with _connect() as conn, _transaction(conn):
+        row = conn.execute(
+            f"SELECT {_COLUMNS} FROM dead_letters WHERE account = ? AND id = ?",
+            (account, letter_id),
+        ).fetchone()
+        if row is None:
+            return False
+        item = _item(row)
+        conn.execute("DELETE FROM dead_letters WHERE id = ?", (letter_id,))
+        conn.execute(
+            "INSERT INTO retries (account, kind, email, payload, attempts, "
+            "next_attempt, last_error, last_status, run_id, created_at) "
+            "VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?)",
+            (
+                account,
+                item["kind"],
+                item["email"],
+                json_codec.dumps(item["payload"]),
+                time.time(),
+                item["last_error"],
+                item["last_status"],
+                item["run_id"],
+                item["created_at"],
+            ),
+        )
+    return True
@@ -1,24 +1,69 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
+from fastapi import APIRouter, Header, HTTPException, Request, UploadFile, File
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel, EmailStr
 from pathlib import Path
+from datetime import date
 from typing import Optional, Union
 import re
+import json
 from datetime import datetime
+from .accounts import account_names, current_account, use_account
 from .brevo_service import (
     add_contact,
+    circuit_state,
+    current_contacts,
+    scheduler_stats,
     send_info_email,
-    get_existing_contacts_email,
-    get_detailed_contacts,
     handle_csv,
 )
+from .circuit_breaker import CircuitOpen
+from .rate_limiter import INTERACTIVE, use_priority
+from requests import RequestException
+from . import json_codec
+from .metrics import render_metrics, CONTENT_TYPE
+from .planner import plan_csv, SnapshotUnavailable
+from .results_store import list_runs, read_results
+from .retry_queue import (
+    enqueue,
+    is_retryable,
+    list_dead_letters,
+    list_retries,
+    queue_summary,
+    requeue_dead_letter,
+)
+from .log_rotation import recent_log_lines
+from .log_index import search_log
+from .webhooks import WebhookUnauthorized, check_webhook_token, handle_webhook
+import asyncio
+import time
 
 router = APIRouter()
 
+LOG_FILES = [
+    "api_service.log",
+    "background_service.log",
+    "brevo_service.log",
+    "brevo_api.log",
+]
+
+
+class FastJSONResponse(JSONResponse):
+    # The app's default response class. Endpoints with large bodies return it
+    # directly, which also skips FastAPI's jsonable_encoder pass.
+    def render(self, content) -> bytes:
+        return json_codec.dumps(content)
+
 
 class UserEmail(BaseModel):
     email: EmailStr
 
 
+class BackfillRequest(BaseModel):
+    start_date: date
+    end_date: date
+    force: bool = False
+
+
 class ContactInfo(BaseModel):
     email: EmailStr
     nat: Union[str, None] = None
@@ -38,7 +83,9 @@ class ContactInfo(BaseModel):
 
 @router.post("/add_contact")
 async def add_contact_endpoint(data: ContactInfo):
-    existing_contacts = get_existing_contacts_email()
+    # Membership checks go to the shared contact store, not a download.
+    snapshot = await asyncio.to_thread(current_contacts)
+    existing_contacts = snapshot["emails"]
 
     # excluding None values
     contact_data = {}
@@ -69,7 +116,14 @@ async def add_contact_endpoint(data: ContactInfo):
     if data.tender_code:
         contact_data["tender_code"] = data.tender_code
 
-    response = add_contact(data.email, existing_contacts, contact_data=contact_data)
+    try:
+        # A caller is waiting: goes ahead of CSV runs in the account's queue.
+        with use_priority(INTERACTIVE):
+            response = await asyncio.to_thread(
+                add_contact, data.email, existing_contacts, contact_data=contact_data
+            )
+    except CircuitOpen as e:
+        raise HTTPException(status_code=503, detail=str(e))
     if response.status_code not in (201, 204):
         raise HTTPException(status_code=response.status_code, detail=response.text)
 
@@ -87,31 +141,164 @@ async def add_contact_endpoint(data: ContactInfo):
 
 @router.post("/send-info")
 async def send_info(data: UserEmail):
-    response = send_info_email(data.email)
-    if response.status_code not in (200, 201):
-        raise HTTPException(status_code=response.status_code, detail=response.text)
-    return {"status": "sent", "email": data.email}
+    try:
+        with use_priority(INTERACTIVE):
+            response = await asyncio.to_thread(send_info_email, data.email)
+    except (CircuitOpen, RequestException) as e:
+        response = None
+        error, status = str(e), None
+    else:
+        error, status = response.text, response.status_code
+    if response is not None and status in (200, 201):
+        return {"status": "sent", "email": data.email}
+    if is_retryable(status):
+        # Brevo is struggling; the retry queue sends it once it recovers.
+        await asyncio.to_thread(enqueue, "send_info", data.email, {}, error, status)
+        return JSONResponse(
+            status_code=202, content={"status": "queued", "email": data.email}
+        )
+    raise HTTPException(status_code=status, detail=error)
 
 
 @router.post("/process-csv")
-async def process_csv_endpoint(file: UploadFile = File(...)):
+async def process_csv_endpoint(
+    file: UploadFile = File(...), dry_run: bool = False, max_items: int = 1000
+):
     contents = await file.read()
-    results = handle_csv(contents)
-    return results
+    if dry_run:
+        try:
+            plan = await asyncio.to_thread(plan_csv, contents, max_items=max_items)
+            return FastJSONResponse(plan)
+        except SnapshotUnavailable as e:
+            raise HTTPException(status_code=409, detail=str(e))
+
+    # Off the event loop, so other requests (and other accounts) are served
+    # while the run is going.
+    results = await asyncio.to_thread(handle_csv, contents)
+    return FastJSONResponse(results)
+
+
+@router.post("/backfill")
+def backfill_endpoint(data: BackfillRequest):
+    from .background_service import BrevoBackgroundService
+    from .backfill import submit_backfill
+
+    if data.end_date < data.start_date:
+        raise HTTPException(
+            status_code=400, detail="end date must not be before start date"
+        )
+    try:
+        service = BrevoBackgroundService(current_account())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # A range of files takes far longer than a request should; the job runs
+    # in the background and GET /backfill/{job_id} reports on it.
+    job = submit_backfill(
+        service, data.start_date.isoformat(), data.end_date.isoformat(), data.force
+    )
+    return JSONResponse(status_code=202, content=job)
+
+
+@router.get("/backfill/{job_id}")
+def backfill_status(job_id: str):
+    from .backfill import backfill_job
+
+    job = backfill_job(job_id)
+    if job is None or job["account"] != current_account():
+        raise HTTPException(status_code=404, detail=f"No backfill job {job_id}")
+    return FastJSONResponse(job)
+
+
+@router.post("/webhooks/brevo")
+async def brevo_webhook(
+    request: Request,
+    authorization: Optional[str] = Header(None),
+    token: Optional[str] = None,
+):
+    # Contact changes made in Brevo (unsubscribes, bounces, edits, list
+    # additions) keep the local contact snapshot current between downloads.
+    try:
+        check_webhook_token(authorization, token)
+    except WebhookUnauthorized as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    try:
+        payload = json_codec.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    return await asyncio.to_thread(handle_webhook, payload)
+
+
+@router.get("/accounts")
+async def get_accounts():
+    accounts = []
+    for account in account_names():
+        with use_account(account):
+            accounts.append(
+                {
+                    "account": account,
+                    "circuit": circuit_state(),
+                    "requests": scheduler_stats(),
+                }
+            )
+    return {"current": current_account(), "accounts": accounts}
+
+
+@router.get("/results")
+async def get_result_runs(limit: int = 50):
+    return {"runs": await asyncio.to_thread(list_runs, limit)}
+
+
+@router.get("/results/{run_id}")
+async def get_run_results(
+    run_id: str, offset: int = 0, limit: int = 100, outcome: Optional[str] = None
+):
+    page = await asyncio.to_thread(
+        read_results, run_id, offset=offset, limit=min(limit, 1000), outcome=outcome
+    )
+    if page is None:
+        raise HTTPException(status_code=404, detail=f"No results for run {run_id}")
+    return FastJSONResponse(page)
+
+
+@router.get("/retries")
+async def get_retries(offset: int = 0, limit: int = 100):
+    summary = await asyncio.to_thread(queue_summary)
+    items = await asyncio.to_thread(list_retries, offset, min(limit, 1000))
+    return FastJSONResponse(dict(summary, items=items))
+
+
+@router.get("/dead-letters")
+async def get_dead_letters(offset: int = 0, limit: int = 100):
+    items = await asyncio.to_thread(list_dead_letters, offset, min(limit, 1000))
+    return FastJSONResponse({"offset": offset, "items": items})
+
+
+@router.post("/dead-letters/{letter_id}/retry")
+async def retry_dead_letter(letter_id: int):
+    if not await asyncio.to_thread(requeue_dead_letter, letter_id):
+        raise HTTPException(status_code=404, detail=f"No dead letter {letter_id}")
+    return {"status": "queued", "id": letter_id}
 
 
 @router.get("/users")
 async def get_all_users(detailed: bool = False):
     try:
+        snapshot = await asyncio.to_thread(current_contacts)
         if detailed:
-            contacts = get_detailed_contacts()
-            return {"total_contacts": len(contacts), "contacts": contacts}
+            contacts = await asyncio.to_thread(
+                lambda: [contact for _, contact in snapshot["detailed"].items()]
+            )
+            return FastJSONResponse(
+                {"total_contacts": len(contacts), "contacts": contacts}
+            )
         else:
-            existing_contacts = get_existing_contacts_email()
-            return {
-                "total_contacts": len(existing_contacts),
-                "contacts": sorted(list(existing_contacts)),
-            }
+            existing_contacts = await asyncio.to_thread(sorted, snapshot["emails"])
+            return FastJSONResponse(
+                {
+                    "total_contacts": len(existing_contacts),
+                    "contacts": existing_contacts,
+                }
+            )
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Failed to fetch contacts: {str(e)}"
@@ -119,69 +306,129 @@ async def get_all_users(detailed: bool = False):
 
 
 @router.get("/logs")
-async def get_logs(limit: int = 50):
-    log_files = ["api_service.log", "background_service.log", "brevo_service.log"]
-
+async def get_logs(limit: int = 50, segments: int = 2):
     all_logs = []
 
-    for log_file in log_files:
+    for log_file in LOG_FILES:
         log_path = Path(log_file)
-        if log_path.exists():
-            try:
-                with open(log_path, "r", encoding="utf-8") as f:
-                    lines = f.readlines()
-
-                recent_lines = lines[-100:] if len(lines) > 100 else lines
+        try:
+            # Reads back into rotated (compressed) segments when the live file
+            # was rotated recently; a log that does not exist yet has no lines.
+            recent_lines = await asyncio.to_thread(
+                recent_log_lines,
+                log_path,
+                max(limit, 100),
+                max_segments=min(segments, 10),
+            )
+            for line in recent_lines:
+                line = line.strip()
+                if not line:
+                    continue
 
-                for line in recent_lines:
-                    line = line.strip()
-                    if not line:
+                if line.startswith("{"):
+                    try:
+                        record = json.loads(line)
+                        all_logs.append(
+                            {
+                                "timestamp": record.get("timestamp", ""),
+                                "level": record.get("level", "INFO"),
+                                "message": record.get("message", ""),
+                                "source": log_file,
+                            }
+                        )
                         continue
+                    except ValueError:
+                        pass
 
-                    match = re.match(
-                        r"(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) \[(\w+)\] (.+)", line
-                    )
-                    if match:
-                        timestamp_str, level, message = match.groups()
-                        try:
-                            datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S")
-                            all_logs.append(
-                                {
-                                    "timestamp": timestamp_str,
-                                    "level": level,
-                                    "message": message,
-                                    "source": log_file,
-                                }
-                            )
-                        except ValueError:
-                            all_logs.append(
-                                {
-                                    "timestamp": timestamp_str,
-                                    "level": level,
-                                    "message": message,
-                                    "source": log_file,
-                                }
-                            )
-                    else:
+                match = re.match(
+                    r"(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) \[(\w+)\] (.+)", line
+                )
+                if match:
+                    timestamp_str, level, message = match.groups()
+                    try:
+                        datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S")
                         all_logs.append(
                             {
-                                "timestamp": datetime.now().strftime(
-                                    "%Y-%m-%d %H:%M:%S"
-                                ),
-                                "level": "INFO",
-                                "message": line,
+                                "timestamp": timestamp_str,
+                                "level": level,
+                                "message": message,
                                 "source": log_file,
                             }
                         )
-            except Exception as e:
-                all_logs.append(
-                    {
-                        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        "level": "ERROR",
-                        "message": f"Error reading {log_file}: {str(e)}",
-                        "source": "system",
-                    }
-                )
+                    except ValueError:
+                        all_logs.append(
+                            {
+                                "timestamp": timestamp_str,
+                                "level": level,
+                                "message": message,
+                                "source": log_file,
+                            }
+                        )
+                else:
+                    all_logs.append(
+                        {
+                            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                            "level": "INFO",
+                            "message": line,
+                            "source": log_file,
+                        }
+                    )
+        except Exception as e:
+            all_logs.append(
+                {
+                    "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "level": "ERROR",
+                    "message": f"Error reading {log_file}: {str(e)}",
+                    "source": "system",
+                }
+            )
 
     all_logs.sort(key=lambda x: x["timestamp"], reverse=True)
     return {"logs": all_logs[:limit]}
+
+
+@router.get("/logs/search")
+async def search_logs(
+    level: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    email: Optional[str] = None,
+    q: Optional[str] = None,
+    source: Optional[str] = None,
+    limit: int = 100,
+    segments: Optional[int] = None,
+):
+    # Uses the per-minute index written next to each log segment to read only
+    # the parts of the logs that can match, including rotated segments.
+    if source and source not in LOG_FILES:
+        raise HTTPException(status_code=400, detail=f"Unknown log source: {source}")
+    time_format = "%Y-%m-%d %H:%M:%S"
+    started = time.perf_counter()
+
+    all_logs = []
+    stats = {}
+    for log_file in [source] if source else LOG_FILES:
+        matches, stats[log_file] = await asyncio.to_thread(
+            search_log,
+            Path(log_file),
+            start=start.strftime(time_format) if start else None,
+            end=end.strftime(time_format) if end else None,
+            level=level,
+            email=email,
+            text=q,
+            limit=limit,
+            max_segments=segments,
+        )
+        all_logs.extend(matches)
+
+    all_logs.sort(key=lambda x: x["timestamp"], reverse=True)
+    return {
+        "logs": all_logs[:limit],
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        "stats": stats,
+    }
+
+
+@router.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(render_metrics(), media_type=CONTENT_TYPE)
@@ -0,0 +1,117 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from . import json_codec
+from .accounts import account_env, current_account
+
+FLUSH_EVERY = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    account TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    applied_at REAL NOT NULL,
+    PRIMARY KEY (account, fingerprint)
+) WITHOUT ROWID;
+DROP INDEX IF EXISTS fingerprints_applied_at;
+CREATE INDEX IF NOT EXISTS fingerprints_account_applied_at
+    ON fingerprints (account, applied_at);
+"""
+
+
+def row_fingerprint(email: str, contact_data: dict) -> str:
+    # The normalized email plus the attributes a row sends; the campaign list
+    # is new every run and is left out.
+    content = json_codec.dumps([email.strip().lower(), sorted(contact_data.items())])
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+class FingerprintStore:
+    # Rows whose upsert Brevo accepted within the retention window. Daily
+    # exports overlap, so most of a day's rows were already applied the day
+    # before. Fingerprints are buffered and written in batches; losing a
+    # batch in a crash only means those rows are upserted again.
+    def __init__(
+        self,
+        db_path: Path,
+        retention_seconds: float,
+        account: str,
+        read_only: bool = False,
+    ):
+        self.account = account
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        self._pending = []
+        if read_only:
+            # Dry runs look, they neither create the file nor prune it.
+            self._conn = sqlite3.connect(
+                f"{db_path.resolve().as_uri()}?mode=ro",
+                uri=True,
+                timeout=30,
+                check_same_thread=False,
+            )
+            return
+        # Upserts finish on worker threads; the lock serializes the connection.
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        with self._conn:
+            self._conn.execute(
+                "DELETE FROM fingerprints WHERE account = ? AND applied_at < ?",
+                (account, time.time() - retention_seconds),
+            )
+
+    def has_table(self) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                ("fingerprints",),
+            ).fetchone()
+        return row is not None
+
+    def seen(self, fingerprint: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM fingerprints "
+                "WHERE account = ? AND fingerprint = ? AND applied_at >= ?",
+                (self.account, fingerprint, time.time() - self.retention_seconds),
+            ).fetchone()
+        return row is not None
+
+    def add(self, fingerprint: str):
+        with self._lock:
+            self._pending.append((self.account, fingerprint, time.time()))
+            if len(self._pending) >= FLUSH_EVERY:
+                self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?)", self._pending
+            )
+        self._pending = []
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._conn.close()
+
+
+def open_fingerprint_store(read_only: bool = False) -> FingerprintStore | None:
+    # ROW_FINGERPRINT_RETENTION_DAYS=0 turns the store off. Read-only, a store
+    # no run has written yet counts as empty.
+    days = float(account_env("ROW_FINGERPRINT_RETENTION_DAYS", "7"))
+    if days <= 0:
+        return None
+    db_path = Path(account_env("ROW_FINGERPRINT_DB", "row_fingerprints.db"))
+    if read_only and not db_path.exists():
+        return None
+    store = FingerprintStore(db_path, days * 86400, current_account(), read_only)
+    if read_only and not store.has_table():
+        store.close()
+        return None
+    return store
@@ -0,0 +1,16 @@
+import functools
+import os
+
+
+# .env is read on first use rather than at import, so importing the package
+# stays cheap and does not touch the filesystem or the process environment.
+@functools.lru_cache(maxsize=None)
+def load_env() -> bool:
+    from dotenv import load_dotenv
+
+    return load_dotenv()
+
+
+def env(name: str, default: str | None = None) -> str | None:
+    load_env()
+    return os.getenv(name, default)
@@ -0,0 +1,595 @@
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from itertools import islice
+from pathlib import Path
+
+from . import brevo_service, json_codec
+from .csv_source import open_csv_rows
+from .accounts import DEFAULT_ACCOUNT, current_account, use_account
+from .logging_config import configure_logging
+from .results_store import RunResults, new_run_id
+from .settings import env
+from .stage_timer import StageTimer
+
+
+# Settings are read when a run needs them, not at import.
+def shard_dir() -> Path:
+    return Path(env("CSV_SHARD_DIR", "csv_shards"))
+
+
+def shard_rows() -> int:
+    return int(env("CSV_SHARD_ROWS", "2000"))
+
+
+def lease_seconds() -> float:
+    return float(env("CSV_SHARD_LEASE_SECONDS", "120"))
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    csv_path TEXT NOT NULL,
+    snapshot_path TEXT NOT NULL,
+    list_id INTEGER NOT NULL,
+    campaign_id INTEGER NOT NULL,
+    shard_count INTEGER NOT NULL,
+    sent INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    account TEXT NOT NULL DEFAULT 'default',
+    rate_limit REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS shards (
+    run_id TEXT NOT NULL,
+    shard_index INTEGER NOT NULL,
+    start_row INTEGER NOT NULL,
+    end_row INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    PRIMARY KEY (run_id, shard_index)
+);
+CREATE TABLE IF NOT EXISTS workers (
+    run_id TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    seen_at REAL NOT NULL,
+    PRIMARY KEY (run_id, owner)
+);
+"""
+# How often a worker re-divides the run's rate among the workers it sees.
+RATE_SHARE_SECONDS = 5
+# Runs whose coordinator died are forgotten after this long.
+STALE_RUN_SECONDS = 7 * 86400
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def _connect(db_path: Path) -> sqlite3.Connection:
+    # One connection per thread: lease heartbeats open their own.
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(_SCHEMA)
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(runs)")}
+    # Databases from before multi-account runs and shared rate budgets.
+    added = {
+        "account": f"TEXT NOT NULL DEFAULT '{DEFAULT_ACCOUNT}'",
+        "rate_limit": "REAL NOT NULL DEFAULT 0",
+    }
+    for column, definition in added.items():
+        if column not in columns:
+            try:
+                conn.execute(f"ALTER TABLE runs ADD COLUMN {column} {definition}")
+            except sqlite3.OperationalError:
+                pass  # another worker added it first
+    return conn
+
+
+def _worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def _count_rows(csv_path: Path) -> int:
+    with open_csv_rows(csv_path) as reader:
+        return sum(1 for _ in reader)
+
+
+def claim_shard(conn: sqlite3.Connection, run_id: str, owner: str):
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        shard = conn.execute(
+            """
+            SELECT shard_index, start_row, end_row, attempts FROM shards
+            WHERE run_id = ? AND (status = 'pending'
+                OR (status = 'leased' AND lease_expires < ?))
+            ORDER BY shard_index LIMIT 1
+            """,
+            (run_id, now),
+        ).fetchone()
+        if shard:
+            conn.execute(
+                """
+                UPDATE shards SET status = 'leased', owner = ?, lease_expires = ?,
+                    attempts = attempts + 1
+                WHERE run_id = ? AND shard_index = ?
+                """,
+                (owner, now + lease_seconds(), run_id, shard["shard_index"]),
+            )
+        conn.execute("COMMIT")
+        return shard
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _renew_lease(conn, run_id: str, shard_index: int, owner: str):
+    cursor = conn.execute(
+        """
+        UPDATE shards SET lease_expires = ?
+        WHERE run_id = ? AND shard_index = ? AND owner = ? AND status = 'leased'
+        """,
+        (time.time() + lease_seconds(), run_id, shard_index, owner),
+    )
+    if cursor.rowcount != 1:
+        raise LeaseLost(f"Lost lease on shard {shard_index} of run {run_id}")
+
+
+class _LeaseHeartbeat:
+    # Renews a shard lease every third of its duration on its own thread for
+    # as long as the shard is worked. The CSV parser reads thousands of rows
+    # ahead of the upserts, so renewing as rows are parsed would stop long
+    # before the upserts finish.
+    def __init__(self, db_path: Path, run_id: str, shard_index: int, owner: str):
+        self.db_path = db_path
+        self.run_id = run_id
+        self.shard_index = shard_index
+        self.owner = owner
+        self.lost = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=f"lease-shard{shard_index}", daemon=True
+        )
+
+    def _run(self):
+        conn = _connect(self.db_path)
+        interval = lease_seconds() / 3
+        try:
+            while not self._stopped.wait(interval):
+                try:
+                    _renew_lease(conn, self.run_id, self.shard_index, self.owner)
+                except LeaseLost as e:
+                    logging.warning(str(e))
+                    self.lost.set()
+                    return
+                except sqlite3.Error as e:
+                    # Try again on the next beat; the lease has time left.
+                    logging.warning(
+                        f"Could not renew lease on shard {self.shard_index}: {str(e)}"
+                    )
+        finally:
+            conn.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+
+
+class _RateShare:
+    # Every worker on a run, on this host or another, takes an equal part of
+    # the account's BREVO_RATE_LIMIT. Workers register in the workers table
+    # and re-divide every RATE_SHARE_SECONDS, so a host that joins late lowers
+    # everyone's share instead of adding its own full rate on top.
+    def __init__(self, db_path: Path, run_id: str, owner: str, rate_limit: float):
+        self.db_path = db_path
+        self.run_id = run_id
+        self.owner = owner
+        self.rate_limit = rate_limit
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=f"rate-share-{run_id}", daemon=True
+        )
+        self._limited = None
+
+    def _share(self, conn) -> float:
+        now = time.time()
+        conn.execute(
+            "INSERT INTO workers VALUES (?, ?, ?) "
+            "ON CONFLICT (run_id, owner) DO UPDATE SET seen_at = excluded.seen_at",
+            (self.run_id, self.owner, now),
+        )
+        (workers,) = conn.execute(
+            "SELECT COUNT(*) FROM workers WHERE run_id = ? AND seen_at > ?",
+            (self.run_id, now - 3 * RATE_SHARE_SECONDS),
+        ).fetchone()
+        return self.rate_limit / max(1, workers)
+
+    def _run(self):
+        conn = _connect(self.db_path)
+        try:
+            while not self._stopped.wait(RATE_SHARE_SECONDS):
+                try:
+                    self._set_rate(self._share(conn))
+                except sqlite3.Error as e:
+                    # Keep the current share until the next beat.
+                    logging.warning(f"Could not update rate share: {str(e)}")
+        finally:
+            conn.close()
+
+    def __enter__(self):
+        if self.rate_limit <= 0:
+            return self
+        conn = _connect(self.db_path)
+        try:
+            share = self._share(conn)
+        finally:
+            conn.close()
+        self._limited = brevo_service.limited_rate(share)
+        self._set_rate = self._limited.__enter__()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._limited is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._limited.__exit__(*exc_info)
+        conn = _connect(self.db_path)
+        try:
+            conn.execute(
+                "DELETE FROM workers WHERE run_id = ? AND owner = ?",
+                (self.run_id, self.owner),
+            )
+        except sqlite3.Error:
+            pass  # it ages out of the count
+        finally:
+            conn.close()
+
+
+def _leased_rows(rows, heartbeat: _LeaseHeartbeat):
+    # Stops handing out rows once another worker has taken the shard over.
+    for row in rows:
+        if heartbeat.lost.is_set():
+            return
+        yield row
+
+
+def _load_snapshot(snapshot_path: str):
+    with open(snapshot_path, "rb") as f:
+        data = json_codec.loads(f.read())
+    return set(data["emails"]), data["detailed"]
+
+
+def _process_shard(conn, db_path: Path, run, shard, owner: str, snapshot) -> None:
+    existing_emails, detailed_by_email = snapshot
+    # One file per lease: a worker that lost its lease may still be writing
+    # to the file of the attempt before this one.
+    shard_name = f"{run['run_id']}.shard{shard['shard_index']}.{shard['attempts'] + 1}"
+    # Shard outcomes live next to the shared CSV so every host can write them.
+    shard_results = RunResults(
+        shard_name, Path(run["csv_path"]).parent / f"{shard_name}.jsonl"
+    )
+
+    # Every worker maps the same file, so they share its pages.
+    heartbeat = _LeaseHeartbeat(db_path, run["run_id"], shard["shard_index"], owner)
+    try:
+        with heartbeat, open_csv_rows(run["csv_path"]) as reader:
+            rows = islice(reader, shard["start_row"], shard["end_row"])
+            brevo_service._process_all_rows(
+                _leased_rows(rows, heartbeat),
+                existing_emails,
+                detailed_by_email,
+                shard_results,
+                run["list_id"],
+                workers=brevo_service.upsert_workers(),
+            )
+    finally:
+        shard_results.close()
+
+    shard_summary = {
+        "counts": dict(shard_results.counts),
+        "sample_errors": shard_results.sample_errors,
+        "results_file": str(shard_results.path),
+    }
+
+    cursor = conn.execute(
+        """
+        UPDATE shards SET status = 'committed', result = ?, lease_expires = NULL
+        WHERE run_id = ? AND shard_index = ? AND owner = ? AND status = 'leased'
+        """,
+        (
+            json.dumps(shard_summary, ensure_ascii=False),
+            run["run_id"],
+            shard["shard_index"],
+            owner,
+        ),
+    )
+    if cursor.rowcount != 1:
+        # The worker that took the shard over writes its own file.
+        shard_results.path.unlink(missing_ok=True)
+        raise LeaseLost(f"Lost lease on shard {shard['shard_index']} before commit")
+    logging.info(
+        f"Committed shard {shard['shard_index']} (rows {shard['start_row']}-"
+        f"{shard['end_row']}) of run {run['run_id']}"
+    )
+
+
+def run_shard_worker(db_path: str, run_id: str, exit_when_idle: bool = True):
+    owner = _worker_id()
+    conn = _connect(Path(db_path))
+    run = conn.execute("SELECT * FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+    if run is None:
+        logging.error(f"Shard run {run_id} not found in {db_path}")
+        return 0
+
+    snapshot = _load_snapshot(run["snapshot_path"])
+    processed = 0
+    # Workers on other hosts learn the run's Brevo account from the database,
+    # and every worker keeps to its share of the account's request rate.
+    with use_account(run["account"]), _RateShare(
+        Path(db_path), run_id, owner, run["rate_limit"]
+    ):
+        while True:
+            shard = claim_shard(conn, run_id, owner)
+            if shard is None:
+                if exit_when_idle or _all_committed(conn, run_id):
+                    break
+                time.sleep(1)
+                continue
+            try:
+                _process_shard(conn, Path(db_path), run, shard, owner, snapshot)
+                processed += 1
+            except LeaseLost as e:
+                logging.warning(str(e))
+    conn.close()
+    return processed
+
+
+def _spawned_shard_worker(db_path: str, run_id: str):
+    configure_logging()
+    return run_shard_worker(db_path, run_id)
+
+
+def _all_committed(conn, run_id: str) -> bool:
+    row = conn.execute(
+        "SELECT COUNT(*) FROM shards WHERE run_id = ? AND status != 'committed'",
+        (run_id,),
+    ).fetchone()
+    return row[0] == 0
+
+
+def _merge_shard_results(conn, run_id: str, row_results: RunResults):
+    for row in conn.execute(
+        "SELECT result FROM shards WHERE run_id = ? AND status = 'committed' "
+        "ORDER BY shard_index",
+        (run_id,),
+    ).fetchall():
+        shard_summary = json.loads(row["result"])
+        shard_path = Path(shard_summary["results_file"])
+        row_results.merge(
+            shard_summary["counts"], shard_summary["sample_errors"], shard_path
+        )
+        shard_path.unlink(missing_ok=True)
+
+
+def _forget_run(db_path: Path, run_id: str):
+    # The run's rows are only needed while it runs; runs left behind by a
+    # coordinator that died go once they are STALE_RUN_SECONDS old.
+    conn = _connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        stale = [
+            row["run_id"]
+            for row in conn.execute(
+                "SELECT run_id FROM runs WHERE created_at < ?",
+                (time.time() - STALE_RUN_SECONDS,),
+            )
+        ]
+        for table in ("shards", "workers", "runs"):
+            conn.executemany(
+                f"DELETE FROM {table} WHERE run_id = ?",
+                [(forgotten,) for forgotten in [run_id, *stale]],
+            )
+        conn.execute("COMMIT")
+    except sqlite3.Error as e:
+        logging.warning(f"Could not clean up shard run {run_id}: {str(e)}")
+    finally:
+        conn.close()
+
+
+def _stop_workers(processes, grace_seconds: float):
+    for process in processes:
+        if process.pid is None:
+            continue  # never started
+        process.join(timeout=grace_seconds)
+        if process.is_alive():
+            # Every shard is committed (or the run failed), so a straggler,
+            # e.g. one paused on an open circuit, only holds a lease it no
+            # longer needs.
+            logging.warning(f"Stopping shard worker {process.pid}")
+            process.terminate()
+            process.join()
+
+
+def _mark_sent(conn, run_id: str) -> bool:
+    cursor = conn.execute(
+        "UPDATE runs SET sent = 1 WHERE run_id = ? AND sent = 0", (run_id,)
+    )
+    return cursor.rowcount == 1
+
+
+def handle_csv_sharded(source: bytes | Path, local_workers: int) -> dict:
+    directory = shard_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    db_path = directory / "shards.db"
+    run_id = new_run_id()
+    csv_path = directory / f"{run_id}.csv"
+    snapshot_path = directory / f"{run_id}.snapshot.json"
+    if isinstance(source, Path):
+        shutil.copyfile(source, csv_path)
+    else:
+        csv_path.write_bytes(source)
+    row_results = RunResults(run_id)
+    try:
+        results = _run_sharded(
+            db_path, run_id, csv_path, snapshot_path, local_workers, row_results
+        )
+        results.update(row_results.as_dict())
+        return results
+    finally:
+        row_results.close()
+        csv_path.unlink(missing_ok=True)
+        snapshot_path.unlink(missing_ok=True)
+        _forget_run(db_path, run_id)
+
+
+def _run_sharded(
+    db_path: Path,
+    run_id: str,
+    csv_path: Path,
+    snapshot_path: Path,
+    local_workers: int,
+    row_results: RunResults,
+) -> dict:
+    timer = StageTimer()
+    total_rows = _count_rows(csv_path)
+
+    with timer.stage("contact_download"):
+        existing_emails, detailed_by_email = brevo_service._existing_contacts_for_run()
+        with open(snapshot_path, "wb") as f:
+            f.write(
+                json_codec.dumps(
+                    {"emails": sorted(existing_emails), "detailed": detailed_by_email}
+                )
+            )
+
+    results = brevo_service._init_results(len(existing_emails))
+
+    with timer.stage("folder_list_setup"):
+        if not brevo_service._ensure_folder("Winners"):
+            return {"errors": [{"error": "Folder setup failed"}]}
+        list_id = brevo_service.create_new_contact_list("csv_import")
+        if not list_id:
+            return {"errors": [{"error": "Failed to create contact list"}]}
+
+    with timer.stage("campaign_creation"):
+        campaign_result = brevo_service.create_new_campaign(list_id)
+    results["campaign_info"] = campaign_result
+    if not campaign_result["success"]:
+        results["errors"].append(
+            {"error": "Failed to create campaign", "details": campaign_result["error"]}
+        )
+        return results
+
+    rows_per_shard = shard_rows()
+    shard_ranges = [
+        (start, min(start + rows_per_shard, total_rows))
+        for start in range(0, total_rows, rows_per_shard)
+    ]
+    conn = _connect(db_path)
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute(
+        """
+        INSERT INTO runs (run_id, csv_path, snapshot_path, list_id, campaign_id,
+            shard_count, created_at, account, rate_limit)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            run_id,
+            str(csv_path),
+            str(snapshot_path),
+            list_id,
+            campaign_result["campaign_id"],
+            len(shard_ranges),
+            time.time(),
+            current_account(),
+            # Each worker process has its own scheduler; _RateShare divides
+            # this among them.
+            brevo_service.rate_limit(),
+        ),
+    )
+    conn.executemany(
+        "INSERT INTO shards (run_id, shard_index, start_row, end_row) VALUES (?, ?, ?, ?)",
+        [(run_id, i, start, end) for i, (start, end) in enumerate(shard_ranges)],
+    )
+    conn.execute("COMMIT")
+    logging.info(
+        f"Shard run {run_id}: {total_rows} rows in {len(shard_ranges)} shards, "
+        f"{local_workers} local worker processes (other hosts may join with "
+        f"'python -m brevo.sharding {run_id}')"
+    )
+
+    with timer.stage("row_upserts"):
+        context = multiprocessing.get_context("spawn")
+        processes = [
+            context.Process(
+                target=_spawned_shard_worker,
+                args=(str(db_path), run_id),
+                daemon=True,
+            )
+            for _ in range(max(0, local_workers - 1))
+        ]
+        finished = False
+        try:
+            for process in processes:
+                process.start()
+
+            # The coordinator works shards as well, and keeps going until
+            # every shard is committed, picking up leases that expired on dead
+            # workers.
+            run_shard_worker(str(db_path), run_id, exit_when_idle=False)
+            finished = True
+        finally:
+            # A coordinator that failed takes its workers down with it.
+            _stop_workers(processes, grace_seconds=5 if finished else 0)
+
+    _merge_shard_results(conn, run_id, row_results)
+    with timer.stage("row_retries"):
+        brevo_service.retry_run_upserts(row_results)
+    brevo_service._record_run_writes(row_results, list_id)
+
+    if not _all_committed(conn, run_id):
+        results["errors"].append({"error": "Not every shard committed"})
+        logging.error(f"Shard run {run_id} has uncommitted shards, not sending")
+    elif _mark_sent(conn, run_id):
+        with timer.stage("campaign_send"):
+            send_result = brevo_service.send_run_campaign(
+                campaign_result["campaign_id"], run_id
+            )
+        results["campaign_info"]["send_result"] = send_result
+        if not send_result["success"]:
+            logging.error(f"Failed to send campaign: {send_result['error']}")
+    else:
+        logging.warning(f"Campaign for shard run {run_id} was already sent")
+    conn.close()
+
+    results["shard_run"] = {"run_id": run_id, "shards": len(shard_ranges)}
+    results["account"] = current_account()
+    results["timings"] = timer.as_dict()
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 2:
+        print("Usage: python -m brevo.sharding RUN_ID")
+        exit(2)
+    configure_logging()
+    worked = run_shard_worker(str(shard_dir() / "shards.db"), sys.argv[1])
+    print(f"Processed {worked} shards")
@@ -0,0 +1,53 @@
+import threading
+
+
+def normalize_sms(phone) -> str:
+    digits = "".join(ch for ch in str(phone or "") if ch.isdigit())
+    if digits.startswith("00"):
+        digits = digits[2:]
+    # Georgian mobiles arrive as 995XXXXXXXXX, 5XXXXXXXX or 05XXXXXXXX
+    if len(digits) == 10 and digits.startswith("05"):
+        digits = digits[1:]
+    if len(digits) == 9 and digits.startswith("5"):
+        digits = "995" + digits
+    return digits
+
+
+class SmsIndex:
+    def __init__(self):
+        self._owner_by_sms = {}
+        self._sms_by_email = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_contacts(cls, detailed_contacts_by_email: dict) -> "SmsIndex":
+        index = cls()
+        for email, contact in detailed_contacts_by_email.items():
+            sms = normalize_sms((contact.get("attributes") or {}).get("SMS"))
+            if sms and sms not in index._owner_by_sms:
+                index._owner_by_sms[sms] = email
+                index._sms_by_email[email] = sms
+        return index
+
+    def __len__(self) -> int:
+        return len(self._owner_by_sms)
+
+    def owner(self, phone) -> str | None:
+        return self._owner_by_sms.get(normalize_sms(phone))
+
+    # Assigns the number to email, or returns the contact that already owns it.
+    def claim(self, phone, email: str) -> str | None:
+        sms = normalize_sms(phone)
+        if not sms:
+            return None
+        with self._lock:
+            owner = self._owner_by_sms.get(sms)
+            if owner and owner != email:
+                return owner
+            # Brevo keeps one SMS per contact, so a new number frees the old one.
+            previous = self._sms_by_email.get(email)
+            if previous and previous != sms:
+                self._owner_by_sms.pop(previous, None)
+            self._owner_by_sms[sms] = email
+            self._sms_by_email[email] = sms
+        return None
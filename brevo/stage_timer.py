@@ -0,0 +1,158 @@
+import contextvars
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+_current_stage = contextvars.ContextVar("brevo_current_stage", default=None)
+
+
+class StageTimer:
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+
+    def _entry(self, name: str) -> dict:
+        entry = self.stages.get(name)
+        if entry is None:
+            entry = {
+                "wall_seconds": 0.0,
+                "api_calls": 0,
+                "bytes_sent": 0,
+                "bytes_received": 0,
+            }
+            self.stages[name] = entry
+        return entry
+
+    @contextmanager
+    def stage(self, name: str):
+        with self._lock:
+            self._entry(name)
+        token = _current_stage.set((self, name))
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            _current_stage.reset(token)
+            with self._lock:
+                self._entry(name)["wall_seconds"] += elapsed
+
+    def add_api_call(self, name: str, bytes_sent: int, bytes_received: int):
+        with self._lock:
+            entry = self._entry(name)
+            entry["api_calls"] += 1
+            entry["bytes_sent"] += bytes_sent
+            entry["bytes_received"] += bytes_received
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            stages = {
+                name: dict(entry, wall_seconds=round(entry["wall_seconds"], 3))
+                for name, entry in self.stages.items()
+            }
+        # Stages may overlap, so the total is end-to-end time rather than the
+        # sum of the stages.
+        stages["total"] = {
+            "wall_seconds": round(time.perf_counter() - self._started, 3),
+            "api_calls": sum(s["api_calls"] for s in stages.values()),
+            "bytes_sent": sum(s["bytes_sent"] for s in stages.values()),
+            "bytes_received": sum(s["bytes_received"] for s in stages.values()),
+        }
+        return stages
+
+
+def record_api_call(response=None):
+    current = _current_stage.get()
+    if current is None:
+        return
+    timer, name = current
+
+    bytes_sent = 0
+    bytes_received = 0
+    if response is not None:
+        request = getattr(response, "request", None)
+        body = getattr(request, "body", None)
+        if body:
+            bytes_sent = len(body)
+        bytes_received = _wire_bytes(response)
+    timer.add_api_call(name, bytes_sent, bytes_received)
+
+
+def _wire_bytes(response) -> int:
+    # What came over the network: response.content is already decompressed.
+    length = getattr(response, "headers", {}).get("Content-Length")
+    if length and length.isdigit():
+        return int(length)
+    tell = getattr(getattr(response, "raw", None), "tell", None)
+    if tell is not None:
+        try:
+            return int(tell())
+        except Exception:
+            pass
+    return len(getattr(response, "content", None) or b"")
+
+
+def format_timings(timings: dict) -> list[str]:
+    lines = []
+    for name, entry in timings.items():
+        lines.append(
+            f"{name}: {entry['wall_seconds']:.2f}s, {entry['api_calls']} API calls, "
+            f"{entry['bytes_sent']:,} B sent, {entry['bytes_received']:,} B received"
+        )
+    return lines
+
+
+@contextmanager
+def profiled_run(name: str):
+    # BREVO_PROFILE=1 dumps a cProfile of the wrapped run into BREVO_PROFILE_DIR
+    # (default ./profiles); inspect it with `python -m pstats <file>`.
+    if os.getenv("BREVO_PROFILE", "").lower() not in ("1", "true", "yes"):
+        yield
+        return
+
+    import cProfile
+    import pstats
+
+    profile_dir = Path(os.getenv("BREVO_PROFILE_DIR", "profiles"))
+    profiler = cProfile.Profile()
+    # The run parses and upserts on threads of its own. From 3.12 cProfile
+    # sees every thread; before that each thread started during the run gets
+    # a profiler of its own, merged into the one dump. Threads of other work
+    # going on at the same time are included too.
+    thread_profiles = []
+    lock = threading.Lock()
+
+    def profile_thread(*_):
+        thread_profile = cProfile.Profile()
+        with lock:
+            thread_profiles.append(thread_profile)
+        thread_profile.enable()
+
+    per_thread = sys.version_info < (3, 12)
+    if per_thread:
+        threading.setprofile(profile_thread)
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        if per_thread:
+            threading.setprofile(None)
+        try:
+            profile_dir.mkdir(parents=True, exist_ok=True)
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            profile_path = profile_dir / f"{name}_{timestamp}.prof"
+            stats = pstats.Stats(profiler)
+            with lock:
+                for thread_profile in thread_profiles:
+                    stats.add(thread_profile)
+            stats.dump_stats(profile_path)
+            logging.info(f"Profile for {name} written to {profile_path}")
+        except Exception as e:
+            logging.error(f"Failed to write profile for {name}: {str(e)}")
@@ -0,0 +1,110 @@
+import base64
+import hmac
+import logging
+
+from . import metrics
+from .accounts import account_env
+from .contact_cache import record_contact_changes
+
+# Brevo marketing webhook events and what they change on the contact. Events
+# that do not change a contact (delivered, opened, click, ...) are ignored.
+BLACKLISTING_EVENTS = {"unsubscribed", "spam", "hard_bounce", "hardBounce"}
+
+
+class WebhookUnauthorized(Exception):
+    pass
+
+
+def check_webhook_token(
+    authorization: str | None, query_token: str | None = None
+) -> None:
+    # Brevo webhooks authenticate with a bearer token or basic auth set up on
+    # the webhook; ?token= covers receivers configured with a plain URL.
+    expected = account_env("BREVO_WEBHOOK_TOKEN")
+    if not expected:
+        raise WebhookUnauthorized("BREVO_WEBHOOK_TOKEN is not configured")
+
+    supplied = query_token or ""
+    if authorization:
+        scheme, _, credentials = authorization.partition(" ")
+        if scheme.lower() == "bearer":
+            supplied = credentials.strip()
+        elif scheme.lower() == "basic":
+            try:
+                decoded = base64.b64decode(credentials).decode("utf-8")
+            except ValueError:
+                decoded = ""
+            supplied = decoded.partition(":")[2]
+
+    if not hmac.compare_digest(supplied.encode(), expected.encode()):
+        raise WebhookUnauthorized("Invalid webhook token")
+
+
+def _attributes(event: dict) -> dict:
+    if isinstance(event.get("attributes"), dict):
+        return event["attributes"]
+    # contact_updated sends the changed fields as a list of single-key dicts.
+    attributes = {}
+    for item in event.get("content") or []:
+        if isinstance(item, dict):
+            attributes.update(item)
+    return attributes
+
+
+def _list_ids(value) -> list[int]:
+    # A bad id is skipped, not failed: Brevo redelivers a batch that got an
+    # error, the good events in it included.
+    values = value if isinstance(value, list) else [value]
+    list_ids = []
+    for item in values:
+        if isinstance(item, int) and not isinstance(item, bool):
+            list_ids.append(item)
+        elif isinstance(item, str) and item.strip().isdigit():
+            list_ids.append(int(item))
+        elif item is not None:
+            logging.warning(f"Skipping invalid list_id in webhook event: {item!r}")
+    return list_ids
+
+
+def contact_change(event: dict) -> dict | None:
+    email = (event.get("email") or "").strip().lower()
+    name = event.get("event")
+    if not email or not name:
+        return None
+
+    if name in BLACKLISTING_EVENTS:
+        return {"email": email, "emailBlacklisted": True}
+    if name == "list_addition":
+        list_ids = _list_ids(event.get("list_id"))
+        if not list_ids:
+            return None
+        return {"email": email, "add_list_ids": list_ids}
+    if name == "contact_updated":
+        return {"email": email, "attributes": _attributes(event)}
+    if name == "contact_deleted":
+        return {"email": email, "deleted": True}
+    return None
+
+
+def handle_webhook(payload) -> dict:
+    # Brevo posts one event per request; batched deliveries come as a list.
+    events = payload if isinstance(payload, list) else [payload]
+    changes = []
+    ignored = 0
+    for event in events:
+        if not isinstance(event, dict):
+            event = {}
+        change = contact_change(event)
+        outcome = "ignored" if change is None else "applied"
+        metrics.WEBHOOK_EVENTS.inc(event.get("event") or "unknown", outcome)
+        if change is None:
+            ignored += 1
+        else:
+            changes.append(change)
+
+    applied = record_contact_changes(changes)
+    if changes and not applied:
+        logging.info(
+            f"No contact snapshot yet; {len(changes)} webhook change(s) not recorded"
+        )
+    return {"applied": applied, "ignored": ignored}
@@ -71,12 +71,12 @@ case "$1" in
         fi
         
         echo "📡 Starting API service on port $API_PORT..."
-        nohup uvicorn $API_SERVICE --host 0.0.0.0 --port $API_PORT --reload > api_service.log 2>&1 &
+        nohup uvicorn $API_SERVICE --host 0.0.0.0 --port $API_PORT --reload >> api_service.log 2>&1 &
         API_PID=$!
         echo $API_PID > api_service.pid
         
         echo "⚙️  Starting background service..."
-        nohup python -m $BACKGROUND_SERVICE > background_service.log 2>&1 &
+        nohup python -m $BACKGROUND_SERVICE >> background_service.log 2>&1 &
         BG_PID=$!
         echo $BG_PID > background_service.pid
         
@@ -142,12 +142,12 @@ case "$1" in
         
         # Start services
         echo "📡 Starting API service on port $API_PORT..."
-        nohup uvicorn $API_SERVICE --host 0.0.0.0 --port $API_PORT --reload > api_service.log 2>&1 &
+        nohup uvicorn $API_SERVICE --host 0.0.0.0 --port $API_PORT --reload >> api_service.log 2>&1 &
         API_PID=$!
         echo $API_PID > api_service.pid
         
         echo "⚙️  Starting background service..."
-        nohup python -m $BACKGROUND_SERVICE > background_service.log 2>&1 &
+        nohup python -m $BACKGROUND_SERVICE >> background_service.log 2>&1 &
         BG_PID=$!
         echo $BG_PID > background_service.pid
         
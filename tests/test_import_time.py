@@ -0,0 +1,24 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from brevo.import_check import BUDGETS_MS, import_side_effects, import_time_ms
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+@pytest.mark.parametrize("module", sorted(BUDGETS_MS))
+def test_import_time_within_budget(module):
+    # Best of three, so a cold disk cache does not fail the test.
+    elapsed = min(import_time_ms(module, ROOT) for _ in range(3))
+    budget = BUDGETS_MS[module] * float(os.getenv("IMPORT_BUDGET_SCALE", "1"))
+    assert elapsed <= budget, f"import {module} took {elapsed:.0f} ms"
+
+
+@pytest.mark.parametrize(
+    "module",
+    sorted(BUDGETS_MS) + ["brevo.backfill", "brevo.sharding"],
+)
+def test_import_has_no_side_effects(module):
+    assert import_side_effects(module, ROOT) == ""